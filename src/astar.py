@@ -1,50 +1,71 @@
-import psycopg2
-import shapely.wkb
 from shapely.geometry import LineString
 from shapely.ops import linemerge
-import datetime
+import argparse
 import time
+import signal
+import checkpoint
+import ingest
+import kernels
+import session
+import database
+import geometry
+import metrics
+import heuristics
+import results
+from search import UNIDIRECTIONAL
+from heuristics import PLANAR, METRICS
+
+connect_to_database = database.connect_to_database  # Re-exported for the tests
+haversine_distance = heuristics.haversine_distance
 
 INFINITY = float("inf")
+TIMEOUT = 3600
 
 
-def find_shortest_route(source, destinations):
+def find_shortest_route(source, destinations, metric=PLANAR, mode=UNIDIRECTIONAL, snaps=None):
     '''
     Finds the shortest route between a source node and a destination node
     :param source: node to start at
     :param destination: node to finish at
+    :param metric: heuristic metric, PLANAR, HAVERSINE or ALT (needs built landmarks)
+    :param mode: UNIDIRECTIONAL or BIDIRECTIONAL search
+    :param snaps: spatial.Snap of the nodes when they were found from coordinates, kept in the query metrics
     :return: a string contai
     ning the shortest path in the network from source to destination
     '''
-    id = datetime.datetime.now().strftime("%I%M%S%p%B%d%Y") #Use current exact time as ID
-    start = time.time()
-    destinations_left = destinations[:]
-    shortest_routes = []
-    nodes_assessed = 0
-    for destination in destinations_left:
-        graph = init_graph()
-        costs = init_costs(graph)
-        parents = init_parents(graph)
-        processed_nodes = []
-        # Init the source node distance to itself as 0
-        costs[source] = 0
-        parents[source] = source
-        current_node = get_min_node(costs, processed_nodes, destination)
-
-        while current_node is not None:
-            cost_to_current_node = costs[current_node]  # Current cost to this node
-            neighbors = graph[current_node]  # Get neighbors of current node
-            relax_neighbors(cost_to_current_node, costs, current_node, neighbors, parents, destination)  # Relax neighboring nodes
-            processed_nodes.append(current_node)  # Add current node to processed nodes
-            if current_node == destination:
-                break
-            current_node = get_min_node(costs, processed_nodes, destination)  # Get next node with shortest distance
-            nodes_assessed = nodes_assessed + 1
-        destinations_left.remove(destination)
-        shortest_routes.append(display_shortest_route(parents, source, destination))
-    end = time.time()
-    total_time = end - start
-    return generate_results_to_database(shortest_routes, total_time, id, source, destinations, nodes_assessed)
+    id = results.run_id()  # Same UUID for every route of this run
+    query_metrics = metrics.start('astar', source, destinations)
+    if query_metrics is not None and snaps:
+        query_metrics.add_snaps(snaps)
+    with metrics.profiled('astar'):
+        with metrics.phase(query_metrics, metrics.GRAPH_LOAD):
+            routing_session = session.get_session()
+        start = time.time()
+        result = routing_session.astar(source, destinations, metric, mode, query_metrics)
+        shortest_routes = []
+        for destination in destinations:
+            shortest_routes.append(display_shortest_route(result.parents, source, destination, query_metrics))
+        end = time.time()
+        total_time = end - start
+        route = generate_results_to_database(shortest_routes, total_time, id, source, destinations,
+                                             result.nodes_assessed, query_metrics)
+    if query_metrics is not None:
+        query_metrics.emit()
+    return route
+
+
+def find_shortest_route_by_coordinates(source_point, destination_points, metric=PLANAR, mode=UNIDIRECTIONAL):
+    '''
+    Finds the shortest routes between coordinates, each snapped to its
+    nearest routable vertex with the session's spatial index
+    :param source_point: (lon, lat) to start at
+    :param destination_points: list of (lon, lat) to finish at
+    :param metric: heuristic metric, PLANAR, HAVERSINE or ALT (needs built landmarks)
+    :param mode: UNIDIRECTIONAL or BIDIRECTIONAL search
+    :return: same as find_shortest_route
+    '''
+    snaps = session.get_session().snap([source_point] + list(destination_points))
+    return find_shortest_route(snaps[0].osm_id, [snap.osm_id for snap in snaps[1:]], metric, mode, snaps)
 
 
 def init_graph():
@@ -54,46 +75,17 @@ def init_graph():
     :return: graph
     '''
     graph = {}
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT osm_id FROM ways_vertices_pgr')
-    row = cur.fetchone()
-    while row:
-        graph[float(row[0])] = {}
-        row = cur.fetchone()
-
-    cur.execute('SELECT source_osm, target_osm, length FROM ways')
-    row = cur.fetchone()
-    while row:
-        c1 = float(row[0])
-        c2 = float(row[1])
-        # print "c1: " + str(c1)
-        # print "c2: " + str(c2)
-        graph[c1][c2] = float(row[2])
-        graph[c2][c1] = float(row[2])
-        row = cur.fetchone()
-
-    return graph
-
+    with database.connection() as conn:
+        for row in ingest.iter_rows(conn, 'SELECT osm_id FROM ways_vertices_pgr'):
+            graph[float(row[0])] = {}
 
-def connect_to_database():
-    '''
-    Establishes connection with database.
-    :return: conn
-    '''
-    # Read password in from config
-    with open("../sensitive.config") as f:
-        content = f.readlines()
-    password = [x.strip() for x in content]
+        for row in ingest.iter_rows(conn, 'SELECT source_osm, target_osm, length FROM ways'):
+            c1 = float(row[0])
+            c2 = float(row[1])
+            graph[c1][c2] = float(row[2])
+            graph[c2][c1] = float(row[2])
 
-    # Establish connection
-    try:
-        conn = psycopg2.connect(
-            "dbname='denver' user='postgres' host='localhost' password='" + password.__getitem__(0) + "'")
-        return conn
-    except:
-        print "I am unable to connect to the database"
-        print "dbname='denver' user='postgres' host='localhost' password='" + password.__getitem__(0) + "'"
+    return graph
 
 
 def init_costs(graph):
@@ -124,148 +116,135 @@ def init_parents(graph):
     return parents
 
 
-def distance_to_destination(source, destination):
+def init_coordinates():
+    '''
+    Loads the lon and lat of every vertex in
+    ways_vertices_pgr so the heuristic can be
+    computed without going back to the database.
+    :return: coordinates, a dict of osm_id -> (lon, lat)
+    '''
+    coordinates = {}
+    with database.connection() as conn:
+        for row in ingest.iter_rows(conn, 'SELECT osm_id, lon, lat FROM ways_vertices_pgr'):
+            coordinates[float(row[0])] = (float(row[1]), float(row[2]))
+    return coordinates
+
+
+def distance_to_destination(source, destination, coordinates=None, metric=PLANAR):
     '''
     Gives the heuristic distance from
     a node to the destination node.
 
-    Extracts the lon and lat coordinates from hte point in the ways db
-    given the id of the source and destination points. Using PostGIS built
-    in ST_Distance, it gets the euclidean distance in meters from the source to destination.
+    Looks up the lon and lat coordinates of the source and destination
+    in the in-memory coordinates table, or in the shared session's graph
+    when no table is given, and measures the distance between them in
+    process, so no database round trip is made per call.
+    :param coordinates: table from init_coordinates, the session graph's coordinates if not given
+    :param metric: PLANAR (degrees, matches ST_Distance) or HAVERSINE (great circle degrees)
     :return: distance to destination node heuristic
     '''
-
-    source = int(source)
-    destination = int(destination)
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT lon, lat FROM ways_vertices_pgr WHERE osm_id =' + str(source))
-    source_coords = cur.fetchone()
-    cur.execute('SELECT lon, lat FROM ways_vertices_pgr WHERE osm_id =' + str(destination))
-    destination_coords = cur.fetchone()
-
-    cur.execute("SELECT ST_Distance(ST_GeomFromText('POINT(" + str(source_coords[0]) + " " + str(
-        source_coords[1]) + ")', 4326),ST_GeomFromText('POINT(" + str(destination_coords[0]) + " " + str(
-        destination_coords[1]) + ")', 4326))")
-    distance = cur.fetchone()
-
-    return float(distance[0])
+    if coordinates is None:
+        graph = session.get_session().graph
+        return METRICS[metric](graph.coordinates_of(graph.index_of(source)),
+                               graph.coordinates_of(graph.index_of(destination)))
+    return METRICS[metric](coordinates[float(source)], coordinates[float(destination)])
 
 
-def get_min_node(costs, processed_nodes, destination):
+def make_heuristic(coordinates, destination, metric=PLANAR):
     '''
-    Returns the min node so far from costs
-    :param costs:
-    :param processed_nodes:
-    :return: min_node
+    Builds the heuristic function for one query. Distances to the
+    fixed destination are memoized, since a node is usually relaxed
+    from several of its neighbors.
+    :param coordinates: table from init_coordinates
+    :param destination: destination node of the query
+    :param metric: PLANAR or HAVERSINE
+    :return: function of a node giving its distance to destination
     '''
-    min_node_cost = INFINITY  # Set current min to inf
-    min_node = None  # Set current node to null
-    destination = float(destination)
-    for node in costs:  # For every node in costs
-        # print "min_node_cost:   " + str(min_node_cost)
-        if costs[node] < min_node_cost and node not in processed_nodes:
-            # New current min node
-            min_node_cost = costs[node]
-            min_node = node
-    return min_node
-
-
-def relax_neighbors(cost_to_current_node, costs, current_node, neighbors, parents, destination):
-    '''
-    Relaxing neighbors is the process of checking each neighbor of a node and updating
-    our shortest costs if this new route is shorter.
-    :param cost_to_current_node:
-    :param costs:
-    :param current_node:
-    :param neighbors:
-    :param parents:
-    :return:
-    '''
-    for neighbor in neighbors:  # For each neighbor...
-        new_distance_to_neighbor = cost_to_current_node + (neighbors[neighbor] + distance_to_destination(neighbor, destination)) # Get the new distance to this neighbor
-        current_distance_to_neighbor = costs[neighbor]  # Get the current distance to this neighbor
-        # If it is cheaper to go this way to this neighbor then add that as the shortest cost from the source
-        if new_distance_to_neighbor < current_distance_to_neighbor:
-            costs[neighbor] = new_distance_to_neighbor
-            parents[neighbor] = current_node
-            # We have now relaxed all of the current nodes neighbors
+    distance = METRICS[metric]
+    destination_coords = coordinates[float(destination)]
+    memo = {}
+
+    def heuristic(node):
+        value = memo.get(node)
+        if value is None:
+            value = distance(coordinates[node], destination_coords)
+            memo[node] = value
+        return value
+    return heuristic
 
 
-def display_shortest_route(parents, source, destination):
+def display_shortest_route(parents, source, destination, query_metrics=None):
     '''
     Creates a shortest route string in easy to read
     language.
     :param parents: parent nodes
     :param source:  source node
     :param destinations: destination node
+    :param query_metrics: optional metrics.QueryMetrics
     :return: a string with the shortest path from source to destination
     '''
-    shortest_routes = []
     points_of_line = []
-    points_of_line.append(destination)
-    current_node = parents[destination]
-    while current_node is not source:
-        points_of_line.append(current_node)
-        current_node = parents[current_node]
-        shortest_routes.append(points_of_line)
-    return create_shortest_route_geom(points_of_line)
-
-
-def generate_results_to_database(shortest_route_geoms, total_time, id, source, destinations, nodes_assessed):
+    with metrics.phase(query_metrics, metrics.PATH_RECONSTRUCTION):
+        points_of_line.append(destination)
+        current_node = parents[destination]
+        while current_node != source:
+            points_of_line.append(current_node)
+            current_node = parents[current_node]
+        if destination != source:
+            points_of_line.append(source)
+    return create_shortest_route_geom(points_of_line, query_metrics)
+
+
+def generate_results_to_database(shortest_route_geoms, total_time, id, source, destinations, nodes_assessed,
+                                 query_metrics=None):
     '''
-    Takes all the geoms generated from A* with the respetive info and stores into
-    the results table on the database.
+    Takes all the geoms generated from A* with the respetive info and queues them
+    for the results table on the database, written in batches by results.
     :param shortest_route_geoms: array of all the shortest route geoms for the experiment
     :param total_time: total time to run
     :param id: id of the route
     :param source: source of the route
     :param destinations: destination(s) of the route
     :param nodes_assessed: number of nodes that were assessed for the route
+    :param query_metrics: optional metrics.QueryMetrics
     :return: the items that were imported to database
     '''
-    conn = connect_to_database()
-    cur = conn.cursor()
     index_of_shortest_geom = 0
     shortest_length = 0
     for index, route_geom in enumerate(shortest_route_geoms):
         if route_geom.length <= shortest_length:
             index_of_shortest_geom = index
     hex_shortest_route_geom = LineString(shortest_route_geoms[index_of_shortest_geom]).wkb_hex
-    insert_query = """INSERT INTO public.results_astar_one_to_one(the_geom, total_time, id, nodes_assessed, source, destinations) VALUES (st_geomfromwkb(%(geom)s::geometry, 4326), %(total_time)s, %(id)s, %(nodes_assessed)s, %(source)s, %(destinations)s)"""
-    cur.execute(insert_query, {'geom': hex_shortest_route_geom, 'total_time': total_time, 'id': id, 'nodes_assessed': nodes_assessed, 'source': source, 'destinations': destinations})
-    conn.commit()
+    writer = results.get_writer(results.ASTAR)
+    flushes = writer.flushes
+    with metrics.phase(query_metrics, metrics.DB_WRITE):
+        writer.add(hex_shortest_route_geom, total_time, id, nodes_assessed, source, destinations)
+    if query_metrics is not None:
+        query_metrics.count('db_round_trips', writer.flushes - flushes)
     return shortest_route_geoms[index_of_shortest_geom], total_time, id, source, destinations, nodes_assessed
 
-def create_shortest_route_geom(route):
+def create_shortest_route_geom(route, query_metrics=None):
     '''
     Exports the shortest route as a GIS geom to display in QGIS, along with time and id for analysis purposes
     :param shortest_routes:
     :param total_time:
     :param id:
+    :param query_metrics: optional metrics.QueryMetrics
     :return:
     '''
-    conn = connect_to_database()
-    cur = conn.cursor()
-    lines = []
-    total_geom = None
-    for index, node in enumerate(route):
-        try:
-            source = str(int(node))
-            target = str(int(route[index + 1]))
-            query = 'SELECT the_geom FROM public.ways WHERE target_osm = ' + target + ' AND source_osm = ' + source + ' OR target_osm = ' + source + ' AND source_osm = ' + target + ';'
-            cur.execute(query)
-            hex_geom = cur.fetchone()
-            geom = shapely.wkb.loads(hex_geom[0], hex=True)
-            lines.append(geom)
-        except IndexError:
-            print "Last element"
-        total_geom = linemerge(lines)
-    return total_geom
+    with metrics.phase(query_metrics, metrics.GEOMETRY_FETCH), database.connection() as conn:
+        cur = conn.cursor()
+        return linemerge(geometry.route_lines(route, cur, query_metrics))
 
-import signal
 
-def run_experiment(sources_dataset, destinations_dataset):
+def run_experiment(pairs, progress=None, timeout=TIMEOUT):
+    '''
+    Routes the pairs one after the other, each from its larger osm_id.
+    :param pairs: iterable of (source, destination), e.g. checkpoint.read_pairs(path)
+    :param progress: optional checkpoint.Checkpoint, its answered pairs are skipped and new answers recorded
+    :param timeout: seconds after which a pair is given up
+    :return: number of pairs routed
+    '''
     print ("Start")
     class TimeoutException(Exception):  # Custom exception class
         pass
@@ -275,34 +254,46 @@ def run_experiment(sources_dataset, destinations_dataset):
 
     signal.signal(signal.SIGALRM, timeout_handler)
 
-    for index, source in enumerate(sources_dataset):
-        d = destinations_dataset[index]
-        s = sources_dataset[index]
-        signal.alarm(3600)
+    if progress is not None:
+        pending = progress.pending(pairs)
+    else:
+        pending = ((index, s, d) for index, (s, d) in enumerate(pairs))
+    count = 0
+    for index, s, d in pending:
+        count = count + 1
+        signal.alarm(timeout)
         try:
             try:
-                if destinations_dataset[index] > sources_dataset[index]:
-                    print(find_shortest_route(destinations_dataset[index], [sources_dataset[index]]))
+                if d > s:
+                    print(find_shortest_route(d, [s]))
                 else:
-                    print(find_shortest_route(sources_dataset[index], [destinations_dataset[index]]))
+                    print(find_shortest_route(s, [d]))
+                status = checkpoint.DONE
             except KeyError:
                 print str(d) + " " + str(s) + " have Key Errors!!!!"
+                status = checkpoint.MISSING
+            signal.alarm(0)
         except TimeoutException:
-            print str(d) + " " + str(s) + " took over 60 minutes"
-
+            print str(d) + " " + str(s) + " took over %d seconds" % timeout
+            results.flush_all()
+            status = checkpoint.TIMED_OUT
+        if progress is not None:
+            progress.record(index, status)
+
+    results.close_all()
+    print "Total rows is %d" % count
     print("DONE!")
-
-sources_dataset = []
-destinations_dataset = []
-
-import csv
-count = 0
-with open('denverpoints.csv', 'rb') as f:
-    reader = csv.reader(f)
-    for row in reader:
-        count = count + 1
-        sources_dataset.append(float(row[0]))
-        destinations_dataset.append(float(row[1]))
-print "Total rows is %d" % count
-
-run_experiment(sources_dataset, destinations_dataset)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Route every pair of an experiment file with A* search.")
+    checkpoint.add_arguments(parser)
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help='seconds per pair')
+    parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None, help='search kernels, see kernels.py')
+    arguments = parser.parse_args()
+    metrics.configure_from_environment()
+    if arguments.kernels:
+        kernels.set_backend(arguments.kernels)
+    with checkpoint.from_arguments(arguments, results.ASTAR) as progress:
+        run_experiment(checkpoint.read_pairs(arguments.pairs), progress, arguments.timeout)
@@ -0,0 +1,510 @@
+'''
+Benchmark suite that runs without the denver database.
+
+A graph source builds the CompactGraph: a synthetic grid or random
+geometric graph of any size, an SQLite file with the ways and
+ways_vertices_pgr columns the real graph is read from, or a snapshot.
+Every search method then answers the same seeded random queries, and
+latency percentiles, nodes assessed, load time and peak RSS are written
+as JSON so two commits can be compared. Short local trips are also timed
+with the reused search workspace and with per query search arrays, and
+random coordinates are snapped to vertices one by one and in bulk.
+The kernels command times A* with the python and the numpy heuristic on
+trips of increasing length.
+
+Usage:
+    python benchmark.py run [--source grid|geometric|sqlite|snapshot] [--nodes N] [--path P]
+                            [--queries Q] [--seed S] [--preprocess] [--local-hops H] [--snap-points P]
+                            [--output result.json]
+    python benchmark.py kernels [--source grid|geometric|sqlite|snapshot] [--nodes N] [--queries Q]
+                                [--hops H [H ...]] [--output result.json]
+    python benchmark.py fixture path.sqlite [--source grid|geometric] [--nodes N]
+    python benchmark.py compare old.json new.json
+'''
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+import compact_graph
+import contraction
+import heuristics
+import ingest
+import kernels
+import landmarks
+import search
+import session
+import snapshot
+import spatial
+
+GRID = 'grid'
+GEOMETRIC = 'geometric'
+SQLITE = 'sqlite'
+SNAPSHOT = 'snapshot'
+SPACING = 0.0001  # Degrees between grid neighbors, about 10 m
+ORIGIN = (-105.1, 39.6)
+QUERIES = 100
+SEED = 0
+PERCENTILES = (50, 95, 99)
+LOCAL_HOPS = 20
+SNAP_POINTS = 1000
+KERNEL_HOPS = (5, 20, 80, 320)  # Trip lengths the search kernels are compared on
+
+
+def grid_graph(nodes, seed=SEED):
+    '''
+    Square grid with 4-neighbor streets, each a little longer than the
+    straight line so the planar heuristic stays a lower bound.
+    :param nodes: approximate number of vertices
+    :param seed: seed for the edge lengths
+    :return: CompactGraph
+    '''
+    rng = random.Random(seed)
+    side = max(2, int(round(math.sqrt(nodes))))
+    vertex_ids = xrange(side * side)
+    lons = [ORIGIN[0] + (v % side) * SPACING for v in vertex_ids]
+    lats = [ORIGIN[1] + (v // side) * SPACING for v in vertex_ids]
+
+    def edges():
+        for v in vertex_ids:
+            if v % side != side - 1:
+                yield v, v + 1, SPACING * (1 + rng.random() * 0.5)
+            if v + side < side * side:
+                yield v, v + side, SPACING * (1 + rng.random() * 0.5)
+    return compact_graph.build_compact_graph(vertex_ids, edges(), lons, lats)
+
+
+def geometric_graph(nodes, seed=SEED, degree=6):
+    '''
+    Random geometric graph: points spread uniformly over a square, each
+    joined to the others within the radius that gives about degree
+    neighbors on average.
+    :param nodes: number of vertices
+    :param seed: seed for the points and edge lengths
+    :param degree: expected number of neighbors
+    :return: CompactGraph
+    '''
+    rng = random.Random(seed)
+    extent = math.sqrt(nodes) * SPACING
+    radius = extent * math.sqrt(degree / (math.pi * nodes))
+    lons = [ORIGIN[0] + rng.random() * extent for v in xrange(nodes)]
+    lats = [ORIGIN[1] + rng.random() * extent for v in xrange(nodes)]
+    cells = {}
+    for v in xrange(nodes):
+        cells.setdefault((int((lons[v] - ORIGIN[0]) / radius), int((lats[v] - ORIGIN[1]) / radius)), []).append(v)
+
+    def edges():
+        for (x, y), members in cells.iteritems():
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for u in cells.get((x + dx, y + dy), ()):
+                        for v in members:
+                            if v < u:
+                                straight = math.hypot(lons[u] - lons[v], lats[u] - lats[v])
+                                if straight <= radius:
+                                    yield v, u, straight * (1 + rng.random() * 0.2)
+    return compact_graph.build_compact_graph(xrange(nodes), edges(), lons, lats)
+
+
+def write_sqlite_fixture(graph, path):
+    '''
+    Writes a graph as ways_vertices_pgr and ways tables, the columns
+    ingest reads from PostGIS, into an SQLite file.
+    :param graph: CompactGraph with coordinates
+    :param path: SQLite file to create
+    :return: path
+    '''
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('DROP TABLE IF EXISTS ways_vertices_pgr')
+        conn.execute('DROP TABLE IF EXISTS ways')
+        conn.execute('CREATE TABLE ways_vertices_pgr (osm_id INTEGER PRIMARY KEY, lon REAL, lat REAL)')
+        conn.execute('CREATE TABLE ways (source_osm INTEGER, target_osm INTEGER, length REAL)')
+        conn.executemany('INSERT INTO ways_vertices_pgr VALUES (?, ?, ?)',
+                         ((int(graph.ids[v]), graph.lons[v], graph.lats[v]) for v in xrange(len(graph))))
+        conn.executemany('INSERT INTO ways VALUES (?, ?, ?)',
+                         ((int(graph.ids[v]), int(graph.ids[u]), weight)
+                          for v in xrange(len(graph)) for u, weight in graph.neighbors(v) if v < u))
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+def sqlite_graph(path):
+    '''
+    :param path: SQLite file with ways_vertices_pgr and ways tables
+    :return: CompactGraph
+    '''
+    conn = sqlite3.connect(path)
+    try:
+        vertex_ids = []
+        lons = []
+        lats = []
+        for osm_id, lon, lat in conn.execute(ingest.VERTEX_QUERY):
+            vertex_ids.append(osm_id)
+            lons.append(lon)
+            lats.append(lat)
+        return compact_graph.build_compact_graph(vertex_ids, conn.execute(ingest.EDGE_QUERY), lons, lats)
+    finally:
+        conn.close()
+
+
+def load_graph(source, nodes=10000, path=None, seed=SEED):
+    '''
+    :param source: GRID, GEOMETRIC, SQLITE or SNAPSHOT
+    :param nodes: size of a synthetic graph
+    :param path: file of an SQLITE or SNAPSHOT source
+    :return: CompactGraph
+    '''
+    if source == GRID:
+        return grid_graph(nodes, seed)
+    if source == GEOMETRIC:
+        return geometric_graph(nodes, seed)
+    if source == SQLITE:
+        return sqlite_graph(path)
+    if source == SNAPSHOT:
+        return snapshot.load_snapshot(path or snapshot.SNAPSHOT_PATH)
+    raise ValueError("Unknown graph source %s" % source)
+
+
+def query_pairs(graph, queries=QUERIES, seed=SEED):
+    '''
+    :return: list of seeded random (source, target) osm_id pairs
+    '''
+    rng = random.Random(seed)
+    return [(graph.ids[rng.randrange(len(graph))], graph.ids[rng.randrange(len(graph))]) for query in xrange(queries)]
+
+
+def local_pairs(graph, queries=QUERIES, hops=LOCAL_HOPS, seed=SEED):
+    '''
+    Short trips: each target is a random walk of hops edges from its source.
+    :return: list of seeded (source, target) osm_id pairs
+    '''
+    rng = random.Random(seed)
+    pairs = []
+    for query in xrange(queries):
+        source = node = rng.randrange(len(graph))
+        for hop in xrange(hops):
+            start = graph.offsets[node]
+            end = graph.offsets[node + 1]
+            if start == end:
+                break
+            node = graph.targets[rng.randrange(start, end)]
+        pairs.append((graph.ids[source], graph.ids[node]))
+    return pairs
+
+
+def time_queries(method, pairs):
+    '''
+    :param method: function of source and target giving a SearchResult
+    :param pairs: list of (source, target)
+    :return: summarize of the latencies and nodes assessed
+    '''
+    latencies = []
+    nodes_assessed = []
+    for source_id, target_id in pairs:
+        query_start = time.time()
+        result = method(source_id, target_id)
+        latencies.append(time.time() - query_start)
+        nodes_assessed.append(result.nodes_assessed)
+    return summarize(latencies, nodes_assessed)
+
+
+def local_trips(routing_session, pairs):
+    '''
+    Times short trips with the session's reused search workspace and with
+    search arrays allocated per query, the difference being the reset cost.
+    :return: dict of method name -> summary
+    '''
+    report = {}
+    for name, method in (('dijkstra', lambda s, t: routing_session.dijkstra(s, [t])),
+                         ('astar', lambda s, t: routing_session.astar(s, [t]))):
+        for reuse in (True, False):
+            routing_session.reuse_workspace = reuse
+            report[name + ('-workspace' if reuse else '-allocated')] = time_queries(method, pairs)
+    routing_session.reuse_workspace = True
+    return report
+
+
+def snap_points(graph, count=SNAP_POINTS, seed=SEED):
+    '''
+    :return: list of seeded random (lon, lat) inside the bounding box of graph
+    '''
+    rng = random.Random(seed)
+    min_lon, max_lon = min(graph.lons), max(graph.lons)
+    min_lat, max_lat = min(graph.lats), max(graph.lats)
+    return [(rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)) for point in xrange(count)]
+
+
+def snap_trips(graph, points):
+    '''
+    Builds the spatial index, then snaps the points one at a time and all
+    of them in one bulk call.
+    :return: dict of the build time, single snap latency percentiles, bulk
+             microseconds per point and snap distance percentiles in meters
+    '''
+    start = time.time()
+    index = spatial.build_index(graph)
+    report = {'points': len(points), 'build_seconds': time.time() - start}
+    latencies = []
+    meters = []
+    for lon, lat in points:
+        start = time.time()
+        snap = index.snap(lon, lat)
+        latencies.append(time.time() - start)
+        meters.append(snap.meters)
+    start = time.time()
+    index.nearest_many([lon for lon, lat in points], [lat for lon, lat in points])
+    bulk = time.time() - start
+    latencies.sort()
+    meters.sort()
+    for p in PERCENTILES:
+        report['single_p%d_ms' % p] = percentile(latencies, p) * 1000
+        report['meters_p%d' % p] = percentile(meters, p)
+    report['single_us_per_point'] = sum(latencies) / len(points) * 1e6
+    report['bulk_us_per_point'] = bulk / len(points) * 1e6
+    report['meters_max'] = meters[-1]
+    return report
+
+
+def kernel_trips(routing_session, pairs):
+    '''
+    Times A* on the same trips with the python and the numpy kernels.
+    The heuristic table is also timed alone, as the overhead the numpy
+    A* pays on every query before its first relaxation.
+    :return: dict of astar-backend -> summary, the heuristic table
+             milliseconds and the p50 speedup of the numpy kernels
+    '''
+    graph = routing_session.graph
+    backend = kernels.get_backend()
+    report = {}
+    try:
+        for name in kernels.BACKENDS:
+            kernels.set_backend(name)
+            report['astar-' + name] = time_queries(lambda s, t: routing_session.astar(s, [t]), pairs)
+    finally:
+        kernels.set_backend(backend)
+    start = time.time()
+    for source_id, target_id in pairs:
+        kernels.heuristic_table(graph, graph.index_of(target_id))
+    report['heuristic_table_ms'] = (time.time() - start) / len(pairs) * 1000
+    python = report['astar-' + kernels.PYTHON]['p50_ms']
+    vectorized = report['astar-' + kernels.NUMPY]['p50_ms']
+    report['astar_speedup_p50'] = python / vectorized if vectorized else None
+    return report
+
+
+def kernel_lengths(graph, hops=KERNEL_HOPS, queries=QUERIES, seed=SEED, verbose=True):
+    '''
+    Compares the A* kernels on local trips of each length and on random pairs.
+    :param hops: random walk lengths of the local trips
+    :return: dict of trip length, or 'random', -> kernel_trips report
+    '''
+    routing_session = session.RoutingSession(graph)
+    trips = [(str(length), local_pairs(graph, queries, length, seed)) for length in hops]
+    trips.append(('random', query_pairs(graph, queries, seed)))
+    report = {}
+    for length, pairs in trips:
+        report[length] = kernel_trips(routing_session, pairs)
+        if verbose:
+            lengths = report[length]
+            print >> sys.stderr, "%-7s table %6.2f ms  astar p50 %8.2f -> %8.2f ms %5.2fx  %10.1f nodes" % (
+                length, lengths['heuristic_table_ms'], lengths['astar-python']['p50_ms'],
+                lengths['astar-numpy']['p50_ms'], lengths['astar_speedup_p50'],
+                lengths['astar-python']['nodes_assessed_mean'])
+    return report
+
+
+def methods(routing_session):
+    '''
+    Every search the session can run, by name.
+    :return: list of (name, function of source and target giving a SearchResult)
+    '''
+    found = [
+        ('dijkstra', lambda s, t: routing_session.dijkstra(s, [t])),
+        ('dijkstra-bidirectional', lambda s, t: routing_session.dijkstra(s, [t], search.BIDIRECTIONAL)),
+        ('astar', lambda s, t: routing_session.astar(s, [t])),
+        ('astar-bidirectional', lambda s, t: routing_session.astar(s, [t], mode=search.BIDIRECTIONAL)),
+    ]
+    if routing_session.landmarks is not None:
+        found.append(('astar-alt', lambda s, t: routing_session.astar(s, [t], heuristics.ALT)))
+        found.append(('astar-alt-bidirectional',
+                      lambda s, t: routing_session.astar(s, [t], heuristics.ALT, search.BIDIRECTIONAL)))
+    if routing_session.hierarchy is not None:
+        found.append(('contraction', lambda s, t: routing_session.dijkstra(s, [t], search.CONTRACTION)))
+    return found
+
+
+def percentile(values, p):
+    '''
+    Nearest rank percentile.
+    :param values: sorted list
+    :param p: percentile, 0 to 100
+    '''
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+def summarize(latencies, nodes_assessed):
+    '''
+    :param latencies: seconds per query
+    :param nodes_assessed: nodes assessed per query
+    :return: dict of latency percentiles in milliseconds and node counts
+    '''
+    latencies = sorted(latencies)
+    summary = dict(('p%d_ms' % p, percentile(latencies, p) * 1000) for p in PERCENTILES)
+    summary['mean_ms'] = sum(latencies) / len(latencies) * 1000
+    summary['max_ms'] = latencies[-1] * 1000
+    summary['nodes_assessed_total'] = sum(nodes_assessed)
+    summary['nodes_assessed_mean'] = float(sum(nodes_assessed)) / len(nodes_assessed)
+    return summary
+
+
+def peak_rss_mb():
+    '''
+    :return: peak resident set size of this process so far, in MB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def git_commit():
+    '''
+    :return: the checked out commit, or None outside a git work tree
+    '''
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def run_benchmark(source=GRID, nodes=10000, path=None, queries=QUERIES, seed=SEED, preprocess=False,
+                  verbose=True, local_hops=LOCAL_HOPS, snap_count=SNAP_POINTS):
+    '''
+    Loads a graph and times every search method on the same queries.
+    :param source: GRID, GEOMETRIC, SQLITE or SNAPSHOT
+    :param nodes: size of a synthetic graph
+    :param path: file of an SQLITE or SNAPSHOT source
+    :param queries: number of queries per method
+    :param seed: seed of the graph and the queries
+    :param preprocess: also build landmarks and a contraction hierarchy and time their queries
+    :param verbose: print a line per method
+    :param local_hops: length of the short trips timed with and without workspace reuse, 0 to skip them
+    :param snap_count: random coordinates snapped to vertices, 0 to skip snapping
+    :return: JSON serializable dict
+    '''
+    start = time.time()
+    graph = load_graph(source, nodes, path, seed)
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'source': source,
+        'path': path,
+        'seed': seed,
+        'queries': queries,
+        'nodes': len(graph),
+        'edges': graph.edge_count(),
+        'load_seconds': time.time() - start,
+        'preprocessing_seconds': {},
+        'methods': {},
+    }
+    routing_session = session.RoutingSession(graph)
+    if preprocess:
+        start = time.time()
+        routing_session.landmarks = landmarks.select_landmarks(graph, verbose=False)
+        report['preprocessing_seconds']['landmarks'] = time.time() - start
+        start = time.time()
+        routing_session.hierarchy = contraction.build_hierarchy(graph, verbose=False)
+        report['preprocessing_seconds']['contraction'] = time.time() - start
+    pairs = query_pairs(graph, queries, seed)
+    for name, method in methods(routing_session):
+        report['methods'][name] = time_queries(method, pairs)
+        if verbose:
+            print_summary(name, report['methods'][name])
+    if local_hops:
+        report['local_hops'] = local_hops
+        report['local'] = local_trips(routing_session, local_pairs(graph, queries, local_hops, seed))
+        if verbose:
+            for name in sorted(report['local']):
+                print_summary('local ' + name, report['local'][name])
+    if snap_count:
+        report['snap'] = snap_trips(graph, snap_points(graph, snap_count, seed))
+        if verbose:
+            print >> sys.stderr, "%-26s p50 %8.3f ms  %.1f us per point in bulk, p95 %.1f m away" % (
+                'snap', report['snap']['single_p50_ms'], report['snap']['bulk_us_per_point'],
+                report['snap']['meters_p95'])
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def print_summary(name, summary):
+    print >> sys.stderr, "%-26s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %10.1f nodes" % (
+        name, summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['nodes_assessed_mean'])
+
+
+def compare(old, new):
+    '''
+    Relative change of every method's latency percentiles between two reports.
+    :param old: report dict
+    :param new: report dict
+    :return: dict of method -> {metric: fraction of change, positive when slower}
+    '''
+    changes = {}
+    for name, summary in new['methods'].iteritems():
+        if name not in old['methods']:
+            continue
+        before = old['methods'][name]
+        changes[name] = dict((key, (summary[key] - before[key]) / before[key] if before[key] else None)
+                             for key in ['p%d_ms' % p for p in PERCENTILES] + ['nodes_assessed_mean'])
+    return changes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search benchmarks without the denver database.')
+    parser.add_argument('command', choices=('run', 'kernels', 'fixture', 'compare'))
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--source', choices=(GRID, GEOMETRIC, SQLITE, SNAPSHOT), default=GRID)
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--path', default=None)
+    parser.add_argument('--queries', type=int, default=QUERIES)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--preprocess', action='store_true')
+    parser.add_argument('--local-hops', type=int, default=LOCAL_HOPS)
+    parser.add_argument('--snap-points', type=int, default=SNAP_POINTS)
+    parser.add_argument('--hops', type=int, nargs='+', default=list(KERNEL_HOPS))
+    parser.add_argument('--output', default=None)
+    arguments = parser.parse_args()
+    if arguments.command == 'run':
+        output = json.dumps(run_benchmark(arguments.source, arguments.nodes, arguments.path, arguments.queries,
+                                          arguments.seed, arguments.preprocess, local_hops=arguments.local_hops,
+                                          snap_count=arguments.snap_points),
+                            indent=2, sort_keys=True)
+    elif arguments.command == 'kernels':
+        if kernels.numpy is None:
+            parser.error("Comparing the A* kernels needs numpy")
+        graph = load_graph(arguments.source, arguments.nodes, arguments.path, arguments.seed)
+        output = json.dumps(kernel_lengths(graph, arguments.hops, arguments.queries, arguments.seed),
+                            indent=2, sort_keys=True)
+    elif arguments.command == 'fixture':
+        output = write_sqlite_fixture(load_graph(arguments.source, arguments.nodes, seed=arguments.seed),
+                                      arguments.files[0])
+    else:
+        with open(arguments.files[0]) as f:
+            old = json.load(f)
+        with open(arguments.files[1]) as f:
+            new = json.load(f)
+        output = json.dumps(compare(old, new), indent=2, sort_keys=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
@@ -0,0 +1,217 @@
+'''
+Route cache keyed on the unordered (source, destination) pair.
+
+The graph is undirected, so a route and its reverse share one entry,
+stored from the smaller osm_id to the larger and turned around on the
+way out. Entries hold the cost, the node path and optionally the route
+geometry as hex WKB. The least recently used entry is evicted once the
+cache is full. Every cache is tied to the graph it was filled from by a
+fingerprint of the snapshot and the edge weights; a saved cache is
+discarded on load when that no longer matches, and an attached cache is
+cleared as soon as the graph's weights are changed in place, unless the
+change was reported to repair, which keeps the routes still shortest.
+'''
+from collections import OrderedDict
+import cPickle
+import os
+import shapely.wkb
+import geometry
+
+CAPACITY = 100000
+CACHE_PATH = 'denver.routes'
+FORMAT_VERSION = 1
+
+
+class CachedRoute(object):
+    '''
+    A cache hit, oriented from the source asked for to the destination.
+    '''
+
+    def __init__(self, cost, path, geometry_hex):
+        self.cost = cost
+        self.path = path
+        self.geometry_hex = geometry_hex
+
+
+class RouteCache(object):
+    '''
+    Bounded LRU map of unordered node pairs to routes.
+    '''
+
+    def __init__(self, capacity=CAPACITY, graph=None):
+        '''
+        :param capacity: most routes kept
+        :param graph: CompactGraph the routes are computed on, for invalidation
+        '''
+        self.capacity = capacity
+        self.entries = OrderedDict()  # (low, high) -> (cost, path from low to high, geometry hex or None)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.graph = graph
+        self.fingerprint = graph_fingerprint(graph) if graph is not None else None
+        self.graph_version = graph.version if graph is not None else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, source, destination):
+        '''
+        :param source: osm_id
+        :param destination: osm_id
+        :return: CachedRoute from source to destination, or None on a miss
+        '''
+        self._check_graph()
+        key, forward = _key(source, destination)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry  # Most recently used goes last
+        self.hits += 1
+        cost, path, geometry_hex = entry
+        if forward or path is None:
+            return CachedRoute(cost, path, geometry_hex)
+        if geometry_hex is not None:
+            geometry_hex = geometry.oriented(shapely.wkb.loads(geometry_hex, hex=True), False).wkb_hex
+        return CachedRoute(cost, path[::-1], geometry_hex)
+
+    def put(self, source, destination, cost, path, geometry_hex=None):
+        '''
+        Stores a route, evicting the least recently used one when full.
+        :param source: osm_id the path starts at
+        :param destination: osm_id the path ends at
+        :param cost: route cost, INFINITY when unreachable
+        :param path: list of osm_id from source to destination, or None
+        :param geometry_hex: optional route geometry from source to destination as hex WKB
+        '''
+        self._check_graph()
+        key, forward = _key(source, destination)
+        if path is not None:
+            path = tuple(path)
+        if not forward:
+            if path is not None:
+                path = path[::-1]
+            if geometry_hex is not None:
+                geometry_hex = geometry.oriented(shapely.wkb.loads(geometry_hex, hex=True), False).wkb_hex
+        if geometry_hex is None and key in self.entries:
+            geometry_hex = self.entries[key][2]  # Keep geometry a plain route lookup did not have
+        self.entries.pop(key, None)
+        self.entries[key] = (cost, path, geometry_hex)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def repair(self, changed, decreased, previous_version):
+        '''
+        Follows an in place change of edge weights. When weights only went
+        up, a route that does not use a changed edge is still the shortest
+        and an unreachable pair stays unreachable, so only the routes over
+        a changed edge are dropped. A lower weight may give any pair a
+        shorter route, so then the whole cache is cleared.
+        :param changed: list of (osm_id, osm_id) roads whose weight changed
+        :param decreased: whether any weight went down
+        :param previous_version: graph version before the change, the cache is
+                                 cleared when it had not caught up with it
+        :return: number of routes dropped
+        '''
+        before = len(self.entries)
+        if decreased or self.graph is None or self.graph_version != previous_version:
+            self.entries.clear()
+            self.invalidations += 1
+        else:
+            nodes = set()
+            roads = set()
+            for a, b in changed:
+                nodes.add(a)
+                nodes.add(b)
+                roads.add((a, b) if a < b else (b, a))
+            for key, (cost, path, geometry_hex) in self.entries.items():
+                if path is None or nodes.isdisjoint(path):
+                    continue
+                for k in xrange(len(path) - 1):
+                    a, b = path[k], path[k + 1]
+                    if ((a, b) if a < b else (b, a)) in roads:
+                        del self.entries[key]
+                        break
+        if self.graph is not None:
+            self.fingerprint = graph_fingerprint(self.graph)
+            self.graph_version = self.graph.version
+        return before - len(self.entries)
+
+    def stats(self):
+        '''
+        :return: dict of size, capacity, hits, misses, hit rate, evictions and invalidations
+        '''
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def _check_graph(self):
+        if self.graph is not None and self.graph.version != self.graph_version:
+            self.entries.clear()
+            self.invalidations += 1
+            self.fingerprint = graph_fingerprint(self.graph)
+            self.graph_version = self.graph.version
+
+    def save(self, path=CACHE_PATH):
+        '''
+        Writes the entries, least recently used first, with the graph
+        fingerprint. Written next to path and renamed over it.
+        :param path: file to write
+        :return: path
+        '''
+        self._check_graph()
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            cPickle.dump({'version': FORMAT_VERSION, 'fingerprint': self.fingerprint,
+                          'entries': self.entries.items()}, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_path, path)
+        return path
+
+
+def load_cache(path=CACHE_PATH, graph=None, capacity=CAPACITY):
+    '''
+    Reads a saved cache, or starts an empty one when the file is missing,
+    unreadable, or was filled from a different graph.
+    :param path: file written by RouteCache.save
+    :param graph: CompactGraph the cache will be used with
+    :param capacity: most routes kept
+    :return: RouteCache
+    '''
+    route_cache = RouteCache(capacity, graph)
+    if not os.path.exists(path):
+        return route_cache
+    try:
+        with open(path, 'rb') as f:
+            saved = cPickle.load(f)
+    except (EOFError, cPickle.UnpicklingError, ValueError, TypeError):
+        return route_cache
+    if saved.get('version') != FORMAT_VERSION or saved.get('fingerprint') != route_cache.fingerprint:
+        route_cache.invalidations += 1
+        return route_cache
+    for key, entry in saved['entries'][-capacity:]:
+        route_cache.entries[key] = entry
+    return route_cache
+
+
+def graph_fingerprint(graph):
+    '''
+    :param graph: CompactGraph
+    :return: snapshot fingerprint, size and edge weight checksum of graph
+    '''
+    return (tuple(graph.fingerprint) if graph.fingerprint is not None else None, len(graph), graph.edge_count(),
+            graph.weights_checksum())
+
+
+def _key(source, destination):
+    source = float(source)
+    destination = float(destination)
+    if source <= destination:
+        return (source, destination), True
+    return (destination, source), False
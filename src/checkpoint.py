@@ -0,0 +1,258 @@
+'''
+Resumable experiments.
+
+The pairs file is streamed a row at a time, and a Checkpoint records the
+index of every pair that has been answered: done once its route is in
+the results table, or missing, unreachable, failed or timed out. A rerun with the
+same checkpoint skips those and resumes with the next pending pair.
+
+The checkpoint is an append-only log of "index code" lines, so a crash
+loses at most the line being written. A "run id" line keeps the run id
+of the experiment, so the rows a resumed run writes carry the same id as
+those of the first one. Each results table has its own default
+checkpoint, so a Dijkstra and an A* run over the same pairs file do not
+skip each other's pairs. Done indices are only logged after
+the result writer has flushed their rows, so a pair is never recorded
+as done without its route in the database. Closing the checkpoint
+rewrites the log as "first-last code" ranges. Without a checkpoint file,
+the routes a run already wrote can be read back from its results table.
+'''
+import csv
+import os
+import database
+import results
+
+PAIRS_PATH = 'denverpoints.csv'
+
+DONE = 'done'
+MISSING = 'missing'
+FAILED = 'failed'
+TIMED_OUT = 'timed out'
+UNREACHABLE = 'unreachable'
+CODES = {DONE: 'd', MISSING: 'm', FAILED: 'f', TIMED_OUT: 't', UNREACHABLE: 'u'}
+STATUSES = dict((code, status) for status, code in CODES.iteritems())
+
+
+def read_pairs(path=PAIRS_PATH):
+    '''
+    Streams the (source, destination) pairs of an experiment file.
+    :param path: csv of source,destination osm_id rows
+    :return: generator of (source, destination)
+    '''
+    with open(path, 'rb') as f:
+        for row in csv.reader(f):
+            yield float(row[0]), float(row[1])
+
+
+def checkpoint_path(pairs_path, table):
+    '''
+    :param pairs_path: experiment file
+    :param table: results table the experiment writes to
+    :return: the default checkpoint file of the pairs file and table
+    '''
+    return '%s.%s.checkpoint' % (pairs_path, table)
+
+
+class Checkpoint(object):
+    '''
+    Statuses of the answered pair indices of one experiment file.
+    '''
+
+    def __init__(self, path, writer=None, retry_failed=False):
+        '''
+        :param path: log file, read if it exists and appended to
+        :param writer: results.ResultWriter the done routes are added to
+        :param retry_failed: treat missing, unreachable, failed and timed out pairs as pending again
+        '''
+        self.path = path
+        self.writer = writer
+        self.statuses = {}
+        self.run_id = None
+        self.pairs = set()  # Unordered pairs known to be done, read from a results table
+        self.unflushed = []
+        self.flushes = writer.flushes if writer is not None else 0
+        if os.path.exists(path):
+            self._read()
+        if retry_failed:
+            self.statuses = dict((index, status) for index, status in self.statuses.iteritems() if status == DONE)
+        self.file = open(path, 'ab')
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == 'run' and line.endswith('\n'):
+                    self.run_id = parts[1]
+                    continue
+                if len(parts) != 2 or parts[1] not in STATUSES or not line.endswith('\n'):
+                    continue  # The line a crash cut short
+                first, _, last = parts[0].partition('-')
+                status = STATUSES[parts[1]]
+                for index in xrange(int(first), int(last or first) + 1):
+                    self.statuses[index] = status
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def answered(self, index, source=None, destination=None):
+        '''
+        :return: whether pair index, from source to destination, needs no more routing
+        '''
+        if index in self.statuses:
+            return True
+        return bool(self.pairs) and _unordered(source, destination) in self.pairs
+
+    def pending(self, pairs):
+        '''
+        :param pairs: iterable of (source, destination)
+        :return: generator of (index, source, destination) of the pairs not yet answered
+        '''
+        for index, (source, destination) in enumerate(pairs):
+            if not self.answered(index, source, destination):
+                yield index, source, destination
+
+    def record(self, index, status):
+        '''
+        :param index: pair index in the experiment file
+        :param status: DONE once its route was added to the writer, else
+                       MISSING, UNREACHABLE, FAILED or TIMED_OUT
+        '''
+        if status == DONE and self.writer is not None:
+            self.unflushed.append(index)
+            self.sync()
+        else:
+            self._write(index, status)
+
+    def sync(self):
+        '''
+        Logs the done indices whose rows the writer has flushed since the
+        last call. A flush writes every row added before it, so any flush
+        covers all of them.
+        '''
+        if self.writer is not None and self.writer.flushes != self.flushes:
+            self.flushes = self.writer.flushes
+            unflushed = self.unflushed
+            self.unflushed = []
+            for index in unflushed:
+                self._write(index, DONE)
+
+    def set_run(self, run_id):
+        '''
+        Logs the run id the experiment writes its rows with.
+        :param run_id: results.run_id() of the run
+        '''
+        if run_id != self.run_id:
+            self.run_id = run_id
+            self.file.write('run %s\n' % run_id)
+            self.file.flush()
+
+    def _write(self, index, status):
+        self.statuses[index] = status
+        self.file.write('%d %s\n' % (index, CODES[status]))
+        self.file.flush()
+
+    def load_results(self, table, run_id):
+        '''
+        Counts every route run_id already has in table as done, for runs
+        without a checkpoint file.
+        :param table: results.DIJKSTRAS or results.ASTAR
+        :param run_id: id of the run being resumed
+        :return: number of routes found
+        '''
+        with database.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT source, destinations[1] FROM ' + table + ' WHERE id = %s', (run_id,))
+            for source, destination in cur:
+                self.pairs.add(_unordered(float(source), float(destination)))
+        return len(self.pairs)
+
+    def counts(self):
+        '''
+        :return: dict of status to number of indices
+        '''
+        counts = dict((status, 0) for status in CODES)
+        for status in self.statuses.itervalues():
+            counts[status] += 1
+        return counts
+
+    def close(self):
+        '''
+        Logs what the writer flushed, then rewrites the log as ranges.
+        Call after closing the writer.
+        '''
+        self.sync()
+        self.file.close()
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            if self.run_id is not None:
+                f.write('run %s\n' % self.run_id)
+            for first, last, status in _ranges(self.statuses):
+                if first == last:
+                    f.write('%d %s\n' % (first, CODES[status]))
+                else:
+                    f.write('%d-%d %s\n' % (first, last, CODES[status]))
+        os.rename(temporary_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_checkpoint(path, table, retry_failed=False, run_id=None):
+    '''
+    :param path: checkpoint file
+    :param table: results table the experiment writes to
+    :param retry_failed: route missing, failed and timed out pairs again
+    :param run_id: earlier run to resume: its routes in table count as
+                   done and the new rows carry its id. Without it, the
+                   run id the checkpoint logged is resumed, if any.
+    :return: Checkpoint tracking the shared writer of table
+    '''
+    progress = Checkpoint(path, results.get_writer(table), retry_failed)
+    if run_id is not None or progress.run_id is not None:
+        results.resume_run(run_id or progress.run_id)
+    progress.set_run(results.run_id())
+    if run_id is not None:
+        progress.load_results(table, run_id)
+    return progress
+
+
+def add_arguments(parser):
+    '''
+    Adds the pairs file and the checkpoint options to an argparse parser.
+    '''
+    parser.add_argument('pairs', nargs='?', default=PAIRS_PATH)
+    parser.add_argument('--checkpoint', default=None, help='progress file, default <pairs>.<table>.checkpoint')
+    parser.add_argument('--retry-failed', action='store_true', help='route missing, failed and timed out pairs again')
+    parser.add_argument('--resume-run', default=None, help='run id whose routes in the results table count as done')
+
+
+def from_arguments(arguments, table):
+    '''
+    :param arguments: parsed with add_arguments
+    :return: Checkpoint for the pairs file of arguments
+    '''
+    return open_checkpoint(arguments.checkpoint or checkpoint_path(arguments.pairs, table), table,
+                           arguments.retry_failed, arguments.resume_run)
+
+
+def _ranges(statuses):
+    '''
+    :return: list of (first, last, status) runs of consecutive indices with one status
+    '''
+    runs = []
+    for index in sorted(statuses):
+        status = statuses[index]
+        if runs and runs[-1][1] == index - 1 and runs[-1][2] == status:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index, status])
+    return [tuple(run) for run in runs]
+
+
+def _unordered(source, destination):
+    source = float(source)
+    destination = float(destination)
+    return (source, destination) if source >= destination else (destination, source)
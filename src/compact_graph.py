@@ -0,0 +1,268 @@
+from array import array
+import bisect
+import sys
+import zlib
+
+ID_TYPE = 'd'  # OSM ids are kept as floats, the same keys init_graph uses
+INDEX_TYPE = 'i'  # Dense int32 node index
+WEIGHT_TYPE = 'd'
+COORDINATE_TYPE = 'd'
+
+
+class CompactGraph(object):
+    '''
+    Array backed (CSR) version of the graph built by init_graph.
+
+    Every vertex gets a dense int32 index. The neighbors of index i are
+    targets[offsets[i]:offsets[i + 1]] with the matching weights, and
+    ids[i] gives back the OSM id of index i. Indices are assigned in
+    ascending OSM id order, so ids is sorted and an OSM id is found with
+    a binary search instead of a separate hash map.
+
+    The arrays may be array.array objects or read-only views into a
+    snapshot file, the graph only relies on indexing and slicing.
+    '''
+
+    def __init__(self, ids, offsets, targets, weights, lons=None, lats=None):
+        '''
+        :param ids: sorted array of OSM ids, position is the node index
+        :param offsets: array of len(ids) + 1 slice starts into targets/weights
+        :param targets: array of neighbor indices
+        :param weights: array of edge lengths
+        :param lons: optional array of vertex longitudes by index
+        :param lats: optional array of vertex latitudes by index
+        '''
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.lons = lons
+        self.lats = lats
+        self.fingerprint = None  # Source table fingerprint when loaded from a snapshot
+        self.version = 0  # Bumped whenever edge weights are changed in place
+        self.below_straight_line = set()  # (i, j), i < j, of updated roads shorter than the straight line
+        self.components = None  # components.Components once labeled
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, osm_id):
+        try:
+            self.index_of(osm_id)
+            return True
+        except KeyError:
+            return False
+
+    def index_of(self, osm_id):
+        '''
+        :param osm_id: OSM id of a vertex
+        :return: dense index of the vertex, raises KeyError like the dict graph
+        '''
+        osm_id = float(osm_id)
+        i = bisect.bisect_left(self.ids, osm_id)
+        if i == len(self.ids) or self.ids[i] != osm_id:
+            raise KeyError(osm_id)
+        return i
+
+    def neighbors(self, i):
+        '''
+        :param i: node index
+        :return: list of (neighbor index, weight) pairs
+        '''
+        start = self.offsets[i]
+        end = self.offsets[i + 1]
+        return zip(self.targets[start:end], self.weights[start:end])
+
+    def coordinates_of(self, i):
+        '''
+        :param i: node index
+        :return: (lon, lat) of the node
+        '''
+        return self.lons[i], self.lats[i]
+
+    def weights_checksum(self):
+        '''
+        :return: CRC32 of the raw edge weights, to tell apart graphs with equal structure
+        '''
+        return zlib.crc32(buffer(self.weights)) & 0xffffffff
+
+    def edge_count(self):
+        '''
+        :return: number of directed edges (each road is stored both ways)
+        '''
+        return len(self.targets)
+
+    def memory_usage(self):
+        '''
+        Approximate bytes held by the graph.
+        :return: dict with the adjacency bytes, the coordinate bytes and their total
+        '''
+        arrays = 0
+        for values in (self.ids, self.offsets, self.targets, self.weights):
+            arrays += len(values) * values.itemsize
+        coordinates = 0
+        if self.lons is not None:
+            coordinates = (len(self.lons) + len(self.lats)) * self.lons.itemsize
+        return {'arrays': arrays, 'coordinates': coordinates, 'total': arrays + coordinates}
+
+
+def build_compact_graph(vertex_ids, edges, lons=None, lats=None):
+    '''
+    Builds a CompactGraph from the rows init_graph reads.
+    Each edge is stored in both directions, and when the same pair
+    appears more than once the last row wins, as it does in the dict graph.
+    :param vertex_ids: iterable of osm_id from ways_vertices_pgr
+    :param edges: iterable of (source_osm, target_osm, length) from ways
+    :param lons: optional longitudes in the same order as vertex_ids
+    :param lats: optional latitudes in the same order as vertex_ids
+    :return: CompactGraph
+    '''
+    ids, lons, lats, index = index_vertices(vertex_ids, lons, lats)
+    sources = array(INDEX_TYPE)
+    targets = array(INDEX_TYPE)
+    weights = array(WEIGHT_TYPE)
+    for source_osm, target_osm, length in edges:
+        add_edge(index, sources, targets, weights, source_osm, target_osm, length)
+    return csr_from_edges(ids, sources, targets, weights, lons, lats)
+
+
+def index_vertices(vertex_ids, lons=None, lats=None):
+    '''
+    Assigns dense indices in ascending OSM id order, dropping repeated ids.
+    :param vertex_ids: iterable of osm_id
+    :param lons: optional longitudes in the same order as vertex_ids
+    :param lats: optional latitudes in the same order as vertex_ids
+    :return: ids, lons, lats in index order, and a dict of osm_id -> index for the build
+    '''
+    raw_ids = [float(osm_id) for osm_id in vertex_ids]
+    order = sorted(xrange(len(raw_ids)), key=raw_ids.__getitem__)
+    ids = array(ID_TYPE)
+    kept = []
+    index = {}
+    for k in order:
+        osm_id = raw_ids[k]
+        if osm_id not in index:
+            index[osm_id] = len(ids)
+            ids.append(osm_id)
+            kept.append(k)
+    del raw_ids
+    if lons is not None:
+        lons = array(COORDINATE_TYPE, (float(lons[k]) for k in kept))
+        lats = array(COORDINATE_TYPE, (float(lats[k]) for k in kept))
+    return ids, lons, lats, index
+
+
+def add_edge(index, sources, targets, weights, source_osm, target_osm, length):
+    '''
+    Appends a road to the edge list in both directions.
+    :param index: osm_id -> index from index_vertices
+    '''
+    c1 = index[float(source_osm)]
+    c2 = index[float(target_osm)]
+    length = float(length)
+    sources.append(c1)
+    targets.append(c2)
+    weights.append(length)
+    sources.append(c2)
+    targets.append(c1)
+    weights.append(length)
+
+
+def from_dict_graph(graph, coordinates=None):
+    '''
+    Converts a graph from init_graph into a CompactGraph.
+    :param graph: dict of osm_id -> {neighbor osm_id: length}
+    :param coordinates: optional dict of osm_id -> (lon, lat)
+    :return: CompactGraph
+    '''
+    ids = array(ID_TYPE, sorted(graph.keys()))
+    index = {}
+    for i, osm_id in enumerate(ids):
+        index[osm_id] = i
+    sources = array(INDEX_TYPE)
+    targets = array(INDEX_TYPE)
+    weights = array(WEIGHT_TYPE)
+    for i, osm_id in enumerate(ids):
+        for neighbor, length in graph[osm_id].iteritems():
+            sources.append(i)
+            targets.append(index[neighbor])
+            weights.append(length)
+    lons = lats = None
+    if coordinates is not None:
+        lons = array(COORDINATE_TYPE, (coordinates[osm_id][0] for osm_id in ids))
+        lats = array(COORDINATE_TYPE, (coordinates[osm_id][1] for osm_id in ids))
+    return csr_from_edges(ids, sources, targets, weights, lons, lats)
+
+
+def csr_from_edges(ids, sources, targets, weights, lons=None, lats=None):
+    '''
+    Counting sort of an edge list into CSR order, dropping repeated
+    (source, target) pairs so only the last weight is kept.
+    '''
+    n = len(ids)
+    counts = array(INDEX_TYPE, [0]) * (n + 1)
+    for s in sources:
+        counts[s + 1] += 1
+    for i in xrange(n):
+        counts[i + 1] += counts[i]
+    offsets = array(INDEX_TYPE, counts)
+    cursor = array(INDEX_TYPE, counts)
+    sorted_targets = array(INDEX_TYPE, [0]) * len(targets)
+    sorted_weights = array(WEIGHT_TYPE, [0.0]) * len(weights)
+    for e in xrange(len(sources)):
+        s = sources[e]
+        position = cursor[s]
+        sorted_targets[position] = targets[e]
+        sorted_weights[position] = weights[e]
+        cursor[s] = position + 1
+
+    # Drop duplicate pairs, keeping the first position with the last weight
+    final_offsets = array(INDEX_TYPE, [0]) * (n + 1)
+    final_targets = array(INDEX_TYPE)
+    final_weights = array(WEIGHT_TYPE)
+    for i in xrange(n):
+        seen = {}
+        for position in xrange(offsets[i], offsets[i + 1]):
+            target = sorted_targets[position]
+            if target in seen:
+                final_weights[seen[target]] = sorted_weights[position]
+            else:
+                seen[target] = len(final_targets)
+                final_targets.append(target)
+                final_weights.append(sorted_weights[position])
+        final_offsets[i + 1] = len(final_targets)
+    return CompactGraph(ids, final_offsets, final_targets, final_weights, lons, lats)
+
+
+def dict_graph_memory_usage(graph):
+    '''
+    Approximate bytes held by a graph from init_graph,
+    counting the dicts and the float objects in them.
+    :param graph: dict of osm_id -> {neighbor osm_id: length}
+    :return: bytes
+    '''
+    total = sys.getsizeof(graph)
+    for osm_id, neighbors in graph.iteritems():
+        total += sys.getsizeof(osm_id) + sys.getsizeof(neighbors)
+        for neighbor, length in neighbors.iteritems():
+            total += sys.getsizeof(neighbor) + sys.getsizeof(length)
+    return total
+
+
+def compare_memory(graph, compact=None):
+    '''
+    Prints how much memory the dict graph and the CompactGraph
+    take for the same data.
+    :param graph: graph from init_graph
+    :param compact: CompactGraph of the same data, built from graph if not given
+    :return: dict of the measured byte counts
+    '''
+    if compact is None:
+        compact = from_dict_graph(graph)
+    report = compact.memory_usage()
+    report['dict'] = dict_graph_memory_usage(graph)
+    print "Nodes: %d, directed edges: %d" % (len(compact), compact.edge_count())
+    print "Dict graph:    %10.1f MB" % (report['dict'] / 1048576.0)
+    print "Compact graph: %10.1f MB (adjacency %.1f MB, coordinates %.1f MB)" % (
+        report['total'] / 1048576.0, report['arrays'] / 1048576.0, report['coordinates'] / 1048576.0)
+    return report
@@ -0,0 +1,243 @@
+'''
+Connected components of the road graph.
+
+One pass over the CSR arrays gives every vertex the label of its
+connected component, numbered by size so label 0 is the largest. With
+the labels attached to the graph, a pair in two different components is
+answered as unreachable by comparing two ints instead of searching
+everything reachable from the source. The graph can also be pruned to
+its largest component ahead of time. A graph from init_graph is labeled
+through compact_graph.from_dict_graph.
+
+Usage:
+    python components.py build [path]
+    python components.py stats [path]
+    python components.py prune [snapshot path]
+'''
+from array import array
+import sys
+import time
+import compact_graph
+import snapshot
+
+MAGIC = 'RGCOMP\0\0'
+VERSION = 1
+COMPONENTS_PATH = 'denver.components'
+LABEL_TYPE = 'i'
+TOP = 5
+
+
+class Components(object):
+    '''
+    Component label of every node index, label 0 the largest component.
+    '''
+
+    def __init__(self, graph, labels, sizes):
+        '''
+        :param graph: the CompactGraph labeled
+        :param labels: array of component labels by node index
+        :param sizes: array of node counts by label, largest first
+        '''
+        self.graph = graph
+        self.labels = labels
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def connected(self, i, j):
+        '''
+        :param i: node index
+        :param j: node index
+        :return: whether a path joins the two nodes
+        '''
+        return self.labels[i] == self.labels[j]
+
+    def connected_ids(self, source, destination):
+        '''
+        :param source: osm_id
+        :param destination: osm_id
+        :return: whether a path joins the two vertices, raises KeyError for unknown ids
+        '''
+        return self.labels[self.graph.index_of(source)] == self.labels[self.graph.index_of(destination)]
+
+    def label_of(self, osm_id):
+        '''
+        :return: component label of a vertex, raises KeyError for an unknown id
+        '''
+        return self.labels[self.graph.index_of(osm_id)]
+
+    def stats(self, top=TOP):
+        '''
+        :param top: number of largest component sizes listed
+        :return: dict of component count, largest size and its share of the
+                 nodes, count of single node components and the top sizes
+        '''
+        nodes = len(self.labels)
+        return {'components': len(self.sizes), 'nodes': nodes, 'largest': self.sizes[0] if self.sizes else 0,
+                'largest_share': float(self.sizes[0]) / nodes if nodes else 0.0,
+                'isolated': sum(1 for size in self.sizes if size == 1), 'top_sizes': list(self.sizes[:top])}
+
+
+def label_components(graph):
+    '''
+    Labels the connected components with an iterative depth first search.
+    The graph stores every road both ways, so following out edges is enough.
+    :param graph: CompactGraph
+    :return: Components
+    '''
+    n = len(graph)
+    offsets = graph.offsets
+    targets = graph.targets
+    labels = array(LABEL_TYPE, [-1]) * n
+    sizes = []
+    for root in xrange(n):
+        if labels[root] != -1:
+            continue
+        label = len(sizes)
+        labels[root] = label
+        size = 1
+        stack = [root]
+        while stack:
+            i = stack.pop()
+            for position in xrange(offsets[i], offsets[i + 1]):
+                j = targets[position]
+                if labels[j] == -1:
+                    labels[j] = label
+                    size += 1
+                    stack.append(j)
+        sizes.append(size)
+
+    # Renumber by size, largest first, keeping discovery order between equal sizes
+    order = sorted(xrange(len(sizes)), key=lambda label: -sizes[label])
+    renumber = array(LABEL_TYPE, [0]) * len(sizes)
+    for new_label, label in enumerate(order):
+        renumber[label] = new_label
+    for i in xrange(n):
+        labels[i] = renumber[labels[i]]
+    return Components(graph, labels, array(LABEL_TYPE, [sizes[label] for label in order]))
+
+
+def get_components(graph):
+    '''
+    :param graph: CompactGraph
+    :return: the Components attached to graph, labeled and attached on first use
+    '''
+    if graph.components is None:
+        graph.components = label_components(graph)
+    return graph.components
+
+
+def prune_to_largest(graph, components=None):
+    '''
+    Drops every vertex outside the largest component.
+    :param graph: CompactGraph
+    :param components: Components of graph, labeled when not given
+    :return: CompactGraph of the largest component, with its Components attached
+    '''
+    if components is None:
+        components = get_components(graph)
+    labels = components.labels
+    kept = [i for i in xrange(len(graph)) if labels[i] == 0]
+    new_index = array(compact_graph.INDEX_TYPE, [-1]) * len(graph)
+    for position, i in enumerate(kept):
+        new_index[i] = position
+    ids = array(compact_graph.ID_TYPE, (graph.ids[i] for i in kept))
+    offsets = array(compact_graph.INDEX_TYPE, [0])
+    targets = array(compact_graph.INDEX_TYPE)
+    weights = array(compact_graph.WEIGHT_TYPE)
+    for i in kept:
+        for position in xrange(graph.offsets[i], graph.offsets[i + 1]):
+            targets.append(new_index[graph.targets[position]])  # Same component, so always kept
+            weights.append(graph.weights[position])
+        offsets.append(len(targets))
+    lons = lats = None
+    if graph.lons is not None:
+        lons = array(compact_graph.COORDINATE_TYPE, (graph.lons[i] for i in kept))
+        lats = array(compact_graph.COORDINATE_TYPE, (graph.lats[i] for i in kept))
+    pruned = compact_graph.CompactGraph(ids, offsets, targets, weights, lons, lats)
+    pruned.fingerprint = graph.fingerprint
+    pruned.components = Components(pruned, array(LABEL_TYPE, [0]) * len(kept), array(LABEL_TYPE, [len(kept)]))
+    return pruned
+
+
+def pair_stats(components, pairs):
+    '''
+    Where the pairs of an experiment fall.
+    :param components: Components
+    :param pairs: iterable of (source, destination) osm_id
+    :return: dict of pair counts: within the largest component, within a
+             smaller one, across components, with an unknown vertex, and
+             the pairs by component label
+    '''
+    report = {'largest': 0, 'smaller': 0, 'across': 0, 'unknown': 0, 'by_component': {}}
+    for source, destination in pairs:
+        try:
+            source_label = components.label_of(source)
+            destination_label = components.label_of(destination)
+        except KeyError:
+            report['unknown'] += 1
+            continue
+        if source_label != destination_label:
+            report['across'] += 1
+            continue
+        report['largest' if source_label == 0 else 'smaller'] += 1
+        report['by_component'][source_label] = report['by_component'].get(source_label, 0) + 1
+    return report
+
+
+def write_components(components, path=COMPONENTS_PATH):
+    '''
+    :param components: Components
+    :param path: file to write, tied to the graph fingerprint
+    :return: path
+    '''
+    fingerprint = components.graph.fingerprint or (0, 0, 0, 0)
+    return snapshot.write_arrays(path, MAGIC, VERSION, tuple(fingerprint) + (len(components.graph),),
+                                 [('labels', components.labels), ('sizes', components.sizes)])
+
+
+def load_components(graph, path=COMPONENTS_PATH):
+    '''
+    Memory maps saved component labels for graph.
+    :param graph: the CompactGraph they were computed on
+    :param path: components file
+    :return: Components
+    '''
+    fields, sections, mapped = snapshot.read_arrays(path, MAGIC, VERSION)
+    if fields[-1] != len(graph) or (graph.fingerprint is not None and tuple(fields[:-1]) != tuple(graph.fingerprint)):
+        raise snapshot.SnapshotError("%s was built from a different graph, rebuild it" % path)
+    components = Components(graph, sections['labels'], sections['sizes'])
+    components.mapped = mapped
+    return components
+
+
+def print_stats(components):
+    stats = components.stats()
+    print "%(components)d components over %(nodes)d nodes, the largest has %(largest)d (%(largest_share).1f%%)" % \
+        dict(stats, largest_share=100 * stats['largest_share'])
+    print "%d single node components, largest sizes %s" % (stats['isolated'], stats['top_sizes'])
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'build':
+        start = time.time()
+        graph = snapshot.load_compact_graph()
+        components = label_components(graph)
+        write_components(components, sys.argv[2] if len(sys.argv) > 2 else COMPONENTS_PATH)
+        print "Labeled in %.2f seconds" % (time.time() - start)
+        print_stats(components)
+    elif command == 'stats':
+        graph = snapshot.load_compact_graph()
+        print_stats(load_components(graph, sys.argv[2] if len(sys.argv) > 2 else COMPONENTS_PATH))
+    elif command == 'prune':
+        path = sys.argv[2] if len(sys.argv) > 2 else snapshot.SNAPSHOT_PATH
+        graph = snapshot.load_compact_graph(path)
+        pruned = prune_to_largest(graph)
+        snapshot.write_snapshot(pruned, path, graph.fingerprint or (0, 0, 0, 0))
+        print "Kept %d of %d nodes in %s, rebuild the hierarchy, landmarks and components" % (
+            len(pruned), len(graph), path)
+    else:
+        print __doc__
+        sys.exit(2)
@@ -0,0 +1,329 @@
+'''
+Contraction Hierarchies over a CompactGraph.
+
+Preprocessing contracts nodes one at a time in order of importance
+(edge difference plus contracted neighbors, updated lazily), adding a
+shortcut between two neighbors whenever no witness path avoids the
+contracted node. A query is a bidirectional Dijkstra that only follows
+edges to higher ranked nodes, and the shortcuts on the result are
+unpacked back into the original OSM node sequence.
+
+Usage:
+    python contraction.py build [snapshot] [hierarchy]
+    python contraction.py bench [queries]
+'''
+from array import array
+import heapq
+import random
+import sys
+import time
+import search
+import snapshot
+
+MAGIC = 'RGCH\0\0\0\0'
+VERSION = 1
+HIERARCHY_PATH = 'denver.ch'
+NO_MIDDLE = -1  # Middle node of an original edge
+WITNESS_SETTLE_LIMIT = 60
+INFINITY = float("inf")
+
+
+class ContractionHierarchy(object):
+    '''
+    Ranks and upward edges of a contracted CompactGraph. The upward
+    edges of node i are up_targets[up_offsets[i]:up_offsets[i + 1]],
+    with their weights and the contracted middle node of each shortcut.
+    '''
+
+    def __init__(self, graph, rank, up_offsets, up_targets, up_weights, up_middles):
+        '''
+        :param graph: the CompactGraph that was contracted
+        :param rank: array of the contraction order of every node
+        '''
+        self.graph = graph
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_middles = up_middles
+
+    def shortcut_count(self):
+        count = 0
+        for middle in self.up_middles:
+            if middle != NO_MIDDLE:
+                count += 1
+        return count
+
+    def query(self, source, target):
+        '''
+        Bidirectional upward search between two node indices.
+        :param source: index of the node to start at
+        :param target: index of the node to finish at
+        :return: cost, path as a list of indices (None if unreachable),
+                 (forward nodes_assessed, backward nodes_assessed)
+        '''
+        up_offsets = self.up_offsets
+        up_targets = self.up_targets
+        up_weights = self.up_weights
+        costs = ({source: 0}, {target: 0})
+        parents = ({source: source}, {target: target})
+        frontiers = ([(0, source)], [(0, target)])
+        settled = (set(), set())
+        nodes_assessed = [0, 0]
+        best_cost = INFINITY
+        meeting_node = None
+        side = 1
+        while True:
+            # Alternate sides, a side is done once its smallest key reaches the best cost
+            open_sides = [k for k in (0, 1) if frontiers[k] and frontiers[k][0][0] < best_cost]
+            if not open_sides:
+                break
+            side = open_sides[0] if len(open_sides) == 1 else 1 - side
+            cost_to_current_node, current_node = heapq.heappop(frontiers[side])
+            if current_node in settled[side]:
+                continue  # Stale entry
+            settled[side].add(current_node)
+            nodes_assessed[side] += 1
+            other_cost = costs[1 - side].get(current_node)
+            if other_cost is not None and cost_to_current_node + other_cost < best_cost:
+                best_cost = cost_to_current_node + other_cost
+                meeting_node = current_node
+            side_costs = costs[side]
+            for position in xrange(up_offsets[current_node], up_offsets[current_node + 1]):
+                neighbor = up_targets[position]
+                new_distance_to_neighbor = cost_to_current_node + up_weights[position]
+                if new_distance_to_neighbor < side_costs.get(neighbor, INFINITY):
+                    side_costs[neighbor] = new_distance_to_neighbor
+                    parents[side][neighbor] = current_node
+                    heapq.heappush(frontiers[side], (new_distance_to_neighbor, neighbor))
+
+        if meeting_node is None:
+            return INFINITY, None, tuple(nodes_assessed)
+        upward = [meeting_node]
+        while upward[-1] != source:
+            upward.append(parents[0][upward[-1]])
+        upward.reverse()
+        current_node = meeting_node
+        while current_node != target:
+            current_node = parents[1][current_node]
+            upward.append(current_node)
+        path = [upward[0]]
+        for index in xrange(1, len(upward)):
+            path.extend(self.unpack_edge(upward[index - 1], upward[index])[1:])
+        return best_cost, path, tuple(nodes_assessed)
+
+    def unpack_edge(self, a, b):
+        '''
+        Expands an edge of the hierarchy into the original nodes it covers.
+        :param a: node index
+        :param b: node index, adjacent to a in the hierarchy
+        :return: list of node indices from a to b
+        '''
+        path = [a]
+        stack = [b]
+        current_node = a
+        while stack:
+            next_node = stack[-1]
+            middle = self._middle(current_node, next_node)
+            if middle == NO_MIDDLE:
+                path.append(next_node)
+                current_node = stack.pop()
+            else:
+                stack.append(middle)
+        return path
+
+    def _middle(self, a, b):
+        lower, higher = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+        for position in xrange(self.up_offsets[lower], self.up_offsets[lower + 1]):
+            if self.up_targets[position] == higher:
+                return self.up_middles[position]
+        raise KeyError((a, b))
+
+
+def build_hierarchy(graph, settle_limit=WITNESS_SETTLE_LIMIT, verbose=True):
+    '''
+    Contracts every node of a CompactGraph.
+    :param graph: CompactGraph
+    :param settle_limit: nodes a witness search may settle before giving up
+    :param verbose: print progress, preprocessing time and shortcut count
+    :return: ContractionHierarchy
+    '''
+    start = time.time()
+    n = len(graph)
+    adjacency = [dict() for v in xrange(n)]  # neighbor -> (weight, middle) among uncontracted nodes
+    for v in xrange(n):
+        for u, weight in graph.neighbors(v):
+            if u != v and weight < adjacency[v].get(u, (INFINITY,))[0]:
+                adjacency[v][u] = (weight, NO_MIDDLE)
+    deleted_neighbors = [0] * n
+    rank = array('i', [0]) * n
+
+    frontier = [(_priority(adjacency, v, deleted_neighbors, settle_limit), v) for v in xrange(n)]
+    heapq.heapify(frontier)
+    shortcuts_added = 0
+    order = 0
+    while frontier:
+        priority, v = heapq.heappop(frontier)
+        new_priority = _priority(adjacency, v, deleted_neighbors, settle_limit)
+        if frontier and new_priority > frontier[0][0]:
+            heapq.heappush(frontier, (new_priority, v))  # Lazy update, no longer the least important
+            continue
+        for u, w, weight in _shortcuts(adjacency, v, settle_limit):
+            adjacency[u][w] = (weight, v)
+            adjacency[w][u] = (weight, v)
+            shortcuts_added += 1
+        for u in adjacency[v]:
+            del adjacency[u][v]
+            deleted_neighbors[u] += 1
+        # What is left in adjacency[v] are exactly its upward edges
+        rank[v] = order
+        order += 1
+        if verbose and order % 10000 == 0:
+            print "Contracted %d of %d nodes, %d shortcuts" % (order, n, shortcuts_added)
+
+    up_offsets = array('i', [0]) * (n + 1)
+    up_targets = array('i')
+    up_weights = array('d')
+    up_middles = array('i')
+    for v in xrange(n):
+        for u, (weight, middle) in adjacency[v].iteritems():
+            up_targets.append(u)
+            up_weights.append(weight)
+            up_middles.append(middle)
+        up_offsets[v + 1] = len(up_targets)
+    hierarchy = ContractionHierarchy(graph, rank, up_offsets, up_targets, up_weights, up_middles)
+    if verbose:
+        print "Contracted %d nodes in %.1f seconds, %d shortcuts, %d upward edges" % (
+            n, time.time() - start, shortcuts_added, len(up_targets))
+    return hierarchy
+
+
+def _shortcuts(adjacency, v, settle_limit):
+    '''
+    Shortcuts needed to contract v: for each pair of its neighbors,
+    one with the length through v unless a witness path is as short.
+    :return: list of (u, w, weight)
+    '''
+    neighbors = adjacency[v].items()
+    shortcuts = []
+    for k, (u, (weight_u, middle_u)) in enumerate(neighbors):
+        later = neighbors[k + 1:]
+        if not later:
+            continue
+        max_cost = weight_u + max(weight_w for w, (weight_w, middle_w) in later)
+        witness = _witness_search(adjacency, u, v, max_cost, settle_limit)
+        for w, (weight_w, middle_w) in later:
+            through_v = weight_u + weight_w
+            if witness.get(w, INFINITY) > through_v:
+                shortcuts.append((u, w, through_v))
+    return shortcuts
+
+
+def _witness_search(adjacency, source, avoid, max_cost, settle_limit):
+    '''
+    Dijkstra from source over uncontracted nodes, skipping avoid and
+    stopping past max_cost or after settle_limit nodes.
+    :return: dict of node -> distance found
+    '''
+    costs = {source: 0}
+    frontier = [(0, source)]
+    settled = 0
+    while frontier and settled < settle_limit:
+        cost, node = heapq.heappop(frontier)
+        if cost > costs[node]:
+            continue
+        if cost > max_cost:
+            break
+        settled += 1
+        for neighbor, (weight, middle) in adjacency[node].iteritems():
+            if neighbor == avoid:
+                continue
+            new_cost = cost + weight
+            if new_cost < costs.get(neighbor, INFINITY):
+                costs[neighbor] = new_cost
+                heapq.heappush(frontier, (new_cost, neighbor))
+    return costs
+
+
+def _priority(adjacency, v, deleted_neighbors, settle_limit):
+    return len(_shortcuts(adjacency, v, settle_limit)) - len(adjacency[v]) + deleted_neighbors[v]
+
+
+def write_hierarchy(hierarchy, path=HIERARCHY_PATH):
+    '''
+    Saves a hierarchy next to the snapshot it was built from, recording
+    that snapshot's fingerprint.
+    :param hierarchy: ContractionHierarchy
+    :param path: file to write
+    :return: path
+    '''
+    fingerprint = hierarchy.graph.fingerprint or (0, 0, 0, 0)
+    sections = [('rank', hierarchy.rank), ('up_offsets', hierarchy.up_offsets),
+                ('up_targets', hierarchy.up_targets), ('up_weights', hierarchy.up_weights),
+                ('up_middles', hierarchy.up_middles)]
+    sections = [(name, values if isinstance(values, array) else array(typecode, values))
+                for (name, values), typecode in zip(sections, 'iiidi')]
+    return snapshot.write_arrays(path, MAGIC, VERSION, tuple(fingerprint) + (len(hierarchy.graph),), sections)
+
+
+def load_hierarchy(graph, path=HIERARCHY_PATH):
+    '''
+    Memory maps a saved hierarchy for graph.
+    :param graph: the CompactGraph the hierarchy was built from
+    :param path: hierarchy file
+    :return: ContractionHierarchy
+    '''
+    fields, sections, mapped = snapshot.read_arrays(path, MAGIC, VERSION)
+    if fields[-1] != len(graph) or (graph.fingerprint is not None and tuple(fields[:-1]) != tuple(graph.fingerprint)):
+        raise snapshot.SnapshotError("%s was built from a different graph, rebuild it" % path)
+    hierarchy = ContractionHierarchy(graph, sections['rank'], sections['up_offsets'], sections['up_targets'],
+                                     sections['up_weights'], sections['up_middles'])
+    hierarchy.mapped = mapped
+    return hierarchy
+
+
+def benchmark(hierarchy, queries=100, seed=0):
+    '''
+    Compares hierarchy queries with plain Dijkstra on random pairs.
+    :param hierarchy: ContractionHierarchy
+    :param queries: number of random source/target pairs
+    :param seed: random seed for the pairs
+    :return: dict of total seconds and nodes assessed for both
+    '''
+    graph = hierarchy.graph
+    rng = random.Random(seed)
+    report = {'dijkstra_time': 0.0, 'ch_time': 0.0, 'dijkstra_nodes': 0, 'ch_nodes': 0, 'mismatches': 0}
+    for query in xrange(queries):
+        source = rng.randrange(len(graph))
+        target = rng.randrange(len(graph))
+        start = time.time()
+        costs, parents, nodes_assessed = search.dijkstra(graph, source, [target])
+        report['dijkstra_time'] += time.time() - start
+        report['dijkstra_nodes'] += nodes_assessed
+        start = time.time()
+        cost, path, assessed = hierarchy.query(source, target)
+        report['ch_time'] += time.time() - start
+        report['ch_nodes'] += assessed[0] + assessed[1]
+        if abs(cost - costs[target]) > 1e-9 and not (cost == costs[target] == INFINITY):
+            report['mismatches'] += 1
+    print "%d queries: Dijkstra %.3f s, %d nodes assessed; CH %.3f s, %d nodes assessed; speedup %.1fx" % (
+        queries, report['dijkstra_time'], report['dijkstra_nodes'], report['ch_time'], report['ch_nodes'],
+        report['dijkstra_time'] / max(report['ch_time'], 1e-9))
+    if report['mismatches']:
+        print "WARNING: %d queries returned a different cost than Dijkstra" % report['mismatches']
+    return report
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'build':
+        graph = snapshot.load_compact_graph(sys.argv[2] if len(sys.argv) > 2 else snapshot.SNAPSHOT_PATH)
+        hierarchy = build_hierarchy(graph)
+        write_hierarchy(hierarchy, sys.argv[3] if len(sys.argv) > 3 else HIERARCHY_PATH)
+        benchmark(hierarchy)
+    elif command == 'bench':
+        graph = snapshot.load_compact_graph()
+        benchmark(load_hierarchy(graph), int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    else:
+        print __doc__
+        sys.exit(2)
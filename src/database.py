@@ -0,0 +1,131 @@
+import atexit
+import contextlib
+import os
+import threading
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+CONFIG_PATH = "../sensitive.config"
+DSN = "dbname='denver' user='postgres' host='localhost' password='%s'"
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8
+SHARED_KEY = 'shared'
+
+# Queries that run once per route edge or once per route, prepared once per connection
+STATEMENTS = {
+    'edge_geometry': 'SELECT the_geom FROM public.ways '
+                     'WHERE target_osm = $2 AND source_osm = $1 OR target_osm = $1 AND source_osm = $2',
+    # One row per edge of a route in route order, the shortest way when a pair has
+    # several, and whether the way runs from the route node to the next one
+    'route_edge_geometries': 'SELECT DISTINCT ON (e.ord) e.ord, w.the_geom, w.source_osm = e.s '
+                             'FROM unnest($1::bigint[], $2::bigint[]) WITH ORDINALITY AS e(s, t, ord) '
+                             'JOIN public.ways w ON w.source_osm = e.s AND w.target_osm = e.t '
+                             'OR w.source_osm = e.t AND w.target_osm = e.s '
+                             'ORDER BY e.ord, w.length',
+}
+
+_password = None
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    '''
+    Connection that remembers which STATEMENTS it has prepared.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(PooledConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def read_password():
+    '''
+    Reads the database password from the config file, once per process.
+    :return: password
+    '''
+    global _password
+    if _password is None:
+        with open(CONFIG_PATH) as f:
+            content = f.readlines()
+        _password = [x.strip() for x in content].__getitem__(0)
+    return _password
+
+
+def get_pool():
+    '''
+    Returns the module connection pool, creating it on first use.
+    A forked child gets a fresh pool instead of sharing the sockets
+    of its parent.
+    :return: psycopg2 ThreadedConnectionPool
+    '''
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = psycopg2.pool.ThreadedConnectionPool(MIN_CONNECTIONS, MAX_CONNECTIONS,
+                                                         DSN % read_password(),
+                                                         connection_factory=PooledConnection)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextlib.contextmanager
+def connection():
+    '''
+    Borrows a connection from the pool for the body of a with block.
+    The transaction is committed when the block finishes and rolled
+    back if it raises, then the connection goes back to the pool.
+    '''
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def connect_to_database():
+    '''
+    Establishes connection with database.
+    Every caller in a process gets the same long lived pooled connection,
+    so callers that never close it no longer leak connections.
+    :return: conn
+    '''
+    try:
+        return get_pool().getconn(SHARED_KEY)
+    except psycopg2.Error:
+        print "I am unable to connect to the database"
+
+
+def execute_prepared(cur, name, params):
+    '''
+    Runs one of STATEMENTS, preparing it on the cursor's connection
+    the first time it is used there.
+    :param cur: cursor of a pooled connection
+    :param name: key of STATEMENTS
+    :param params: tuple of statement parameters
+    '''
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute('PREPARE ' + name + ' AS ' + STATEMENTS[name])
+        conn.prepared.add(name)
+    cur.execute('EXECUTE ' + name + ' (' + ', '.join(['%s'] * len(params)) + ')', params)
+
+
+def close_all():
+    '''
+    Closes every connection of the pool. Registered to run at exit.
+    '''
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+atexit.register(close_all)
@@ -1,49 +1,62 @@
-import psycopg2
-import shapely.wkb
 from shapely.geometry import LineString
 from shapely.ops import linemerge
-import datetime
+import argparse
 import time
 import signal
+import checkpoint
+import ingest
+import kernels
+import session
+import database
+import geometry
+import metrics
+import results
+from search import UNIDIRECTIONAL
+
+connect_to_database = database.connect_to_database  # Re-exported for the tests
 
 INFINITY = float("inf")
+TIMEOUT = 3600
 
 
-def find_shortest_route(source, destination):
+def find_shortest_route(source, destination, mode=UNIDIRECTIONAL, snaps=None):
     '''
     Finds the shortest route between a source node and a destination node
     :param source: node to start at
     :param destination: node to finish at
+    :param mode: UNIDIRECTIONAL, BIDIRECTIONAL or CONTRACTION search
+    :param snaps: spatial.Snap of the nodes when they were found from coordinates, kept in the query metrics
     :return: a string containing the shortest path in the network from source to destination
     '''
-    id = datetime.datetime.now().strftime("%I%M%S%p%B%d%Y") #Use current exact time as ID
-    start = time.time()
-    graph = init_graph()
-    costs = init_costs(graph)
-    parents = init_parents(graph)
-    processed_nodes = []
-    # Init the source node distance to itself as 0
-    costs[source] = 0
-    parents[source] = source
-    current_node = get_min_node(costs, processed_nodes)
-    # Make a copy of the destinations
-    destinations_left = destination[:]
-    nodes_assessed = 0
-
-    while current_node is not None:
-        cost_to_current_node = costs[current_node]  # Current cost to this node
-        neighbors = graph[current_node]  # Get neighbors of current node
-        relax_neighbors(cost_to_current_node, costs, current_node, neighbors, parents)  # Relax neighboring nodes
-        processed_nodes.append(current_node)  # Add current node to processed nodes
-        if current_node in destinations_left:
-            destinations_left.remove(current_node)
-            if destinations_left.__len__() is 0:
-                break
-        current_node = get_min_node(costs, processed_nodes)  # Get next node with shortest distance
-        nodes_assessed = nodes_assessed + 1
-    end = time.time()
-    total_time = end - start
-    return display_shortest_route(parents, source, destination, total_time, id, nodes_assessed)
+    id = results.run_id()  # Same UUID for every route of this run
+    query_metrics = metrics.start('dijkstra', source, destination)
+    if query_metrics is not None and snaps:
+        query_metrics.add_snaps(snaps)
+    with metrics.profiled('dijkstra'):
+        with metrics.phase(query_metrics, metrics.GRAPH_LOAD):
+            routing_session = session.get_session()
+        start = time.time()
+        result = routing_session.dijkstra(source, destination, mode, query_metrics)
+        end = time.time()
+        total_time = end - start
+        route = display_shortest_route(result.parents, source, destination, total_time, id, result.nodes_assessed,
+                                       query_metrics)
+    if query_metrics is not None:
+        query_metrics.emit()
+    return route
+
+
+def find_shortest_route_by_coordinates(source_point, destination_points, mode=UNIDIRECTIONAL):
+    '''
+    Finds the shortest routes between coordinates, each snapped to its
+    nearest routable vertex with the session's spatial index
+    :param source_point: (lon, lat) to start at
+    :param destination_points: list of (lon, lat) to finish at
+    :param mode: UNIDIRECTIONAL, BIDIRECTIONAL or CONTRACTION search
+    :return: same as find_shortest_route
+    '''
+    snaps = session.get_session().snap([source_point] + list(destination_points))
+    return find_shortest_route(snaps[0].osm_id, [snap.osm_id for snap in snaps[1:]], mode, snaps)
 
 
 def init_graph():
@@ -53,48 +66,19 @@ def init_graph():
     :return: graph
     '''
     graph = {}
-    conn = connect_to_database()
-    cur = conn.cursor()
-    cur.execute('SELECT osm_id FROM ways_vertices_pgr')
-    row = cur.fetchone()
-    while row:
-        graph[float(row[0])] = {}
-        row = cur.fetchone()
+    with database.connection() as conn:
+        for row in ingest.iter_rows(conn, 'SELECT osm_id FROM ways_vertices_pgr'):
+            graph[float(row[0])] = {}
 
-    cur.execute('SELECT source_osm, target_osm, length FROM ways')
-    row = cur.fetchone()
-    while row:
-        c1 = float(row[0])
-        c2 = float(row[1])
-        # print "c1: " + str(c1)
-        # print "c2: " + str(c2)
-        graph[c1][c2] = float(row[2])
-        graph[c2][c1] = float(row[2])
-        row = cur.fetchone()
+        for row in ingest.iter_rows(conn, 'SELECT source_osm, target_osm, length FROM ways'):
+            c1 = float(row[0])
+            c2 = float(row[1])
+            graph[c1][c2] = float(row[2])
+            graph[c2][c1] = float(row[2])
 
     return graph
 
 
-def connect_to_database():
-    '''
-    Establishes connection with database.
-    :return: conn
-    '''
-    # Read password in from config
-    with open("../sensitive.config") as f:
-        content = f.readlines()
-    password = [x.strip() for x in content]
-
-    # Establish connection
-    try:
-        conn = psycopg2.connect(
-            "dbname='denver' user='postgres' host='localhost' password='" + password.__getitem__(0) + "'")
-        return conn
-    except:
-        print("I am unable to connect to the database")
-        print("dbname='denver' user='postgres' host='localhost' password='" + password.__getitem__(0) + "'")
-
-
 def init_costs(graph):
     '''
     Initializes the costs hash table for
@@ -124,106 +108,71 @@ def init_parents(graph):
     return parents
 
 
-def get_min_node(costs, processed_nodes):
-    '''
-    Returns the min node so far from costs
-    :param costs:
-    :param processed_nodes:
-    :return: min_node
-    '''
-    min_node_cost = INFINITY  # Set current min to inf
-    min_node = None  # Set current node to null
-    for node in costs:  # For every node in costs
-        # If the node is smaller than the current smallest AND the node has not yet been processed
-        if costs[node] < min_node_cost and node not in processed_nodes:
-            # New current min node
-            min_node_cost = costs[node]
-            min_node = node
-    return min_node
-
-
-def relax_neighbors(cost_to_current_node, costs, current_node, neighbors, parents):
-    '''
-    Relaxing neighbors is the process of checking each neighbor of a node and updating
-    our shortest costs if this new route is shorter.
-    :param cost_to_current_node:
-    :param costs:
-    :param current_node:
-    :param neighbors:
-    :param parents:
-    :return:
-    '''
-    for neighbor in neighbors:  # For each neighbor...
-        new_distance_to_neighbor = cost_to_current_node + neighbors[neighbor]  # Get the new distance to this neighbor
-        current_distance_to_neighbor = costs[neighbor]  # Get the current distance to this neighbor
-        # If it is cheaper to go this way to this neighbor then add that as the shortest cost from the source
-        if new_distance_to_neighbor < current_distance_to_neighbor:
-            costs[neighbor] = new_distance_to_neighbor
-            parents[neighbor] = current_node
-            # We have now relaxed all of the current nodes neighbors
-    return len(neighbors)
-
-
-def display_shortest_route(parents, source, destinations, total_time, id, node_assessed):
+def display_shortest_route(parents, source, destinations, total_time, id, node_assessed, query_metrics=None):
     '''
     Creates a shortest route string in easy to read
     language.
     :param parents: parent nodes
     :param source:  source node
     :param destinations: destination node
+    :param query_metrics: optional metrics.QueryMetrics
     :return: a string with the shortest path from source to destination
     '''
     shortest_routes = []
-    for current_destination in destinations:
-        points_of_line = []
-        points_of_line.append(current_destination)
-        current_node = parents[current_destination]
-        while current_node is not source:
-            points_of_line.append(current_node)
-            current_node = parents[current_node]
+    with metrics.phase(query_metrics, metrics.PATH_RECONSTRUCTION):
+        for current_destination in destinations:
+            points_of_line = []
+            points_of_line.append(current_destination)
+            current_node = parents[current_destination]
+            while current_node != source:
+                points_of_line.append(current_node)
+                current_node = parents[current_node]
+            if current_destination != source:
+                points_of_line.append(source)
             shortest_routes.append(points_of_line)
-    return create_shortest_route_geom(shortest_routes, total_time, id, node_assessed, source, destinations)
+    return create_shortest_route_geom(shortest_routes, total_time, id, node_assessed, source, destinations,
+                                      query_metrics)
 
 
 
-def create_shortest_route_geom(shortest_routes, total_time, id, nodes_assessed, original_source, original_destinations):
+def create_shortest_route_geom(shortest_routes, total_time, id, nodes_assessed, original_source, original_destinations,
+                               query_metrics=None):
     '''
     Exports the shortest route as a GIS geom to display in QGIS, along with time and id for analysis purposes
     :param shortest_routes:
     :param total_time:
     :param id:
+    :param query_metrics: optional metrics.QueryMetrics
     :return:
     '''
-    conn = connect_to_database()
-    cur = conn.cursor()
-    shortest_route_geoms = []
-    for route in shortest_routes:
-        lines = []
-        for index, node in enumerate(route):
-            try:
-                source = str(int(node))
-                target = str(int(route[index + 1]))
-                query = 'SELECT the_geom FROM public.ways WHERE target_osm = ' + target + ' AND source_osm = ' + source + ' OR target_osm = ' + source + ' AND source_osm = ' + target + ';'
-                cur.execute(query)
-                hex_geom = cur.fetchone()
-                geom = shapely.wkb.loads(hex_geom[0], hex=True)
-                lines.append(geom)
-            except IndexError:
-                print "Last element"
-        total_geom = linemerge(lines)
-        shortest_route_geoms.append(total_geom)
+    with metrics.phase(query_metrics, metrics.GEOMETRY_FETCH), database.connection() as conn:
+        cur = conn.cursor()
+        shortest_route_geoms = []
+        for route in shortest_routes:
+            total_geom = linemerge(geometry.route_lines(route, cur, query_metrics))
+            shortest_route_geoms.append(total_geom)
     index_of_shortest_geom = 0
     shortest_length = 0
     for index, route_geom in enumerate(shortest_route_geoms):
         if route_geom.length <= shortest_length:
             index_of_shortest_geom = index
     hex_shortest_route_geom = LineString(shortest_route_geoms[index_of_shortest_geom]).wkb_hex
-    insert_query = """INSERT INTO public.results_dijkstras_one_to_one(the_geom, total_time, id, nodes_assessed, source, destinations) VALUES (st_geomfromwkb(%(geom)s::geometry, 4326), %(total_time)s, %(id)s, %(nodes_assessed)s, %(source)s, %(destinations)s)"""
-    cur.execute(insert_query, {'geom': hex_shortest_route_geom, 'total_time': total_time, 'id': id, 'nodes_assessed': nodes_assessed, 'source': original_source, 'destinations': original_destinations})
-    conn.commit()
+    writer = results.get_writer(results.DIJKSTRAS)
+    flushes = writer.flushes
+    with metrics.phase(query_metrics, metrics.DB_WRITE):
+        writer.add(hex_shortest_route_geom, total_time, id, nodes_assessed, original_source, original_destinations)
+    if query_metrics is not None:
+        query_metrics.count('db_round_trips', writer.flushes - flushes)
     return shortest_route_geoms[index_of_shortest_geom], total_time, id, nodes_assessed, original_source, original_destinations
 
-def run_experiment(sources_dataset, destinations_dataset):
+def run_experiment(pairs, progress=None, timeout=TIMEOUT):
+    '''
+    Routes the pairs one after the other, each from its larger osm_id.
+    :param pairs: iterable of (source, destination), e.g. checkpoint.read_pairs(path)
+    :param progress: optional checkpoint.Checkpoint, its answered pairs are skipped and new answers recorded
+    :param timeout: seconds after which a pair is given up
+    :return: number of pairs routed
+    '''
     print ("Start")
     class TimeoutException(Exception):  # Custom exception class
         pass
@@ -233,34 +182,46 @@ def run_experiment(sources_dataset, destinations_dataset):
 
     signal.signal(signal.SIGALRM, timeout_handler)
 
-    for index, source in enumerate(sources_dataset):
-        d = destinations_dataset[index]
-        s = sources_dataset[index]
-        signal.alarm(3600)
+    if progress is not None:
+        pending = progress.pending(pairs)
+    else:
+        pending = ((index, s, d) for index, (s, d) in enumerate(pairs))
+    count = 0
+    for index, s, d in pending:
+        count = count + 1
+        signal.alarm(timeout)
         try:
             try:
-                if destinations_dataset[index] > sources_dataset[index]:
-                    print(find_shortest_route(destinations_dataset[index], [sources_dataset[index]]))
+                if d > s:
+                    print(find_shortest_route(d, [s]))
                 else:
-                    print(find_shortest_route(sources_dataset[index], [destinations_dataset[index]]))
+                    print(find_shortest_route(s, [d]))
+                status = checkpoint.DONE
             except KeyError:
                 print str(d) + " " + str(s) + " have Key Errors!!!!"
+                status = checkpoint.MISSING
+            signal.alarm(0)
         except TimeoutException:
-            print str(d) + " " + str(s) + " took over 60 minutes"
-
+            print str(d) + " " + str(s) + " took over %d seconds" % timeout
+            results.flush_all()
+            status = checkpoint.TIMED_OUT
+        if progress is not None:
+            progress.record(index, status)
+
+    results.close_all()
+    print "Total rows is %d" % count
     print("DONE!")
-
-sources_dataset = []
-destinations_dataset = []
-
-import csv
-count = 0
-with open('denverpoints.csv', 'rb') as f:
-    reader = csv.reader(f)
-    for row in reader:
-        count = count + 1
-        sources_dataset.append(float(row[0]))
-        destinations_dataset.append(float(row[1]))
-print "Total rows is %d" % count
-
-run_experiment(sources_dataset, destinations_dataset)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Route every pair of an experiment file with Dijkstra's algorithm.")
+    checkpoint.add_arguments(parser)
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help='seconds per pair')
+    parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None, help='search kernels, see kernels.py')
+    arguments = parser.parse_args()
+    metrics.configure_from_environment()
+    if arguments.kernels:
+        kernels.set_backend(arguments.kernels)
+    with checkpoint.from_arguments(arguments, results.DIJKSTRAS) as progress:
+        run_experiment(checkpoint.read_pairs(arguments.pairs), progress, arguments.timeout)
@@ -0,0 +1,232 @@
+'''
+Route geometry from the ways table.
+
+The lines of a whole route are fetched with one query, an unnest of its
+source and target arrays, instead of one query per edge. Alternatively
+an EdgeGeometryStore holds every way's coordinates in memory, loaded
+from the database or from a geometry file in the snapshot format, and
+no query is made at all. Both return each edge oriented from its route
+node to the next one, so linemerge gets lines that join end to start.
+
+Usage:
+    python geometry.py export [path]
+'''
+from array import array
+import os
+import sys
+import time
+import shapely.wkb
+from shapely.geometry import LineString
+import database
+import ingest
+import snapshot
+
+MAGIC = 'RGGEOM\0\0'
+VERSION = 1
+GEOMETRY_PATH = 'denver.geometry'
+GEOMETRY_QUERY = 'SELECT source_osm, target_osm, ST_AsBinary(the_geom) FROM ways ORDER BY length DESC'
+
+_store = None
+_store_loaded = False
+
+
+class EdgeGeometryStore(object):
+    '''
+    Coordinates of every way keyed by its (source_osm, target_osm) pair.
+    Way k runs through lons/lats[offsets[k]:offsets[k + 1]], from
+    sources[k] to targets[k].
+    '''
+
+    def __init__(self, sources, targets, offsets, lons, lats):
+        self.sources = sources
+        self.targets = targets
+        self.offsets = offsets
+        self.lons = lons
+        self.lats = lats
+        self.index = {}
+        for k in xrange(len(sources)):
+            self.index[(int(sources[k]), int(targets[k]))] = k
+
+    def __len__(self):
+        return len(self.index)
+
+    def line(self, source, target):
+        '''
+        :param source: osm_id the line should start at
+        :param target: osm_id the line should end at
+        :return: LineString from source to target, or None if no way joins them
+        '''
+        source = int(source)
+        target = int(target)
+        k = self.index.get((source, target))
+        forward = k is not None
+        if not forward:
+            k = self.index.get((target, source))
+            if k is None:
+                return None
+        start = self.offsets[k]
+        end = self.offsets[k + 1]
+        coordinates = zip(self.lons[start:end], self.lats[start:end])
+        if not forward:
+            coordinates.reverse()
+        return LineString(coordinates)
+
+    def route_lines(self, route):
+        '''
+        :param route: list of osm_id
+        :return: list of LineString, one per edge of route that has a way
+        '''
+        lines = []
+        for source, target in route_edges(route):
+            line = self.line(source, target)
+            if line is not None:
+                lines.append(line)
+        return lines
+
+
+def route_edges(route):
+    '''
+    :param route: list of osm_id
+    :return: list of (source_osm, target_osm) int pairs of consecutive nodes
+    '''
+    return [(int(route[index]), int(route[index + 1])) for index in xrange(len(route) - 1)]
+
+
+def oriented(geom, forward):
+    '''
+    :param geom: line of a way
+    :param forward: whether the way already runs in route direction
+    :return: the line running in route direction
+    '''
+    if forward or geom.geom_type != 'LineString':
+        return geom
+    return LineString(list(geom.coords)[::-1])
+
+
+def fetch_route_lines(cur, route):
+    '''
+    The lines of every edge of route with a single query.
+    :param cur: cursor of a pooled connection
+    :param route: list of osm_id
+    :return: list of lines in route order
+    '''
+    edges = route_edges(route)
+    if not edges:
+        return []
+    database.execute_prepared(cur, 'route_edge_geometries',
+                              ([source for source, target in edges], [target for source, target in edges]))
+    return [oriented(shapely.wkb.loads(hex_geom, hex=True), forward) for position, hex_geom, forward in cur.fetchall()]
+
+
+def route_lines(route, cur, query_metrics=None):
+    '''
+    The lines of every edge of route, from the shared store when there
+    is one and otherwise from the database.
+    :param route: list of osm_id
+    :param cur: cursor of a pooled connection
+    :param query_metrics: optional metrics.QueryMetrics to count the database round trip in
+    :return: list of lines in route order
+    '''
+    store = get_store()
+    if store is not None:
+        return store.route_lines(route)
+    if query_metrics is not None:
+        query_metrics.count('db_round_trips')
+    return fetch_route_lines(cur, route)
+
+
+def load_geometry_store(conn, verbose=True):
+    '''
+    Reads the coordinates of every way. When a pair of nodes has several
+    ways, in either direction, the shortest is kept, the same one
+    fetch_route_lines picks.
+    :param conn: open database connection
+    :param verbose: print rows/s
+    :return: EdgeGeometryStore
+    '''
+    start = time.time()
+    positions = {}
+    ways = []
+    for source_osm, target_osm, wkb in ingest.iter_rows(conn, GEOMETRY_QUERY):
+        key = (int(source_osm), int(target_osm))
+        pair = (min(key), max(key))  # line() reads a way in both directions
+        if pair in positions:
+            ways[positions[pair]] = None  # Rows come longest first, the later one is shorter
+        positions[pair] = len(ways)
+        ways.append((key, shapely.wkb.loads(str(wkb)).coords))
+    sources = array('d')
+    targets = array('d')
+    offsets = array('i', [0])
+    lons = array('d')
+    lats = array('d')
+    for way in ways:
+        if way is None:
+            continue
+        (source_osm, target_osm), coordinates = way
+        sources.append(source_osm)
+        targets.append(target_osm)
+        for coordinate in coordinates:
+            lons.append(coordinate[0])
+            lats.append(coordinate[1])
+        offsets.append(len(lons))
+    if verbose:
+        print "Loaded %d way geometries, %d points in %.1f seconds" % (len(sources), len(lons), time.time() - start)
+    return EdgeGeometryStore(sources, targets, offsets, lons, lats)
+
+
+def write_geometry_store(store, path=GEOMETRY_PATH, fingerprint=(0, 0, 0, 0)):
+    '''
+    :param store: EdgeGeometryStore
+    :param path: file to write
+    :param fingerprint: source_fingerprint of the tables the store was read from
+    :return: path
+    '''
+    sections = [('sources', store.sources), ('targets', store.targets), ('offsets', store.offsets),
+                ('lons', store.lons), ('lats', store.lats)]
+    return snapshot.write_arrays(path, MAGIC, VERSION, fingerprint, sections)
+
+
+def load_geometry_file(path=GEOMETRY_PATH):
+    '''
+    :param path: file written by write_geometry_store
+    :return: EdgeGeometryStore over the memory mapped file
+    '''
+    fields, sections, mapped = snapshot.read_arrays(path, MAGIC, VERSION)
+    store = EdgeGeometryStore(sections['sources'], sections['targets'], sections['offsets'],
+                              sections['lons'], sections['lats'])
+    store.fingerprint = fields
+    store.mapped = mapped
+    return store
+
+
+def get_store():
+    '''
+    The store shared by route output in this process: the one set with
+    set_store, else GEOMETRY_PATH when it exists, else None.
+    :return: EdgeGeometryStore or None
+    '''
+    global _store, _store_loaded
+    if not _store_loaded:
+        if os.path.exists(GEOMETRY_PATH):
+            _store = load_geometry_file(GEOMETRY_PATH)
+        _store_loaded = True
+    return _store
+
+
+def set_store(store):
+    '''
+    :param store: EdgeGeometryStore, or None to fetch geometry from the database
+    '''
+    global _store, _store_loaded
+    _store = store
+    _store_loaded = True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'export':
+        print __doc__
+        sys.exit(2)
+    with database.connection() as conn:
+        fingerprint = snapshot.source_fingerprint(conn)
+        store = load_geometry_store(conn)
+    write_geometry_store(store, sys.argv[2] if len(sys.argv) > 2 else GEOMETRY_PATH, fingerprint)
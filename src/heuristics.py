@@ -0,0 +1,91 @@
+import math
+
+PLANAR = 'planar'  # Straight line in degrees, same as ST_Distance on SRID 4326 points
+HAVERSINE = 'haversine'  # Great circle distance in degrees of arc, the unit of the edge weights
+ALT = 'alt'  # Landmark lower bounds, see landmarks.py
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_METERS * math.pi / 180  # Of a great circle
+
+
+def planar_distance(source_coords, destination_coords):
+    '''
+    Euclidean distance between two lon/lat pairs in degrees.
+    This is what PostGIS ST_Distance returns for SRID 4326
+    geometries, and the same unit as the length column of ways.
+    :param source_coords: (lon, lat)
+    :param destination_coords: (lon, lat)
+    :return: distance in degrees
+    '''
+    d_lon = source_coords[0] - destination_coords[0]
+    d_lat = source_coords[1] - destination_coords[1]
+    return math.sqrt(d_lon * d_lon + d_lat * d_lat)
+
+
+def haversine_distance(source_coords, destination_coords):
+    '''
+    Great circle distance between two lon/lat pairs.
+    Only a valid A* lower bound when the edge weights are in meters too.
+    :param source_coords: (lon, lat)
+    :param destination_coords: (lon, lat)
+    :return: distance in meters
+    '''
+    lon1, lat1 = math.radians(source_coords[0]), math.radians(source_coords[1])
+    lon2, lat2 = math.radians(destination_coords[0]), math.radians(destination_coords[1])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def arc_distance(source_coords, destination_coords):
+    '''
+    Great circle distance between two lon/lat pairs in degrees of arc.
+    It is never more than planar_distance, since a degree of longitude
+    shrinks away from the equator, so it is a valid A* lower bound for
+    edge weights in degrees, unlike haversine_distance in meters.
+    :param source_coords: (lon, lat)
+    :param destination_coords: (lon, lat)
+    :return: distance in degrees
+    '''
+    return haversine_distance(source_coords, destination_coords) / METERS_PER_DEGREE
+
+
+METRICS = {PLANAR: planar_distance, HAVERSINE: arc_distance}
+
+
+def make_compact_heuristic(graph, destination, metric=PLANAR):
+    '''
+    Builds the straight line heuristic for one query on a CompactGraph
+    that carries its own vertex coordinates. Distances to the fixed
+    destination are memoized, since a node is usually relaxed from
+    several of its neighbors.
+    :param graph: CompactGraph with lons and lats
+    :param destination: destination node index
+    :param metric: PLANAR or HAVERSINE
+    :return: function of a node index giving its distance to destination
+    '''
+    distance = METRICS[metric]
+    lons = graph.lons
+    lats = graph.lats
+    destination_coords = (lons[destination], lats[destination])
+    memo = {}
+
+    def heuristic(node):
+        value = memo.get(node)
+        if value is None:
+            value = distance((lons[node], lats[node]), destination_coords)
+            memo[node] = value
+        return value
+    return heuristic
+
+
+def average_potential(to_target, to_source):
+    '''
+    Forward potential for bidirectional A*, (h_target(v) - h_source(v)) / 2.
+    The backward search uses its negation, and both stay consistent
+    whenever the two straight line heuristics are.
+    :param to_target: heuristic toward the target
+    :param to_source: heuristic toward the source
+    :return: function of a node index
+    '''
+    def potential(node):
+        return (to_target(node) - to_source(node)) * 0.5
+    return potential
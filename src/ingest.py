@@ -0,0 +1,158 @@
+'''
+Bulk loading of the routing graph from PostGIS.
+
+COPY streams each table as tab separated text straight into the graph
+arrays, a chunk at a time, so no row tuples are created or kept and
+peak memory is the arrays themselves. CURSOR uses a named (server side)
+cursor read in fetchmany batches, and FETCHONE is the row at a time
+loop init_graph used, kept as the baseline to compare against.
+
+Usage:
+    python ingest.py [copy|cursor|fetchone]
+'''
+from array import array
+import sys
+import time
+import compact_graph
+import database
+
+COPY = 'copy'
+CURSOR = 'cursor'
+FETCHONE = 'fetchone'
+BATCH_SIZE = 20000
+COPY_CHUNK_SIZE = 1 << 20
+VERTEX_QUERY = 'SELECT osm_id, lon, lat FROM ways_vertices_pgr'
+EDGE_QUERY = 'SELECT source_osm, target_osm, length FROM ways'
+
+
+class CopySink(object):
+    '''
+    File-like target for cursor.copy_expert. Every complete line of a
+    chunk is split into its columns and handed to handle_row, a partial
+    last line is carried over to the next chunk.
+    '''
+
+    def __init__(self, handle_row):
+        '''
+        :param handle_row: called with the list of column strings of each row
+        '''
+        self.handle_row = handle_row
+        self.rows = 0
+        self.remainder = ''
+
+    def write(self, data):
+        lines = (self.remainder + data).split('\n')
+        self.remainder = lines.pop()
+        handle_row = self.handle_row
+        for line in lines:
+            handle_row(line.split('\t'))
+        self.rows += len(lines)
+
+    def close(self):
+        if self.remainder:
+            self.handle_row(self.remainder.split('\t'))
+            self.rows += 1
+            self.remainder = ''
+
+
+def iter_rows(conn, query, method=CURSOR, batch_size=BATCH_SIZE):
+    '''
+    Yields the rows of query one by one.
+    :param conn: open database connection
+    :param query: SELECT statement
+    :param method: CURSOR for server side fetchmany batches, FETCHONE for one row per call
+    :param batch_size: rows per fetchmany
+    '''
+    if method == FETCHONE:
+        cur = conn.cursor()
+        cur.execute(query)
+        row = cur.fetchone()
+        while row:
+            yield row
+            row = cur.fetchone()
+        return
+    cur = conn.cursor(name='ingest')
+    cur.itersize = batch_size
+    cur.execute(query)
+    try:
+        rows = cur.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                yield row
+            rows = cur.fetchmany(batch_size)
+    finally:
+        cur.close()
+
+
+def stream_table(conn, query, handle_row, method=COPY):
+    '''
+    Feeds every row of query to handle_row, as strings for COPY
+    or as database values for the cursor methods.
+    :param conn: open database connection
+    :param query: SELECT statement
+    :param handle_row: called with each row
+    :param method: COPY, CURSOR or FETCHONE
+    :return: number of rows
+    '''
+    if method == COPY:
+        sink = CopySink(handle_row)
+        conn.cursor().copy_expert('COPY (' + query + ') TO STDOUT', sink, COPY_CHUNK_SIZE)
+        sink.close()
+        return sink.rows
+    rows = 0
+    for row in iter_rows(conn, query, method):
+        handle_row(row)
+        rows += 1
+    return rows
+
+
+def load_compact_graph(conn, method=COPY, verbose=True):
+    '''
+    Builds a CompactGraph with coordinates from ways_vertices_pgr and ways.
+    :param conn: open database connection
+    :param method: COPY, CURSOR or FETCHONE
+    :param verbose: print rows per second and total load time
+    :return: CompactGraph
+    '''
+    start = time.time()
+    vertex_ids = array(compact_graph.ID_TYPE)
+    lons = array(compact_graph.COORDINATE_TYPE)
+    lats = array(compact_graph.COORDINATE_TYPE)
+
+    def add_vertex(row):
+        vertex_ids.append(float(row[0]))
+        lons.append(float(row[1]))
+        lats.append(float(row[2]))
+
+    vertex_rows = stream_table(conn, VERTEX_QUERY, add_vertex, method)
+    vertex_time = time.time() - start
+    ids, lons, lats, index = compact_graph.index_vertices(vertex_ids, lons, lats)
+
+    edge_start = time.time()
+    sources = array(compact_graph.INDEX_TYPE)
+    targets = array(compact_graph.INDEX_TYPE)
+    weights = array(compact_graph.WEIGHT_TYPE)
+
+    def add_edge(row):
+        compact_graph.add_edge(index, sources, targets, weights, row[0], row[1], row[2])
+
+    edge_rows = stream_table(conn, EDGE_QUERY, add_edge, method)
+    edge_time = time.time() - edge_start
+    graph = compact_graph.csr_from_edges(ids, sources, targets, weights, lons, lats)
+    total_time = time.time() - start
+    if verbose:
+        print "ways_vertices_pgr: %d rows in %.2f seconds (%d rows/s)" % (
+            vertex_rows, vertex_time, vertex_rows / max(vertex_time, 1e-9))
+        print "ways: %d rows in %.2f seconds (%d rows/s)" % (
+            edge_rows, edge_time, edge_rows / max(edge_time, 1e-9))
+        print "Graph loaded with %s in %.2f seconds" % (method, total_time)
+    return graph
+
+
+if __name__ == '__main__':
+    method = sys.argv[1] if len(sys.argv) > 1 else COPY
+    if method not in (COPY, CURSOR, FETCHONE):
+        print __doc__
+        sys.exit(2)
+    with database.connection() as conn:
+        load_compact_graph(conn, method)
@@ -0,0 +1,127 @@
+'''
+Vectorized heuristic for A* over a CompactGraph.
+
+The numpy backend computes the straight line distance from every vertex
+to the destination in one array operation, and the scalar A* of
+search.py reads its estimates from that table instead of calling the
+distance function once per relaxed node. The python backend is the same
+search with the memoized heuristic of heuristics.py, and is used
+whenever numpy cannot be imported. Dijkstra has no heuristic and runs
+the scalar search with either backend.
+
+The table costs time in the size of the graph on every query, and only
+pays once the search settles a good part of it: on a 250k node random
+geometric graph it takes about 9 ms, which makes short trips some forty
+times slower, while random pairs come out 2% faster. Relaxing whole
+neighbor slices with numpy was tried as well and lost everywhere, since
+a road graph vertex has three or four edges and an array operation costs
+about a microsecond whatever its length. `python benchmark.py kernels`
+times both backends over trips of increasing length to show where each
+one wins.
+
+The backend can be set from the environment, read on the first query:
+    ROUTING_KERNELS=numpy
+'''
+import os
+import warnings
+import heuristics
+import search
+import snapshot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PYTHON = 'python'
+NUMPY = 'numpy'
+BACKENDS = (PYTHON, NUMPY)
+
+_backend = None  # Read from ROUTING_KERNELS on first use unless set_backend was called
+
+
+def get_backend():
+    '''
+    :return: NUMPY when it is set and numpy can be imported, otherwise PYTHON
+    '''
+    global _backend
+    if _backend is None:
+        _backend = _environment_backend()
+    if _backend == NUMPY and numpy is None:
+        return PYTHON
+    return _backend
+
+
+def _environment_backend():
+    '''
+    :return: the backend named by ROUTING_KERNELS, PYTHON with a warning when it names none
+    '''
+    backend = os.environ.get('ROUTING_KERNELS') or PYTHON
+    if backend not in BACKENDS:
+        warnings.warn("Ignoring ROUTING_KERNELS=%s, expected one of %s" % (backend, ', '.join(BACKENDS)))
+        return PYTHON
+    return backend
+
+
+def set_backend(backend):
+    '''
+    Chooses the search kernels of every session in this process.
+    :param backend: PYTHON or NUMPY
+    '''
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError("Unknown kernel backend %r, expected one of %s" % (backend, ', '.join(BACKENDS)))
+    _backend = backend
+
+
+def as_numpy(values):
+    '''
+    :param values: array.array, or numpy array memory mapped from a snapshot
+    :return: numpy array sharing the memory of values
+    '''
+    if isinstance(values, numpy.ndarray):
+        return values
+    return numpy.frombuffer(values, dtype=snapshot.NUMPY_TYPES[values.typecode])
+
+
+def heuristic_table(graph, destination, metric=heuristics.PLANAR):
+    '''
+    The straight line distance from every vertex to destination, computed
+    in one numpy operation, or vertex by vertex without numpy.
+    :param graph: CompactGraph with lons and lats
+    :param destination: destination node index
+    :param metric: PLANAR or HAVERSINE
+    :return: numpy array, or list without numpy, indexed by node
+    '''
+    if metric not in heuristics.METRICS:
+        raise ValueError("No straight line table for the %r heuristic" % metric)
+    if numpy is None:
+        distance = heuristics.METRICS[metric]
+        lons = graph.lons
+        lats = graph.lats
+        destination_coords = (lons[destination], lats[destination])
+        return [distance((lons[node], lats[node]), destination_coords) for node in xrange(len(graph))]
+    lons = as_numpy(graph.lons)
+    lats = as_numpy(graph.lats)
+    if metric == heuristics.PLANAR:
+        return numpy.hypot(lons - lons[destination], lats - lats[destination])
+    lon1 = numpy.radians(lons)
+    lat1 = numpy.radians(lats)
+    lon2 = lon1[destination]
+    lat2 = lat1[destination]
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return numpy.degrees(2 * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a))))
+
+
+def astar(graph, source, target, table, stats=None, workspace=None):
+    '''
+    search.astar reading the heuristic from a table instead of computing it.
+    :param graph: CompactGraph
+    :param source: index of the node to start at
+    :param target: index of the node to finish at
+    :param table: lower bound of every node's distance to target, see heuristic_table
+    :param stats: optional dict, heap and relaxation counts are added to it
+    :param workspace: optional search.SearchWorkspace to reuse instead of allocating per search
+    :return: costs, parents, nodes_assessed
+    '''
+    return search.astar(graph, source, target, table.__getitem__, stats, workspace)
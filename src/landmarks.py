@@ -0,0 +1,241 @@
+'''
+Landmark (ALT) lower bounds for A*.
+
+A handful of landmarks are picked far apart from each other, and the exact
+distance from every landmark to every vertex is stored as float32. By the
+triangle inequality |d(L, t) - d(L, v)| <= d(v, t) for every landmark L,
+and the largest of those differences is the ALT heuristic.
+
+Longer roads only raise distances, so the bounds stay valid when edge
+weights go up in place. When one goes down the landmarks are dropped,
+and rebuilt in the background when the service watches updates, see
+updates.py.
+
+Usage:
+    python landmarks.py build [count]
+    python landmarks.py bench [queries]
+'''
+from array import array
+import random
+import sys
+import time
+import heuristics
+import search
+import snapshot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'RGALT\0\0\0'
+VERSION = 2  # 2 saves the rounding slack of every landmark
+LANDMARKS_PATH = 'denver.landmarks'
+LANDMARK_COUNT = 16
+DISTANCE_TYPE = 'f'  # float32, half the memory of the graph weights
+FLOAT32_EPSILON = 2.0 ** -23
+INFINITY = float("inf")
+
+
+class Landmarks(object):
+    '''
+    Distances from K landmarks to all n vertices of a CompactGraph,
+    landmark k's distance to vertex v at distances[k * n + v].
+    '''
+
+    def __init__(self, graph, indices, distances, slack=None):
+        '''
+        :param graph: the CompactGraph the distances were computed on
+        :param indices: node index of every landmark
+        :param distances: flat float32 array of K * n distances
+        :param slack: rounding slack of every landmark as saved with them, computed when not given
+        '''
+        self.graph = graph
+        self.indices = indices
+        self.distances = distances
+        # float32 rounding may push a difference just above the true
+        # distance, so every bound is lowered by the largest rounding error
+        if slack is None:
+            slack = rounding_slack(distances, len(graph), len(indices))
+        self.slack = [float(value) for value in slack]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def lower_bound(self, node, destination):
+        '''
+        :param node: node index
+        :param destination: node index
+        :return: ALT lower bound of the distance between them
+        '''
+        return self.make_heuristic(destination)(node)
+
+    def make_heuristic(self, destination):
+        '''
+        Builds the ALT heuristic for one query, memoized like the straight line one.
+        :param destination: destination node index
+        :return: function of a node index giving a lower bound of its distance to destination
+        '''
+        n = len(self.graph)
+        distances = self.distances
+        landmarks = [(k * n, float(distances[k * n + destination]), self.slack[k]) for k in xrange(len(self.indices))]
+        memo = {}
+
+        def heuristic(node):
+            value = memo.get(node)
+            if value is None:
+                value = 0.0
+                for offset, to_destination, slack in landmarks:
+                    to_node = distances[offset + node]
+                    if to_node == INFINITY or to_destination == INFINITY:
+                        if to_node != to_destination:
+                            value = INFINITY  # Different components
+                        continue
+                    bound = abs(to_destination - to_node) - slack
+                    if bound > value:
+                        value = bound
+                memo[node] = value
+            return value
+        return heuristic
+
+
+def rounding_slack(distances, n, count):
+    '''
+    :param distances: flat float32 array of count * n distances
+    :return: list of twice the float32 rounding error of each landmark's largest finite distance
+    '''
+    slack = []
+    for k in xrange(count):
+        if numpy is not None:
+            row = numpy.asarray(distances[k * n:(k + 1) * n], dtype=numpy.float64)
+            finite = row[row != INFINITY]
+            largest = float(finite.max()) if len(finite) else None
+        else:
+            finite = [d for d in distances[k * n:(k + 1) * n] if d != INFINITY]
+            largest = max(finite) if finite else None
+        slack.append(2 * FLOAT32_EPSILON * largest if largest is not None else 0.0)
+    return slack
+
+
+def select_landmarks(graph, count=LANDMARK_COUNT, seed=0, verbose=True):
+    '''
+    Farthest point selection: starting from a random vertex, each new
+    landmark is the vertex farthest from all the landmarks picked so far.
+    The distances found on the way are the ones kept.
+    :param graph: CompactGraph
+    :param count: number of landmarks K
+    :param seed: seed for the starting vertex
+    :param verbose: print progress
+    :return: Landmarks
+    '''
+    start = time.time()
+    n = len(graph)
+    count = min(count, n)
+    rng = random.Random(seed)
+    costs, parents, nodes_assessed = search.dijkstra(graph, rng.randrange(n), [])
+    nearest = list(costs)
+    indices = array('i')
+    distances = array(DISTANCE_TYPE)
+    while len(indices) < count:
+        landmark = _farthest(nearest, indices)
+        if landmark is None:
+            break  # Fewer vertices in the component than landmarks asked for
+        costs, parents, nodes_assessed = search.dijkstra(graph, landmark, [])
+        indices.append(landmark)
+        distances.extend(costs)
+        for v in xrange(n):
+            if costs[v] < nearest[v]:
+                nearest[v] = costs[v]
+        if verbose:
+            print "Landmark %d of %d: node %d" % (len(indices), count, landmark)
+    if verbose:
+        print "Selected %d landmarks in %.1f seconds, %.1f MB of distances" % (
+            len(indices), time.time() - start, len(distances) * distances.itemsize / 1e6)
+    return Landmarks(graph, indices, distances)
+
+
+def _farthest(nearest, taken):
+    '''
+    The vertex with the largest finite distance to the landmarks so far.
+    Vertices in other components than the first are never picked, a query
+    between components gets an infinite bound from every landmark anyway.
+    '''
+    best = None
+    best_distance = -1.0
+    for v, distance in enumerate(nearest):
+        if best_distance < distance < INFINITY and v not in taken:
+            best = v
+            best_distance = distance
+    return best
+
+
+def write_landmarks(landmarks, path=LANDMARKS_PATH):
+    '''
+    :param landmarks: Landmarks
+    :param path: file to write, tied to the graph fingerprint
+    :return: path
+    '''
+    fingerprint = landmarks.graph.fingerprint or (0, 0, 0, 0)
+    return snapshot.write_arrays(path, MAGIC, VERSION, tuple(fingerprint) + (len(landmarks.graph),),
+                                 [('indices', landmarks.indices), ('distances', landmarks.distances),
+                                  ('slack', array('d', landmarks.slack))])
+
+
+def load_landmarks(graph, path=LANDMARKS_PATH):
+    '''
+    Memory maps saved landmark distances for graph.
+    :param graph: the CompactGraph they were computed on
+    :param path: landmarks file
+    :return: Landmarks
+    '''
+    fields, sections, mapped = snapshot.read_arrays(path, MAGIC, VERSION)
+    if fields[-1] != len(graph) or (graph.fingerprint is not None and tuple(fields[:-1]) != tuple(graph.fingerprint)):
+        raise snapshot.SnapshotError("%s was built from a different graph, rebuild it" % path)
+    landmarks = Landmarks(graph, sections['indices'], sections['distances'], sections['slack'])
+    landmarks.mapped = mapped
+    return landmarks
+
+
+def benchmark(landmarks, queries=100, seed=0):
+    '''
+    Nodes settled by Dijkstra, straight line A* and ALT A* on the same random pairs.
+    :param landmarks: Landmarks
+    :param queries: number of random source/target pairs
+    :param seed: random seed for the pairs
+    :return: dict of total nodes assessed and seconds per method
+    '''
+    graph = landmarks.graph
+    rng = random.Random(seed)
+    report = dict((name, {'nodes_assessed': 0, 'time': 0.0}) for name in ('dijkstra', 'planar', 'alt'))
+    for query in xrange(queries):
+        source = rng.randrange(len(graph))
+        target = rng.randrange(len(graph))
+        start = time.time()
+        costs, parents, nodes_assessed = search.dijkstra(graph, source, [target])
+        report['dijkstra']['time'] += time.time() - start
+        report['dijkstra']['nodes_assessed'] += nodes_assessed
+        for name, heuristic in (('planar', heuristics.make_compact_heuristic(graph, target)),
+                                ('alt', landmarks.make_heuristic(target))):
+            start = time.time()
+            costs, parents, nodes_assessed = search.astar(graph, source, target, heuristic)
+            report[name]['time'] += time.time() - start
+            report[name]['nodes_assessed'] += nodes_assessed
+    print "%d queries, %d landmarks" % (queries, len(landmarks))
+    for name in ('dijkstra', 'planar', 'alt'):
+        print "%-10s %10d nodes assessed %8.3f s" % (name, report[name]['nodes_assessed'], report[name]['time'])
+    return report
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'build':
+        graph = snapshot.load_compact_graph()
+        landmarks = select_landmarks(graph, int(sys.argv[2]) if len(sys.argv) > 2 else LANDMARK_COUNT)
+        write_landmarks(landmarks)
+        benchmark(landmarks)
+    elif command == 'bench':
+        graph = snapshot.load_compact_graph()
+        benchmark(load_landmarks(graph), int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    else:
+        print __doc__
+        sys.exit(2)
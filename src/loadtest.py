@@ -0,0 +1,183 @@
+'''
+Load test for the routing service.
+
+Client threads, each on its own keep-alive connection, send route,
+one-to-many or matrix queries between vertices sampled from the service
+itself, and the throughput, latency percentiles and error count are
+reported together with the searches the service ran and how many
+requests it coalesced. With --sources K every query starts at one of K
+vertices, which is what request coalescing helps with.
+
+Usage:
+    python loadtest.py [--url http://127.0.0.1:8080 | --socket PATH] [--clients C] [--requests R]
+                       [--kind route|routes|matrix] [--destinations D] [--sources K] [--seed S]
+'''
+import argparse
+import httplib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+import benchmark
+
+ROUTE = 'route'
+ROUTES = 'routes'
+MATRIX = 'matrix'
+URL = 'http://127.0.0.1:8080'
+CLIENTS = 8
+REQUESTS = 1000
+DESTINATIONS = 10  # Per one-to-many query, and the matrix side length
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    '''
+    HTTP over a Unix socket.
+    '''
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client(object):
+    '''
+    JSON requests on one keep-alive connection.
+    '''
+
+    def __init__(self, url=URL, socket_path=None, timeout=120):
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            address = urlparse.urlparse(url)
+            self.connection = httplib.HTTPConnection(address.hostname, address.port, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        '''
+        :return: (status, decoded JSON body)
+        '''
+        headers = {'Content-Type': 'application/json'}
+        data = json.dumps(body) if body is not None else None
+        self.connection.request(method, path, data, headers)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def close(self):
+        self.connection.close()
+
+
+def make_queries(nodes, requests, kind=ROUTE, destinations=DESTINATIONS, sources=None, seed=0):
+    '''
+    :param nodes: vertex ids to draw from
+    :param sources: number of distinct sources, or None to draw every source from nodes
+    :return: list of (method, path, body)
+    '''
+    rng = random.Random(seed)
+    starts = rng.sample(nodes, min(sources, len(nodes))) if sources else nodes
+    queries = []
+    for k in xrange(requests):
+        source = rng.choice(starts)
+        if kind == ROUTE:
+            queries.append(('POST', '/route', {'source': source, 'destination': rng.choice(nodes)}))
+        elif kind == ROUTES:
+            queries.append(('POST', '/routes', {'source': source,
+                                                'destinations': [rng.choice(nodes) for d in xrange(destinations)]}))
+        else:
+            queries.append(('POST', '/matrix', {'sources': [rng.choice(starts) for d in xrange(destinations)],
+                                                'destinations': [rng.choice(nodes) for d in xrange(destinations)]}))
+    return queries
+
+
+def run_load(queries, clients=CLIENTS, url=URL, socket_path=None):
+    '''
+    Sends the queries from concurrent clients, each taking the next unsent one.
+    :return: dict of requests, errors, seconds, requests per second,
+             latency percentiles in milliseconds and the service's pool
+             counters over the run
+    '''
+    before = Client(url, socket_path).request('GET', '/metrics')[1]['pool']
+    queue = list(reversed(queries))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def client_loop():
+        client = Client(url, socket_path)
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    method, path, body = queue.pop()
+                start = time.time()
+                try:
+                    status, answer = client.request(method, path, body)
+                except (httplib.HTTPException, socket.error):
+                    status = None
+                    client.close()
+                    client = Client(url, socket_path)
+                elapsed = time.time() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors[0] += 1
+        finally:
+            client.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=client_loop) for k in xrange(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    after = Client(url, socket_path).request('GET', '/metrics')[1]['pool']
+    latencies.sort()
+    report = {'requests': len(latencies), 'errors': errors[0], 'clients': clients, 'seconds': elapsed,
+              'requests_per_second': len(latencies) / max(elapsed, 1e-9),
+              'searches': after['searches'] - before['searches'],
+              'coalesced': after['coalesced'] - before['coalesced']}
+    if latencies:
+        report.update(('p%d_ms' % p, benchmark.percentile(latencies, p) * 1000) for p in benchmark.PERCENTILES)
+        report['max_ms'] = latencies[-1] * 1000
+    return report
+
+
+def sample_nodes(count, seed=0, url=URL, socket_path=None):
+    '''
+    :return: list of vertex ids drawn by the service
+    '''
+    client = Client(url, socket_path)
+    try:
+        return client.request('GET', '/sample?count=%d&seed=%d' % (count, seed))[1]['nodes']
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test a running routing service.')
+    parser.add_argument('--url', default=URL)
+    parser.add_argument('--socket', default=None, help='Unix socket of the service, instead of --url')
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS)
+    parser.add_argument('--kind', choices=(ROUTE, ROUTES, MATRIX), default=ROUTE)
+    parser.add_argument('--destinations', type=int, default=DESTINATIONS)
+    parser.add_argument('--sources', type=int, default=None, help='distinct sources, default any vertex')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    nodes = sample_nodes(1000, arguments.seed, arguments.url, arguments.socket)
+    queries = make_queries(nodes, arguments.requests, arguments.kind, arguments.destinations, arguments.sources,
+                           arguments.seed)
+    report = run_load(queries, arguments.clients, arguments.url, arguments.socket)
+    print json.dumps(report, indent=2, sort_keys=True)
+    if report['errors']:
+        print >> sys.stderr, "%d requests failed" % report['errors']
+        sys.exit(1)
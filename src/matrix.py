@@ -0,0 +1,55 @@
+import numpy
+import search
+
+
+def distance_matrix(routing_session, sources, targets, with_paths=False):
+    '''
+    Shortest route costs from every source to every target.
+
+    Runs one Dijkstra search per distinct source, each stopping once all
+    targets are settled, instead of one query per pair. The graph is
+    undirected, so when there are fewer distinct targets than sources the
+    searches start from the targets instead and the result is transposed.
+    :param routing_session: RoutingSession to search in
+    :param sources: list of N osm_id
+    :param targets: list of M osm_id
+    :param with_paths: also return the node path of every pair
+    :return: (costs, paths), costs an N x M numpy array with inf for
+             unreachable pairs, paths an N x M list of osm_id lists (None
+             when unreachable) or None if with_paths is False
+    '''
+    graph = routing_session.graph
+    source_indices = [graph.index_of(s) for s in sources]
+    target_indices = [graph.index_of(t) for t in targets]
+    reverse = len(set(target_indices)) < len(set(source_indices))
+    if reverse:
+        source_indices, target_indices = target_indices, source_indices
+
+    costs = numpy.empty((len(source_indices), len(target_indices)), dtype=numpy.float64)
+    paths = [[None] * len(target_indices) for row in source_indices] if with_paths else None
+    done = {}
+    for row, source in enumerate(source_indices):
+        if source in done:
+            costs[row] = costs[done[source]]
+            if with_paths:
+                paths[row] = list(paths[done[source]])
+            continue
+        done[source] = row
+        search_costs, parents, nodes_assessed = search.dijkstra(graph, source, target_indices)
+        for column, target in enumerate(target_indices):
+            costs[row, column] = search_costs[target]
+            if with_paths:
+                paths[row][column] = search.path_to(graph, parents, source, target)
+
+    if reverse:
+        costs = costs.T.copy()
+        if with_paths:
+            paths = [[_reversed(paths[row][column]) for row in xrange(len(source_indices))]
+                     for column in xrange(len(target_indices))]
+    return costs, paths
+
+
+def _reversed(path):
+    if path is None:
+        return None
+    return path[::-1]
@@ -0,0 +1,370 @@
+'''
+Per-query metrics and profiling hooks.
+
+A QueryMetrics collects the seconds spent in each phase of one route
+query (snapping coordinates, graph load, search, heuristic, path
+reconstruction, geometry fetch, database write), counters such as heap
+pushes and pops, edge relaxations, heuristic calls and database round
+trips, and how far the snapped coordinates of the query were moved. Finished metrics
+go to every configured sink: LogSink, CsvSink or TableSink. With no sink
+configured no metrics are collected at all.
+
+Sinks and profiling can be set from the environment, read by
+configure_from_environment when a command line entry point starts:
+    ROUTING_METRICS=log,csv:/tmp/metrics.csv,table
+    ROUTING_PROFILE=cprofile:/tmp/profiles   (or sample:/tmp/profiles)
+'''
+import atexit
+import contextlib
+import cProfile
+import csv
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import results
+
+SNAP = 'snap'
+GRAPH_LOAD = 'graph_load'
+SEARCH = 'search'
+HEURISTIC = 'heuristic'
+PATH_RECONSTRUCTION = 'path_reconstruction'
+GEOMETRY_FETCH = 'geometry_fetch'
+DB_WRITE = 'db_write'
+PHASES = (SNAP, GRAPH_LOAD, SEARCH, HEURISTIC, PATH_RECONSTRUCTION, GEOMETRY_FETCH, DB_WRITE)
+COUNTERS = ('heap_pushes', 'heap_pops', 'edge_relaxations', 'heuristic_calls', 'db_round_trips')
+METRICS_TABLE = 'public.query_metrics'
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+SAMPLE_INTERVAL = 0.005
+
+_sinks = []
+_profiler = None  # (CPROFILE or SAMPLE, directory)
+_sequence = [0]
+_lock = threading.Lock()
+
+
+class QueryMetrics(object):
+    '''
+    Phase timings and counters of one query.
+    '''
+
+    def __init__(self, algorithm, source=None, destinations=None, run_id=None):
+        self.algorithm = algorithm
+        self.source = source
+        self.destinations = destinations
+        self.run_id = run_id or results.run_id()
+        self.phases = dict((name, 0.0) for name in PHASES)
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.snap_meters = []
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''
+        Adds the time spent in the with block to phase name.
+        '''
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self.phases[name] += time.time() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_stats(self, stats):
+        '''
+        :param stats: counter dict filled by a search
+        '''
+        for name, amount in stats.iteritems():
+            self.count(name, amount)
+
+    def add_snaps(self, snaps):
+        '''
+        :param snaps: spatial.Snap of the query's coordinates, their time goes to the SNAP phase
+        '''
+        for snap in snaps:
+            self.phases[SNAP] += snap.seconds
+            self.snap_meters.append(snap.meters)
+
+    def timed_heuristic(self, heuristic):
+        '''
+        Wraps a heuristic to count its calls and time them as the HEURISTIC
+        phase. The timing itself costs about as much as a memoized call.
+        '''
+        phases = self.phases
+        counters = self.counters
+        clock = time.time
+
+        def timed(node):
+            start = clock()
+            value = heuristic(node)
+            phases[HEURISTIC] += clock() - start
+            counters['heuristic_calls'] += 1
+            return value
+        return timed
+
+    def as_dict(self):
+        '''
+        :return: flat dict of the query fields, phase seconds, counters and
+                 the farthest snap in meters (None without coordinates)
+        '''
+        row = {'run_id': self.run_id, 'algorithm': self.algorithm, 'source': self.source,
+               'destinations': self.destinations, 'total': time.time() - self.started,
+               'snap_meters': max(self.snap_meters) if self.snap_meters else None}
+        row.update(self.phases)
+        row.update(self.counters)
+        return row
+
+    def emit(self):
+        '''
+        Hands the metrics to every configured sink.
+        '''
+        for sink in _sinks:
+            sink.write(self)
+
+
+class LogSink(object):
+    '''
+    One line per query on a stream, stderr by default.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def write(self, metrics):
+        parts = ['%s=%.4fs' % (name, metrics.phases[name]) for name in PHASES if metrics.phases[name]]
+        parts += ['%s=%d' % (name, metrics.counters[name]) for name in COUNTERS if metrics.counters.get(name)]
+        if metrics.snap_meters:
+            parts.append('snap_meters=%.1f' % max(metrics.snap_meters))
+        print >> self.stream, "%s %s -> %s %s" % (metrics.algorithm, metrics.source, metrics.destinations,
+                                                  ' '.join(parts))
+
+    def close(self):
+        self.stream.flush()
+
+
+class CsvSink(object):
+    '''
+    One row per query appended to a CSV file, with a header when the file is new.
+    '''
+    COLUMNS = ('run_id', 'algorithm', 'source', 'destinations', 'total') + PHASES + COUNTERS + ('snap_meters',)
+
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(self.COLUMNS)
+        self.lock = threading.Lock()
+
+    def write(self, metrics):
+        row = metrics.as_dict()
+        with self.lock:
+            self.writer.writerow([row.get(column) for column in self.COLUMNS])
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class TableSink(object):
+    '''
+    Rows of METRICS_TABLE, written in batches by a ResultWriter:
+    id, algorithm, source, destinations, phases and counters as JSON,
+    the counters with snap_meters when the query was snapped.
+    '''
+
+    def __init__(self, table=METRICS_TABLE, batch_size=results.BATCH_SIZE):
+        self.writer = results.ResultWriter(table, batch_size, verbose=False,
+                                           columns='(id, algorithm, source, destinations, phases, counters)',
+                                           template='(%s, %s, %s, %s, %s::json, %s::json)')
+
+    def write(self, metrics):
+        self.writer.add_row((metrics.run_id, metrics.algorithm, metrics.source, metrics.destinations,
+                             json.dumps(metrics.phases), json.dumps(self.counters(metrics))))
+
+    @staticmethod
+    def counters(metrics):
+        if not metrics.snap_meters:
+            return metrics.counters
+        return dict(metrics.counters, snap_meters=max(metrics.snap_meters))
+
+    def close(self):
+        self.writer.close()
+
+
+def enabled():
+    '''
+    :return: whether queries should collect metrics
+    '''
+    return bool(_sinks)
+
+
+def start(algorithm, source=None, destinations=None):
+    '''
+    :return: a new QueryMetrics when a sink is configured, else None
+    '''
+    if not _sinks:
+        return None
+    return QueryMetrics(algorithm, source, destinations)
+
+
+def phase(query_metrics, name):
+    '''
+    QueryMetrics.phase that does nothing when query_metrics is None.
+    '''
+    if query_metrics is None:
+        return _nothing()
+    return query_metrics.phase(name)
+
+
+@contextlib.contextmanager
+def _nothing():
+    yield None
+
+
+def set_sinks(sinks):
+    '''
+    Replaces the configured sinks, closing the old ones.
+    :param sinks: list of sink objects, empty to stop collecting metrics
+    '''
+    global _sinks
+    close_sinks()
+    _sinks = list(sinks)
+
+
+def close_sinks():
+    '''
+    Closes every configured sink. Registered to run at exit, before the
+    result writers and the connection pool are closed.
+    '''
+    for sink in _sinks:
+        sink.close()
+
+
+def parse_sinks(spec):
+    '''
+    :param spec: comma separated log, csv:path and table entries
+    :return: list of sinks
+    '''
+    sinks = []
+    for entry in spec.split(','):
+        kind, _, argument = entry.strip().partition(':')
+        if kind == 'log':
+            sinks.append(LogSink())
+        elif kind == 'csv':
+            sinks.append(CsvSink(argument or 'metrics.csv'))
+        elif kind == 'table':
+            sinks.append(TableSink(argument or METRICS_TABLE))
+        elif kind:
+            raise ValueError("Unknown metrics sink %s" % kind)
+    return sinks
+
+
+def set_profiler(kind, directory):
+    '''
+    Profiles every query wrapped in profiled from now on.
+    :param kind: CPROFILE, SAMPLE, or None to stop profiling
+    :param directory: where the profiles are saved
+    '''
+    global _profiler
+    if kind is None:
+        _profiler = None
+        return
+    if kind not in (CPROFILE, SAMPLE):
+        raise ValueError("Unknown profiler %s" % kind)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    _profiler = (kind, directory)
+
+
+@contextlib.contextmanager
+def profiled(name):
+    '''
+    Runs the with block under the configured profiler and saves the
+    profile as <directory>/<name>-<pid>-<n>.prof (cProfile, read it with
+    pstats) or .folded (sampled stacks, one "frame;frame count" line per
+    stack, the input of flamegraph.pl). Does nothing when profiling is off.
+    :param name: label of the profiled query
+    '''
+    if _profiler is None:
+        yield None
+        return
+    kind, directory = _profiler
+    with _lock:
+        _sequence[0] += 1
+        path = os.path.join(directory, '%s-%d-%d' % (name, os.getpid(), _sequence[0]))
+    if kind == CPROFILE:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            profile.dump_stats(path + '.prof')
+    else:
+        sampler = SamplingProfiler()
+        sampler.start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            sampler.save(path + '.folded')
+
+
+class SamplingProfiler(object):
+    '''
+    Statistical profiler: a SIGPROF timer records the main thread's stack
+    every interval of CPU time. Much cheaper than cProfile on hot loops,
+    so it shows where time goes without changing it. Main thread only.
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.iteritems()):
+                f.write('%s %d\n' % (stack, count))
+
+
+def configure_from_environment(environ=os.environ):
+    '''
+    Sets the sinks from ROUTING_METRICS and the profiler from
+    ROUTING_PROFILE. Called from the command line entry points, so that
+    importing this module never opens files or creates directories.
+    :param environ: mapping to read the variables from
+    '''
+    if environ.get('ROUTING_METRICS'):
+        set_sinks(parse_sinks(environ['ROUTING_METRICS']))
+    if environ.get('ROUTING_PROFILE'):
+        kind, _, directory = environ['ROUTING_PROFILE'].partition(':')
+        if not directory:
+            raise ValueError("ROUTING_PROFILE must be kind:directory, e.g. cprofile:/tmp/profiles, got %r" %
+                             environ['ROUTING_PROFILE'])
+        set_profiler(kind, directory)
+
+
+atexit.register(close_sinks)
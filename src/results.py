@@ -0,0 +1,216 @@
+'''
+Buffered writer for experiment results.
+
+Rows are kept in memory and inserted with execute_values, one statement
+and one commit per batch, instead of a connection and a commit per
+route. A batch is written when it is full, when FLUSH_INTERVAL seconds
+have passed since the last write, when the writer is closed, and at
+interpreter exit. Every row of a run carries the same run id, a UUID.
+
+A failed write keeps the rows for the next flush, which the next add
+attempts as the buffer is still full. After MAX_FAILED_FLUSHES failures
+in a row the error is raised, so a database that stays down stops the
+run instead of growing the buffer without bound.
+'''
+import atexit
+import threading
+import time
+import uuid
+import psycopg2
+from psycopg2.extras import execute_values
+import database
+
+DIJKSTRAS = 'public.results_dijkstras_one_to_one'
+ASTAR = 'public.results_astar_one_to_one'
+COLUMNS = '(the_geom, total_time, id, nodes_assessed, source, destinations)'
+ROW_TEMPLATE = '(st_geomfromwkb(%s::geometry, 4326), %s, %s, %s, %s, %s)'
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 30.0
+MAX_FAILED_FLUSHES = 3
+
+_run_id = None
+_writers = {}
+_lock = threading.Lock()
+
+
+class ResultWriter(object):
+    '''
+    Collects result rows for one table and inserts them in batches.
+    '''
+
+    def __init__(self, table, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, verbose=True,
+                 columns=COLUMNS, template=ROW_TEMPLATE, max_failed_flushes=MAX_FAILED_FLUSHES):
+        '''
+        :param table: DIJKSTRAS or ASTAR
+        :param batch_size: rows per INSERT
+        :param flush_interval: seconds after which buffered rows are written on the next add
+        :param verbose: print rows/s after every flush
+        :param columns: column list of the INSERT, for tables other than the results ones
+        :param template: execute_values template matching columns
+        :param max_failed_flushes: failed writes in a row after which flush raises
+        '''
+        self.table = table
+        self.columns = columns
+        self.template = template
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+        self.rows = []
+        self.rows_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.max_failed_flushes = max_failed_flushes
+        self.write_time = 0.0
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, geom_hex, total_time, id, nodes_assessed, source, destinations):
+        '''
+        Buffers one result row, writing the buffer when it is due.
+        :param geom_hex: route geometry as hex WKB
+        :param total_time: seconds the search took
+        :param id: run id
+        :param nodes_assessed: nodes the search assessed
+        :param source: source node
+        :param destinations: destination node(s)
+        '''
+        self.add_row((geom_hex, total_time, id, nodes_assessed, source, destinations))
+
+    def add_row(self, row):
+        '''
+        Buffers one row in column order, writing the buffer when it is due.
+        :param row: tuple of values for columns
+        '''
+        with self.lock:
+            self.rows.append(row)
+            due = len(self.rows) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes every buffered row in one transaction. When the write fails,
+        a timeout included, the rows stay buffered for the next flush, and
+        the error is raised once max_failed_flushes writes failed in a row.
+        :return: number of rows written
+        '''
+        with self.lock:
+            rows = self.rows
+            self.last_flush = time.time()
+            if not rows:
+                return 0
+            start = time.time()
+            try:
+                with database.connection() as conn:
+                    cur = conn.cursor()
+                    execute_values(cur, 'INSERT INTO ' + self.table + self.columns + ' VALUES %s', rows,
+                                   template=self.template, page_size=self.batch_size)
+            except psycopg2.Error as e:
+                self.failed_flushes += 1
+                if self.failed_flushes >= self.max_failed_flushes:
+                    raise
+                print "Could not write %d rows to %s, keeping them: %s" % (len(rows), self.table, e)
+                return 0
+            self.rows = []  # Only once committed, add_row waits on the lock meanwhile
+            self.failed_flushes = 0
+            elapsed = time.time() - start
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self.write_time += elapsed
+        if self.verbose:
+            print "Wrote %d rows to %s, %.0f rows/s" % (len(rows), self.table, len(rows) / max(elapsed, 1e-9))
+        return len(rows)
+
+    def rows_per_second(self):
+        '''
+        :return: write throughput over every flush so far
+        '''
+        return self.rows_written / self.write_time if self.write_time else 0.0
+
+    def close(self):
+        '''
+        Writes what is left and prints the totals.
+        '''
+        self.flush()
+        if self.verbose and self.rows_written:
+            print "%s: %d rows in %.2f seconds, %.0f rows/s" % (
+                self.table, self.rows_written, self.write_time, self.rows_per_second())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def table_for(algorithm):
+    '''
+    :param algorithm: 'dijkstra' or 'astar'
+    :return: DIJKSTRAS or ASTAR
+    '''
+    return ASTAR if algorithm == 'astar' else DIJKSTRAS
+
+
+def run_id():
+    '''
+    Id shared by every result of this run, created on first use.
+    :return: UUID string
+    '''
+    global _run_id
+    if _run_id is None:
+        _run_id = str(uuid.uuid4())
+    return _run_id
+
+
+def new_run():
+    '''
+    Starts a new run, e.g. between experiments in one process.
+    :return: the new run id
+    '''
+    global _run_id
+    flush_all()
+    _run_id = str(uuid.uuid4())
+    return _run_id
+
+
+def resume_run(id):
+    '''
+    Continues an earlier run: the rows written from now on carry its id.
+    :param id: run id of the earlier run
+    '''
+    global _run_id
+    flush_all()
+    _run_id = id
+
+
+def get_writer(table):
+    '''
+    The writer shared by this process for table.
+    :param table: DIJKSTRAS or ASTAR
+    :return: ResultWriter
+    '''
+    with _lock:
+        writer = _writers.get(table)
+        if writer is None:
+            writer = _writers[table] = ResultWriter(table)
+        return writer
+
+
+def flush_all():
+    '''
+    Writes the buffered rows of every shared writer.
+    '''
+    for writer in _writers.values():
+        writer.flush()
+
+
+def close_all():
+    '''
+    Flushes and reports every shared writer. Registered to run at exit,
+    before the connection pool is closed.
+    '''
+    for writer in _writers.values():
+        writer.close()
+    _writers.clear()
+
+atexit.register(close_all)
@@ -0,0 +1,505 @@
+'''
+Parallel experiment runner.
+
+The parent loads the routing session once and forks N workers, which
+share its graph arrays copy-on-write (and the snapshot's mapped pages).
+Each worker is handed one search at a time over its own duplex pipe and
+sends the routes back over the same pipe, so results stream out as they
+finish. The parent writes them with the batched result writer and kills
+and replaces any worker that is still busy when its task's wall-clock
+deadline has passed, so no SIGALRM is involved. A killed worker takes
+only its own pipe with it, never a channel the other workers write to.
+
+When the session has a route cache, the parent caches what the workers
+find, and run_parallel answers cached pairs itself. An experiment never
+does: a cached answer has no search time or node count to write, so
+run_experiment sends every pair to a worker, which searches without the
+cache.
+
+With --group, pairs that share an end are grouped: the graph is
+undirected, so one Dijkstra tree grown from the shared node until all of
+the group's other ends are settled answers every pair of the group in a
+single search. Each route is still reported from its larger osm_id, but
+the time and nodes of the shared search belong to no single pair, so
+grouped rows are written without them.
+
+Pairs whose ends lie in different connected components are answered
+unreachable by the parent from the component labels, without a search.
+Progress is kept in a checkpoint file, see checkpoint.py, so a rerun
+resumes with the pairs that are still pending.
+
+Usage:
+    python runner.py [--algorithm dijkstra|astar] [--workers N] [--timeout S] [--cache PATH]
+                     [--group] [--measure-grouping]
+                     [--checkpoint PATH] [--retry-failed] [--resume-run ID] [pairs.csv]
+'''
+import argparse
+import collections
+import multiprocessing
+import select
+import time
+from shapely.ops import linemerge
+import cache
+import checkpoint
+import components
+import database
+import geometry
+import heuristics
+import metrics
+import results
+import search
+import session
+from checkpoint import DONE, MISSING, UNREACHABLE, FAILED, TIMED_OUT, read_pairs
+
+DIJKSTRA = 'dijkstra'
+ASTAR = 'astar'
+ALGORITHMS = (DIJKSTRA, ASTAR)
+TIMEOUT = 3600.0
+POLL_INTERVAL = 0.5
+
+
+def group_pairs(pairs):
+    '''
+    Groups pairs by a shared end so one shortest-path tree answers the
+    whole group. The graph is undirected, so each pair joins the group of
+    whichever end appears in more pairs, the larger osm_id on a tie.
+    :param pairs: list of (source, destination)
+    :return: list of (group source, list of (index, destination)) in order of first appearance
+    '''
+    ends = collections.Counter()
+    for source, destination in pairs:
+        ends[source] += 1
+        if destination != source:
+            ends[destination] += 1
+    groups = collections.OrderedDict()
+    for index, (source, destination) in enumerate(pairs):
+        if (ends[destination], destination) > (ends[source], source):
+            source, destination = destination, source
+        groups.setdefault(source, []).append((index, destination))
+    return groups.items()
+
+
+def route_pair(routing_session, algorithm, source, destination, mode=search.UNIDIRECTIONAL,
+               metric=heuristics.PLANAR):
+    '''
+    Searches one pair, routing from the larger osm_id as run_experiment
+    does, and builds its geometry.
+    :param routing_session: RoutingSession
+    :param algorithm: DIJKSTRA or ASTAR
+    :return: (hex WKB of the route, search seconds, nodes_assessed, source, destination, cost, path)
+    :raise KeyError: if a node is not in the graph or the pair is not connected
+    '''
+    if destination > source:
+        source, destination = destination, source
+    query_metrics = metrics.start(algorithm, source, [destination])
+    with metrics.profiled(algorithm):
+        start = time.time()
+        if algorithm == ASTAR:
+            result = routing_session.astar(source, [destination], metric, mode, query_metrics)
+        else:
+            result = routing_session.dijkstra(source, [destination], mode, query_metrics)
+        total_time = time.time() - start
+        path = result.paths[destination]
+        if path is None:
+            raise KeyError(destination)
+        route_geom = route_geometry(path, query_metrics)
+    if query_metrics is not None:
+        query_metrics.emit()
+    return route_geom.wkb_hex, total_time, result.nodes_assessed, source, destination, result.costs[destination], path
+
+
+def route_group(routing_session, source, destinations):
+    '''
+    Grows one shortest-path tree from source until every destination is
+    settled and builds the route to each from its parents, reversed when
+    the destination is the larger osm_id as route_pair routes from it.
+    :param routing_session: RoutingSession
+    :param source: osm_id the tree grows from
+    :param destinations: list of osm_id
+    :return: list of (DONE, route) or (MISSING, None) in destinations order,
+             route as from route_pair with None for the seconds and
+             nodes_assessed, which only the whole group has
+    '''
+    graph = routing_session.graph
+    if source not in graph:
+        return [(MISSING, None)] * len(destinations)
+    known = [destination for destination in destinations if destination in graph]
+    query_metrics = metrics.start(DIJKSTRA, source, known)
+    with metrics.profiled(DIJKSTRA):
+        result = routing_session.dijkstra(source, known, search.UNIDIRECTIONAL, query_metrics)
+        outcomes = []
+        for destination in destinations:
+            path = result.paths.get(destination)
+            if path is None:
+                outcomes.append((MISSING, None))
+                continue
+            route_source, route_destination = source, destination
+            if route_destination > route_source:
+                route_source, route_destination = route_destination, route_source
+                path = path[::-1]  # Undirected, the reversed path is the route from the larger osm_id
+            route_geom = route_geometry(path, query_metrics)
+            outcomes.append((DONE, (route_geom.wkb_hex, None, None, route_source, route_destination,
+                                    result.costs[destination], path)))
+    if query_metrics is not None:
+        query_metrics.emit()
+    return outcomes
+
+
+def route_geometry(path, query_metrics=None):
+    '''
+    :param path: list of osm_id
+    :return: the merged lines of path, from the shared store or the database
+    '''
+    with metrics.phase(query_metrics, metrics.GEOMETRY_FETCH):
+        store = geometry.get_store()
+        if store is not None:
+            lines = store.route_lines(path)
+        else:
+            with database.connection() as conn:
+                lines = geometry.route_lines(path, conn.cursor(), query_metrics)
+        return linemerge(lines)
+
+
+def _work(tasks, algorithm, mode, metric, cached):
+    '''
+    Worker loop: route every task that arrives on tasks until None and
+    send its outcome back on tasks.
+    '''
+    routing_session = session.get_session()  # Inherited from the parent, not loaded again
+    if not cached:
+        routing_session.cache = None  # Only this process's copy, the parent keeps its cache
+    while True:
+        task = tasks.recv()
+        if task is None:
+            break
+        task_id, grouped, source, destinations = task
+        if grouped:
+            try:
+                outcome = route_group(routing_session, source, destinations)
+            except Exception as e:
+                outcome = [(FAILED, repr(e))] * len(destinations)
+        else:
+            try:
+                outcome = [(DONE, route_pair(routing_session, algorithm, source, destinations[0], mode, metric))]
+            except KeyError:
+                outcome = [(MISSING, None)]
+            except Exception as e:
+                outcome = [(FAILED, repr(e))]
+        tasks.send((task_id, outcome))
+    metrics.close_sinks()  # Worker processes end without running atexit
+
+
+class _Worker(object):
+    def __init__(self, algorithm, mode, metric, cached):
+        self.tasks, child_tasks = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(child_tasks, algorithm, mode, metric, cached))
+        self.process.daemon = True
+        self.process.start()
+        child_tasks.close()
+        self.task = None
+        self.members = None
+        self.deadline = None
+
+    def send(self, task, members, timeout):
+        self.task = task
+        self.members = members
+        self.deadline = time.time() + timeout
+        self.tasks.send(task)
+
+    def fileno(self):
+        return self.tasks.fileno()  # For select
+
+    def receive(self):
+        '''
+        :return: (task_id, outcome) the worker sent, or None if it exited
+        '''
+        try:
+            return self.tasks.recv()
+        except EOFError:
+            return None
+
+    def stop(self):
+        self.tasks.send(None)
+        self.process.join()
+        self.tasks.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.tasks.close()
+
+
+def _tasks(pairs, grouped):
+    '''
+    :return: generator of (members, source, destinations), members the
+             (index, source, destination) pairs the search answers, in
+             destinations order
+    '''
+    if grouped:
+        pairs = list(pairs)
+        for source, group in group_pairs(pairs):
+            yield ([(index, pairs[index][0], pairs[index][1]) for index, destination in group], source,
+                   [destination for index, destination in group])
+    else:
+        for index, (source, destination) in enumerate(pairs):
+            yield [(index, source, destination)], source, [destination]
+
+
+def run_parallel(pairs, algorithm=DIJKSTRA, workers=None, timeout=TIMEOUT, mode=search.UNIDIRECTIONAL,
+                 metric=heuristics.PLANAR, group=False, cached=True):
+    '''
+    Routes every pair on a pool of forked workers.
+    :param pairs: iterable of (source, destination)
+    :param algorithm: DIJKSTRA or ASTAR
+    :param workers: number of processes, one per core by default
+    :param timeout: wall-clock seconds a single search may take
+    :param group: answer the pairs sharing an end with one shortest-path
+                  tree, for unidirectional DIJKSTRA only
+    :param cached: answer the pairs in the session's route cache without a
+                   search, their routes with None for the seconds and
+                   nodes_assessed. The routes found are cached either way.
+    :return: generator of (index, source, destination, status, route) in
+             completion order, status DONE, MISSING, UNREACHABLE, FAILED or
+             TIMED_OUT and route the tuple from route_pair when DONE
+    '''
+    routing_session = session.get_session()  # Load before forking so every worker shares it
+    route_cache = routing_session.cache
+    graph_components = routing_session.graph.components
+    grouped = group and algorithm == DIJKSTRA and mode == search.UNIDIRECTIONAL
+    workers = workers or multiprocessing.cpu_count()
+    pool = [_Worker(algorithm, mode, metric, cached) for k in xrange(workers)]
+    tasks = enumerate(_tasks(pairs, grouped))
+    idle = list(xrange(workers))
+    answered = collections.deque()  # Pairs the parent answered without a search
+
+    def dispatch():
+        while idle:
+            task = next(tasks, None)
+            if task is None:
+                return
+            task_id, (members, source, destinations) = task
+            if (cached and route_cache is not None) or graph_components is not None:
+                searched = []
+                for member, destination in zip(members, destinations):
+                    if graph_components is not None and _unreachable(graph_components, source, destination):
+                        answered.append(member + (UNREACHABLE, None))
+                        continue
+                    route = None
+                    if cached and route_cache is not None:
+                        route = _cached_route(route_cache, source, destination, not grouped)
+                    if route is not None:
+                        answered.append(member + (DONE, route))
+                    else:
+                        searched.append((member, destination))
+                members = [member for member, destination in searched]
+                destinations = [destination for member, destination in searched]
+            if destinations:
+                pool[idle.pop()].send((task_id, grouped, source, destinations), members, timeout)
+
+    try:
+        dispatch()
+        while len(idle) < workers or answered:
+            while answered:
+                yield answered.popleft()
+            if len(idle) == workers:
+                dispatch()
+                continue
+            busy = [worker for worker in pool if worker.task is not None]
+            ready = select.select(busy, [], [], POLL_INTERVAL)[0]
+            for worker_id, worker in enumerate(pool):
+                if worker not in ready:
+                    continue
+                members = worker.members
+                worker.task = None
+                answer = worker.receive()
+                if answer is None:  # The worker died, replace it as if it timed out
+                    worker.kill()
+                    pool[worker_id] = _Worker(algorithm, mode, metric, cached)
+                    routes = [(FAILED, 'worker exited')] * len(members)
+                else:
+                    routes = answer[1]
+                idle.append(worker_id)
+                for member, (status, route) in zip(members, routes):
+                    if status == DONE and route_cache is not None:
+                        route_cache.put(route[3], route[4], route[5], route[6], route[0])
+                    yield member + (status, route)
+            now = time.time()
+            for worker_id, worker in enumerate(pool):
+                if worker.task is not None and now > worker.deadline:
+                    members = worker.members
+                    worker.kill()
+                    pool[worker_id] = _Worker(algorithm, mode, metric, cached)
+                    idle.append(worker_id)
+                    for member in members:
+                        yield member + (TIMED_OUT, None)
+            dispatch()
+        for worker in pool:
+            worker.stop()
+    finally:
+        for worker in pool:
+            if worker.process.is_alive():
+                worker.kill()
+            worker.tasks.close()
+
+
+def _unreachable(graph_components, source, destination):
+    '''
+    :return: whether both vertices are in the graph but in different components
+    '''
+    try:
+        return not graph_components.connected_ids(source, destination)
+    except KeyError:
+        return False  # Left to the search, which reports it MISSING
+
+
+def _cached_route(route_cache, source, destination, larger_first):
+    '''
+    :param larger_first: orient the route from the larger osm_id, as route_pair does
+    :return: the route_pair tuple of a cached route with geometry, None
+             for the seconds and nodes_assessed as nothing was searched, or None
+    '''
+    if larger_first and destination > source:
+        source, destination = destination, source
+    route = route_cache.get(source, destination)
+    if route is None or route.geometry_hex is None:
+        return None
+    return route.geometry_hex, None, None, source, destination, route.cost, route.path
+
+
+def run_experiment(pairs, algorithm=DIJKSTRA, workers=None, timeout=TIMEOUT, mode=search.UNIDIRECTIONAL,
+                   metric=heuristics.PLANAR, group=False, progress=None):
+    '''
+    Routes every pair in parallel and writes the routes to the results table
+    of algorithm. Every pair is searched, the route cache is only filled.
+    :param group: one shortest-path tree per shared source, see run_parallel,
+                  its rows without total_time and nodes_assessed
+    :param progress: optional checkpoint.Checkpoint, its answered pairs are skipped and new answers recorded
+    :return: number of routes written
+    '''
+    if progress is not None:
+        indexes = []
+        pending = []
+        for index, source, destination in progress.pending(pairs):
+            indexes.append(index)
+            pending.append((source, destination))
+        print "Resuming with %d pairs answered" % len(progress)
+    else:
+        pending = list(pairs)
+        indexes = range(len(pending))
+    searches = search_count(pending, algorithm, mode, group)
+    graph_components = session.get_session().graph.components
+    if graph_components is not None:
+        print_pair_stats(graph_components, pending)
+    writer = results.get_writer(results.table_for(algorithm))
+    id = results.run_id()
+    start = time.time()
+    count = 0
+    written = 0
+    for index, source, destination, status, route in run_parallel(pending, algorithm, workers, timeout, mode, metric,
+                                                                   group, cached=False):
+        count += 1
+        index = indexes[index]
+        if status == DONE:
+            route_geom_hex, total_time, nodes_assessed, route_source, route_destination, cost, path = route
+            writer.add(route_geom_hex, total_time, id, nodes_assessed, route_source, [route_destination])
+            written += 1
+        elif status == MISSING:
+            print str(destination) + " " + str(source) + " have Key Errors!!!!"
+        elif status == UNREACHABLE:
+            print str(destination) + " " + str(source) + " are in different components"
+        elif status == TIMED_OUT:
+            print str(destination) + " " + str(source) + " took over %d seconds" % timeout
+        else:
+            print str(destination) + " " + str(source) + " failed: " + route
+        if progress is not None:
+            progress.record(index, status)
+    writer.close()
+    elapsed = time.time() - start
+    print "%d pairs in %.1f seconds, %.1f pairs/s, %d routes written" % (count, elapsed, count / max(elapsed, 1e-9), written)
+    print "%d searches for %d pairs, %d saved by grouping" % (searches, count, count - searches)
+    return written
+
+
+def print_pair_stats(graph_components, pairs):
+    '''
+    Prints the component statistics of the graph and where the pairs fall.
+    '''
+    components.print_stats(graph_components)
+    report = components.pair_stats(graph_components, pairs)
+    print "Pairs: %(largest)d in the largest component, %(smaller)d in smaller ones, %(across)d across " \
+          "components, %(unknown)d with a vertex not in the graph" % report
+    smaller = sorted(report['by_component'].iteritems(), key=lambda item: -item[1])
+    smaller = [(label, count) for label, count in smaller if label != 0][:components.TOP]
+    if smaller:
+        print "Pairs by smaller component: " + ", ".join(
+            "%d (%d nodes): %d" % (label, graph_components.sizes[label], count) for label, count in smaller)
+
+
+def search_count(pairs, algorithm=DIJKSTRA, mode=search.UNIDIRECTIONAL, group=False):
+    '''
+    :param pairs: list of (source, destination)
+    :return: number of searches run_parallel makes for pairs, cache aside
+    '''
+    if group and algorithm == DIJKSTRA and mode == search.UNIDIRECTIONAL:
+        return len(group_pairs(pairs))
+    return len(pairs)
+
+
+def measure_grouping(pairs, workers=None, timeout=TIMEOUT):
+    '''
+    Routes the same pairs with DIJKSTRA once per pair and once grouped,
+    without writing results or using the route cache.
+    :param pairs: list of (source, destination)
+    :return: dict of pairs, searches, searches saved, pairs/s both ways and the throughput gain
+    '''
+    routing_session = session.get_session()
+    route_cache = routing_session.cache
+    routing_session.cache = None
+    rates = {}
+    try:
+        for group in (False, True):
+            start = time.time()
+            for outcome in run_parallel(pairs, DIJKSTRA, workers, timeout, group=group):
+                pass
+            rates[group] = len(pairs) / max(time.time() - start, 1e-9)
+    finally:
+        routing_session.cache = route_cache
+    searches = search_count(pairs, group=True)
+    return {'pairs': len(pairs), 'searches': searches, 'saved': len(pairs) - searches,
+            'ungrouped_pairs_per_second': rates[False], 'grouped_pairs_per_second': rates[True],
+            'gain': rates[True] / rates[False]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Route every pair of an experiment file in parallel.')
+    checkpoint.add_arguments(parser)
+    parser.add_argument('--algorithm', choices=ALGORITHMS, default=DIJKSTRA)
+    parser.add_argument('--mode', choices=(search.UNIDIRECTIONAL, search.BIDIRECTIONAL, search.CONTRACTION),
+                        default=search.UNIDIRECTIONAL)
+    parser.add_argument('--metric', choices=(heuristics.PLANAR, heuristics.HAVERSINE, heuristics.ALT),
+                        default=heuristics.PLANAR)
+    parser.add_argument('--workers', type=int, default=None, help='default: one per core')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds per pair')
+    parser.add_argument('--cache', default=None,
+                        help='route cache file, loaded before and saved after the run, which fills it')
+    parser.add_argument('--cache-size', type=int, default=cache.CAPACITY)
+    parser.add_argument('--group', action='store_true',
+                        help='one search per shared source instead of one per pair, written without timings')
+    parser.add_argument('--measure-grouping', action='store_true',
+                        help='time the pairs ungrouped and grouped and report the gain, writing nothing')
+    arguments = parser.parse_args()
+    metrics.configure_from_environment()
+    if arguments.measure_grouping:
+        report = measure_grouping(list(read_pairs(arguments.pairs)), arguments.workers, arguments.timeout)
+        print "%(pairs)d pairs, %(searches)d searches grouped, %(saved)d saved" % report
+        print "%.1f pairs/s per pair, %.1f pairs/s grouped, %.2fx throughput" % (
+            report['ungrouped_pairs_per_second'], report['grouped_pairs_per_second'], report['gain'])
+        raise SystemExit(0)
+    if arguments.cache:
+        route_cache = session.get_session().enable_cache(arguments.cache_size, arguments.cache)
+    with checkpoint.from_arguments(arguments, results.table_for(arguments.algorithm)) as progress:
+        run_experiment(read_pairs(arguments.pairs), arguments.algorithm, arguments.workers, arguments.timeout,
+                       arguments.mode, arguments.metric, arguments.group, progress)
+    if arguments.cache:
+        route_cache.save(arguments.cache)
+        print "Route cache: %s" % route_cache.stats()
@@ -0,0 +1,321 @@
+import heapq
+
+INFINITY = float("inf")
+NO_PARENT = -1
+UNIDIRECTIONAL = 'unidirectional'
+BIDIRECTIONAL = 'bidirectional'
+CONTRACTION = 'contraction'  # Bidirectional upward search over a contraction hierarchy
+
+
+class SearchWorkspace(object):
+    '''
+    Cost, parent and settled arrays of one search at a time, kept for the
+    next search on the same graph. Starting a search only puts back the
+    costs and parents the previous one wrote, listed in touched, and
+    moves the generation on, so a node is settled when its stamp equals
+    the current generation. The reset costs time proportional to the
+    nodes the last search touched, not to the size of the graph.
+
+    A search returns the workspace's own costs and parents lists, which
+    stay valid until the next search that uses the workspace.
+    '''
+
+    def __init__(self, n):
+        '''
+        :param n: number of nodes of the graph
+        '''
+        self.costs = [INFINITY] * n
+        self.parents = [NO_PARENT] * n
+        self.stamps = [0] * n
+        self.touched = []
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.costs)
+
+    def reset(self):
+        '''
+        Clears what the previous search wrote.
+        :return: the generation of the new search
+        '''
+        costs = self.costs
+        parents = self.parents
+        for node in self.touched:
+            costs[node] = INFINITY
+            parents[node] = NO_PARENT
+        self.touched = []
+        self.generation += 1
+        return self.generation
+
+    def settled_nodes(self):
+        '''
+        :return: list of the nodes the current search settled
+        '''
+        generation = self.generation
+        stamps = self.stamps
+        return [node for node in self.touched if stamps[node] == generation]
+
+
+def workspace_for(graph, workspace=None):
+    '''
+    :param graph: CompactGraph to search
+    :param workspace: SearchWorkspace to reuse, or None for a new one
+    :return: workspace reset for a new search on graph
+    '''
+    if workspace is None:
+        workspace = SearchWorkspace(len(graph))
+    elif len(workspace) != len(graph):
+        raise ValueError("Workspace has %d nodes, the graph %d" % (len(workspace), len(graph)))
+    workspace.reset()
+    return workspace
+
+
+def dijkstra(graph, source, targets, stats=None, workspace=None):
+    '''
+    Dijkstra's algorithm over a CompactGraph, working on dense node indices.
+    Stops once every target has been settled.
+    :param graph: CompactGraph
+    :param source: index of the node to start at
+    :param targets: indices of the nodes to finish at
+    :param stats: optional dict, heap and relaxation counts are added to it
+    :param workspace: optional SearchWorkspace to reuse instead of allocating per search
+    :return: costs, parents, nodes_assessed
+    '''
+    workspace = workspace_for(graph, workspace)
+    offsets = graph.offsets
+    edge_targets = graph.targets
+    edge_weights = graph.weights
+    costs = workspace.costs
+    parents = workspace.parents
+    stamps = workspace.stamps
+    generation = workspace.generation
+    touched = workspace.touched
+    targets_left = set(targets)
+    costs[source] = 0
+    parents[source] = source
+    touched.append(source)
+    frontier = [(0, source)]
+    nodes_assessed = 0
+    pushes = 1
+
+    while frontier:
+        cost_to_current_node, current_node = heapq.heappop(frontier)
+        if stamps[current_node] == generation:
+            continue  # Stale entry
+        stamps[current_node] = generation
+        for position in xrange(offsets[current_node], offsets[current_node + 1]):
+            neighbor = edge_targets[position]
+            new_distance_to_neighbor = cost_to_current_node + edge_weights[position]
+            if new_distance_to_neighbor < costs[neighbor]:
+                if parents[neighbor] == NO_PARENT:
+                    touched.append(neighbor)
+                costs[neighbor] = new_distance_to_neighbor
+                parents[neighbor] = current_node
+                heapq.heappush(frontier, (new_distance_to_neighbor, neighbor))
+                pushes += 1
+        if current_node in targets_left:
+            targets_left.discard(current_node)
+            if not targets_left:
+                break
+        nodes_assessed = nodes_assessed + 1
+    if stats is not None:
+        add_stats(stats, graph, pushes, len(frontier), workspace.settled_nodes())
+    return costs, parents, nodes_assessed
+
+
+def astar(graph, source, target, heuristic, stats=None, workspace=None):
+    '''
+    A* search over a CompactGraph, working on dense node indices.
+    costs holds the distance from the source, the frontier is ordered
+    by that distance plus the heuristic estimate to the target.
+    :param graph: CompactGraph
+    :param source: index of the node to start at
+    :param target: index of the node to finish at
+    :param heuristic: function of a node index giving a lower bound of its distance to target
+    :param stats: optional dict, heap and relaxation counts are added to it
+    :param workspace: optional SearchWorkspace to reuse instead of allocating per search
+    :return: costs, parents, nodes_assessed
+    '''
+    workspace = workspace_for(graph, workspace)
+    offsets = graph.offsets
+    edge_targets = graph.targets
+    edge_weights = graph.weights
+    costs = workspace.costs
+    parents = workspace.parents
+    stamps = workspace.stamps
+    generation = workspace.generation
+    touched = workspace.touched
+    costs[source] = 0
+    parents[source] = source
+    touched.append(source)
+    frontier = [(heuristic(source), source)]
+    nodes_assessed = 0
+    pushes = 1
+
+    while frontier:
+        estimate, current_node = heapq.heappop(frontier)
+        if stamps[current_node] == generation:
+            continue  # Stale entry
+        stamps[current_node] = generation
+        if current_node == target:
+            break
+        cost_to_current_node = costs[current_node]
+        for position in xrange(offsets[current_node], offsets[current_node + 1]):
+            neighbor = edge_targets[position]
+            new_distance_to_neighbor = cost_to_current_node + edge_weights[position]
+            if new_distance_to_neighbor < costs[neighbor]:
+                if parents[neighbor] == NO_PARENT:
+                    touched.append(neighbor)
+                costs[neighbor] = new_distance_to_neighbor
+                parents[neighbor] = current_node
+                heapq.heappush(frontier, (new_distance_to_neighbor + heuristic(neighbor), neighbor))
+                pushes += 1
+        nodes_assessed = nodes_assessed + 1
+    if stats is not None:
+        # The target is settled but its edges are not relaxed
+        add_stats(stats, graph, pushes, len(frontier), workspace.settled_nodes(),
+                  target if stamps[target] == generation else None)
+    return costs, parents, nodes_assessed
+
+
+def bidirectional(graph, source, target, potential=None, stats=None, workspaces=None):
+    '''
+    Bidirectional search over a CompactGraph, which is symmetric so the
+    backward search uses the same adjacency. Without a potential this is
+    bidirectional Dijkstra. With one it is bidirectional A*: the forward
+    search is keyed by cost + potential(v) and the backward search by
+    cost - potential(v). For the average potential
+    (h_target(v) - h_source(v)) / 2 both are consistent, and the search
+    can stop as soon as the two frontier tops add up to the best route
+    found so far.
+    :param graph: CompactGraph
+    :param source: index of the node to start at
+    :param target: index of the node to finish at
+    :param potential: optional forward potential, function of a node index
+    :param stats: optional dict, heap and relaxation counts are added to it
+    :param workspaces: optional (forward, backward) pair of SearchWorkspace to reuse
+    :return: cost, path as a list of indices (None if unreachable),
+             (forward nodes_assessed, backward nodes_assessed)
+    '''
+    if potential is None:
+        potential = _zero
+    if workspaces is None:
+        workspaces = (None, None)
+    workspaces = (workspace_for(graph, workspaces[0]), workspace_for(graph, workspaces[1]))
+    offsets = graph.offsets
+    edge_targets = graph.targets
+    edge_weights = graph.weights
+    costs = (workspaces[0].costs, workspaces[1].costs)
+    parents = (workspaces[0].parents, workspaces[1].parents)
+    stamps = (workspaces[0].stamps, workspaces[1].stamps)
+    generations = (workspaces[0].generation, workspaces[1].generation)
+    touched = (workspaces[0].touched, workspaces[1].touched)
+    signs = (1, -1)  # Forward keys add the potential, backward keys subtract it
+    costs[0][source] = 0
+    parents[0][source] = source
+    touched[0].append(source)
+    costs[1][target] = 0
+    parents[1][target] = target
+    touched[1].append(target)
+    frontiers = ([(potential(source), source)], [(-potential(target), target)])
+    nodes_assessed = [0, 0]
+    pushes = [1, 1]
+    best_cost = INFINITY
+    meeting = None  # (side, settled node, neighbor) of the edge where the best route crosses
+    if source == target:
+        best_cost = 0
+        meeting = (0, source, source)
+
+    while frontiers[0] and frontiers[1]:
+        if frontiers[0][0][0] + frontiers[1][0][0] >= best_cost:
+            break  # No route through an unsettled node can be shorter
+        side = 0 if frontiers[0][0][0] <= frontiers[1][0][0] else 1
+        frontier = frontiers[side]
+        side_costs = costs[side]
+        side_parents = parents[side]
+        side_stamps = stamps[side]
+        side_touched = touched[side]
+        other_costs = costs[1 - side]
+        sign = signs[side]
+        key, current_node = heapq.heappop(frontier)
+        if side_stamps[current_node] == generations[side]:
+            continue  # Stale entry
+        side_stamps[current_node] = generations[side]
+        nodes_assessed[side] = nodes_assessed[side] + 1
+        cost_to_current_node = side_costs[current_node]
+        for position in xrange(offsets[current_node], offsets[current_node + 1]):
+            neighbor = edge_targets[position]
+            new_distance_to_neighbor = cost_to_current_node + edge_weights[position]
+            if new_distance_to_neighbor < side_costs[neighbor]:
+                if side_parents[neighbor] == NO_PARENT:
+                    side_touched.append(neighbor)
+                side_costs[neighbor] = new_distance_to_neighbor
+                side_parents[neighbor] = current_node
+                heapq.heappush(frontier, (new_distance_to_neighbor + sign * potential(neighbor), neighbor))
+                pushes[side] += 1
+            if new_distance_to_neighbor + other_costs[neighbor] < best_cost:
+                best_cost = new_distance_to_neighbor + other_costs[neighbor]
+                meeting = (side, current_node, neighbor)
+
+    if stats is not None:
+        for side in (0, 1):
+            add_stats(stats, graph, pushes[side], len(frontiers[side]), workspaces[side].settled_nodes())
+    if meeting is None:
+        return INFINITY, None, tuple(nodes_assessed)
+    side, settled_node, neighbor = meeting
+    forward_end, backward_start = (settled_node, neighbor) if side == 0 else (neighbor, settled_node)
+    path = [forward_end]
+    while path[-1] != source:
+        path.append(parents[0][path[-1]])
+    path.reverse()
+    if backward_start != forward_end:
+        path.append(backward_start)
+    while path[-1] != target:
+        path.append(parents[1][path[-1]])
+    return best_cost, path, tuple(nodes_assessed)
+
+
+def add_stats(stats, graph, pushes, left_in_frontier, settled_nodes, unrelaxed=None):
+    '''
+    Adds the counts of one finished search to stats. Pops follow from the
+    pushes and what is left on the heap, and relaxations from the degrees
+    of the settled nodes, so the search loop itself only counts pushes.
+    :param stats: dict of counter name -> int
+    :param graph: CompactGraph the search ran on
+    :param pushes: heap pushes, the start node included
+    :param left_in_frontier: entries still on the heap
+    :param settled_nodes: the nodes the search settled
+    :param unrelaxed: a settled node whose edges were not relaxed, or None
+    '''
+    offsets = graph.offsets
+    relaxations = 0
+    for node in settled_nodes:
+        if node != unrelaxed:
+            relaxations += offsets[node + 1] - offsets[node]
+    stats['heap_pushes'] = stats.get('heap_pushes', 0) + pushes
+    stats['heap_pops'] = stats.get('heap_pops', 0) + pushes - left_in_frontier
+    stats['edge_relaxations'] = stats.get('edge_relaxations', 0) + relaxations
+
+
+def _zero(node):
+    return 0
+
+
+def path_to(graph, parents, source, target):
+    '''
+    Walks the parents of a search back from target.
+    :param graph: CompactGraph the search ran on
+    :param parents: parents list from dijkstra or astar
+    :param source: source index
+    :param target: target index
+    :return: list of osm_id from source to target, or None if target was not reached
+    '''
+    if parents[target] == NO_PARENT:
+        return None
+    path = [graph.ids[target]]
+    current_node = target
+    while current_node != source:
+        current_node = parents[current_node]
+        path.append(graph.ids[current_node])
+    path.reverse()
+    return path
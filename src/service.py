@@ -0,0 +1,552 @@
+'''
+Long-lived routing service.
+
+Loads the routing session once and answers JSON queries over HTTP, on a
+TCP port or a Unix socket:
+
+    GET  /health
+    GET  /metrics
+    GET  /route?source=S&destination=D          POST /route   {"source": S, "destination": D}
+    GET  /routes?source=S&destinations=D1,D2    POST /routes  {"source": S, "destinations": [...]}
+                                                POST /matrix  {"sources": [...], "destinations": [...]}
+    GET  /snap?points=LON,LAT|LON,LAT           POST /snap    {"points": [[lon, lat], ...]}
+    GET  /sample?count=N&seed=X                 random vertex ids, for load tests
+
+Every connection is served by its own thread, which only parses the
+request and waits. The searches run in a fixed pool of search processes,
+forked once the session is loaded so they share its graph copy-on-write,
+as the workers of runner.py do; threads only interleave under the GIL.
+The queue of batches stays in the parent: requests with the same source
+that arrive while an earlier one is still queued join its batch, so one
+Dijkstra tree answers all of them, and a thread per process hands it the
+batches one at a time. Costs are null and paths missing for unreachable
+pairs. /snap gives the nearest routable vertex of each point and its
+distance. With --watch-updates edge weight deltas are applied while
+serving, each batch between searches, to the service's graph and to the
+copy of every search process, see updates.py. Landmarks and a hierarchy
+that a batch dropped are rebuilt in the background, and the search
+processes forked again once they are swapped in; until then /health
+reports the service degraded.
+
+Usage:
+    python service.py [--host H] [--port P | --socket PATH] [--workers N]
+                      [--watch-updates [--listen] [--update-interval S]]
+'''
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import multiprocessing
+import os
+import Queue
+import random
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+import benchmark
+import search
+import session
+import updates
+
+HOST = '127.0.0.1'
+PORT = 8080
+WORKERS = 4
+MAX_BATCH = 256  # Destinations per coalesced search
+REQUEST_TIMEOUT = 60.0
+LATENCY_WINDOW = 10000  # Latest latencies kept per endpoint for /metrics
+MAX_BODY = 1 << 20
+MAX_SAMPLE = 100000
+SEARCH = 'search'  # Messages to a search process
+UPDATE = 'update'
+
+
+class RequestError(Exception):
+    '''
+    A request the service refuses, answered with status and message.
+    '''
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class Batch(object):
+    '''
+    Destinations of every request coalesced into one search from source.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.destinations = set()
+        self.requests = 0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SearchProcess(object):
+    '''
+    A process forked from the service that runs the searches it is sent,
+    one at a time, over a duplex pipe. It is forked again from the current
+    graph when it dies.
+    '''
+
+    def __init__(self, routing_session):
+        self.session = routing_session
+        self.lock = threading.Lock()  # One call at a time on the pipe
+        self.start()
+
+    def start(self):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve_searches, args=(child_connection, self.session))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+
+    def call(self, kind, arguments):
+        '''
+        :param kind: SEARCH with (source, destinations), or UPDATE with a list of deltas
+        :return: the SearchResult or updates.UpdateReport of the process
+        '''
+        with self.lock:
+            try:
+                self.connection.send((kind, arguments))
+                answer, error = self.connection.recv()
+            except (EOFError, IOError):
+                self.connection.close()
+                self.process.join()
+                self.start()
+                raise RequestError(500, "Search process exited, started another")
+        if error is not None:
+            raise error
+        return answer
+
+    def restart(self):
+        '''
+        Forks the process again, from the session as it is now.
+        '''
+        with self.lock:
+            self._stop()
+            self.start()
+
+    def close(self):
+        with self.lock:
+            self._stop()
+
+    def _stop(self):
+        try:
+            self.connection.send(None)
+        except IOError:
+            pass  # Already gone
+        self.process.join()
+        self.connection.close()
+
+
+def _serve_searches(connection, routing_session):
+    '''
+    Search process loop: answer every message on connection until None.
+    '''
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        kind, arguments = message
+        try:
+            if kind == SEARCH:
+                answer = routing_session.dijkstra(*arguments)
+            else:
+                answer = updates.apply_updates(routing_session.graph, arguments, routing_session)
+            connection.send((answer, None))
+        except Exception as e:
+            connection.send((None, e))
+
+
+class SearchPool(object):
+    '''
+    Search processes fed from a queue of batches by a thread each. A batch
+    stays open to new requests with its source until a thread takes it.
+    '''
+
+    def __init__(self, routing_session, workers=WORKERS, max_batch=MAX_BATCH, update_lock=None):
+        '''
+        :param routing_session: loaded RoutingSession, the search processes are forked from it
+        :param workers: number of search processes
+        :param max_batch: destinations after which a batch takes no more requests
+        :param update_lock: optional updates.ReadWriteLock every search shares with edge weight updates
+        '''
+        self.session = routing_session
+        self.max_batch = max_batch
+        self.update_lock = update_lock
+        self.queue = Queue.Queue()
+        self.open = {}  # source -> Batch still queued
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+        self.searches = 0
+        self.search_time = 0.0
+        self.processes = []
+        self.threads = []
+        for k in xrange(workers):
+            self.start_worker()
+
+    def start_worker(self):
+        '''
+        Forks one more search process and starts the thread feeding it.
+        '''
+        worker = SearchProcess(self.session)
+        thread = threading.Thread(target=self._run, args=(worker,), name='search-%d' % len(self.threads))
+        thread.daemon = True
+        thread.start()
+        self.processes.append(worker)
+        self.threads.append(thread)
+
+    def submit(self, source, destinations):
+        '''
+        :param source: osm_id in the graph
+        :param destinations: list of osm_id in the graph
+        :return: the Batch that will answer them
+        '''
+        with self.lock:
+            self.requests += 1
+            batch = self.open.get(source)
+            if batch is None or len(batch.destinations) >= self.max_batch:
+                batch = self.open[source] = Batch(source)
+                self.queue.put(batch)
+            else:
+                self.coalesced += 1
+            batch.destinations.update(destinations)
+            batch.requests += 1
+        return batch
+
+    def wait(self, batch, timeout=REQUEST_TIMEOUT):
+        '''
+        :return: SearchResult covering at least the destinations submitted for batch
+        '''
+        if not batch.done.wait(timeout):
+            raise RequestError(504, "Search from %s took over %d seconds" % (batch.source, timeout))
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    def search(self, source, destinations, timeout=REQUEST_TIMEOUT):
+        return self.wait(self.submit(source, destinations), timeout)
+
+    def _run(self, worker):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            with self.lock:
+                if self.open.get(batch.source) is batch:
+                    del self.open[batch.source]
+                destinations = list(batch.destinations)
+            start = time.time()
+            try:
+                if self.update_lock is not None:
+                    with self.update_lock.shared():
+                        batch.result = worker.call(SEARCH, (batch.source, destinations))
+                else:
+                    batch.result = worker.call(SEARCH, (batch.source, destinations))
+            except Exception as e:
+                batch.error = e
+            with self.lock:
+                self.searches += 1
+                self.search_time += time.time() - start
+            batch.done.set()
+
+    def apply_updates(self, deltas):
+        '''
+        Applies a batch of edge weight deltas to the graph of every search
+        process. Called by updates.Poller with the update lock held
+        exclusively, so no search is running.
+        :param deltas: list of (source_osm, target_osm, length)
+        '''
+        for worker in self.processes:
+            worker.call(UPDATE, deltas)
+
+    def reload(self):
+        '''
+        Forks every search process again, so they get what an
+        updates.Rebuilder swapped into the session. Called with the update
+        lock held exclusively.
+        '''
+        for worker in self.processes:
+            worker.restart()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'coalesced': self.coalesced, 'searches': self.searches,
+                    'search_seconds': self.search_time, 'queued': self.queue.qsize(), 'workers': len(self.threads)}
+
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for worker in self.processes:
+            worker.close()
+
+
+class RoutingService(object):
+    '''
+    Answers the queries of the HTTP handler and keeps its metrics.
+    '''
+
+    def __init__(self, routing_session, workers=WORKERS, max_batch=MAX_BATCH):
+        self.session = routing_session
+        self.graph = routing_session.graph
+        self.update_lock = updates.ReadWriteLock()
+        self.pool = SearchPool(routing_session, workers, max_batch, self.update_lock)
+        self.poller = None
+        self.rebuilder = None
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counts = collections.defaultdict(int)
+        self.errors = collections.defaultdict(int)
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.counts[endpoint] += 1
+            self.latencies[endpoint].append(seconds)
+            if status >= 400:
+                self.errors[endpoint] += 1
+
+    def health(self, arguments):
+        missing = self.rebuilder.missing() if self.rebuilder is not None else []
+        return {'status': 'degraded' if missing else 'ok', 'missing': missing,
+                'rebuilding': self.rebuilder is not None and self.rebuilder.rebuilding,
+                'below_straight_line': len(self.graph.below_straight_line),
+                'nodes': len(self.graph), 'uptime_seconds': time.time() - self.started,
+                'graph_version': self.graph.version,
+                'last_delta': self.poller.last_id if self.poller is not None else None}
+
+    def metrics(self, arguments):
+        with self.lock:
+            endpoints = {}
+            for endpoint, window in self.latencies.iteritems():
+                latencies = sorted(window)
+                endpoints[endpoint] = dict(('p%d_ms' % p, benchmark.percentile(latencies, p) * 1000)
+                                           for p in benchmark.PERCENTILES)
+                endpoints[endpoint].update({'requests': self.counts[endpoint], 'errors': self.errors[endpoint]})
+        return {'uptime_seconds': time.time() - self.started, 'endpoints': endpoints, 'pool': self.pool.stats()}
+
+    def route(self, arguments):
+        source = self._node(arguments, 'source')
+        destination = self._node(arguments, 'destination')
+        result = self.pool.search(source, [destination])
+        return _route(source, destination, result)
+
+    def routes(self, arguments):
+        source = self._node(arguments, 'source')
+        destinations = self._nodes(arguments, 'destinations')
+        result = self.pool.search(source, destinations)
+        return {'source': source, 'routes': [_route(source, destination, result) for destination in destinations]}
+
+    def matrix(self, arguments):
+        sources = self._nodes(arguments, 'sources')
+        destinations = self._nodes(arguments, 'destinations')
+        batches = [self.pool.submit(source, destinations) for source in sources]
+        rows = []
+        for batch in batches:
+            result = self.pool.wait(batch)
+            rows.append([_cost(result.costs[destination]) for destination in destinations])
+        return {'sources': sources, 'destinations': destinations, 'costs': rows}
+
+    def snap(self, arguments):
+        points = arguments.get('points')
+        if isinstance(points, basestring):
+            points = [point.split(',') for point in points.split('|')]  # parse_qs splits on ';'
+        if not points:
+            raise RequestError(400, "Missing points")
+        try:
+            points = [(float(lon), float(lat)) for lon, lat in points]
+        except (TypeError, ValueError):
+            raise RequestError(400, "points are not lon,lat pairs")
+        return {'snaps': [snap.as_dict() for snap in self.session.snap(points)]}
+
+    def sample(self, arguments):
+        try:
+            count = min(int(arguments.get('count', 100)), MAX_SAMPLE)
+        except ValueError:
+            raise RequestError(400, "count is not a number")
+        rng = random.Random(arguments.get('seed'))
+        return {'nodes': [self.graph.ids[rng.randrange(len(self.graph))] for k in xrange(count)]}
+
+    def _node(self, arguments, name):
+        if name not in arguments:
+            raise RequestError(400, "Missing %s" % name)
+        try:
+            osm_id = float(arguments[name])
+        except (TypeError, ValueError):
+            raise RequestError(400, "%s is not a vertex id" % name)
+        if osm_id not in self.graph:
+            raise RequestError(404, "%s %s is not in the graph" % (name, arguments[name]))
+        return osm_id
+
+    def _nodes(self, arguments, name):
+        values = arguments.get(name)
+        if isinstance(values, basestring):
+            values = values.split(',')
+        if not values:
+            raise RequestError(400, "Missing %s" % name)
+        return [self._node({name: value}, name) for value in values]
+
+    def watch_updates(self, deltas, channel=None, interval=updates.POLL_INTERVAL):
+        '''
+        Applies edge weight deltas between searches from a daemon thread,
+        and rebuilds the landmarks and hierarchy they drop from another.
+        :param deltas: updates.TableDeltas or updates.MemoryDeltas
+        :param channel: updates.Listener or updates.LocalChannel, None to only poll
+        '''
+        self.rebuilder = updates.Rebuilder(self.session, self.update_lock)
+        self.rebuilder.followers.append(self.pool)
+        self.rebuilder.start()
+        self.poller = updates.Poller(self.session, deltas)
+        self.poller.followers.extend([self.pool, self.rebuilder])
+        return updates.start_watcher(self.poller, channel, interval, self.update_lock)
+
+    def close(self):
+        if self.rebuilder is not None:
+            self.rebuilder.stop()
+        self.pool.close()
+
+
+def _cost(cost):
+    return None if cost == search.INFINITY else cost
+
+
+def _route(source, destination, result):
+    return {'source': source, 'destination': destination, 'cost': _cost(result.costs[destination]),
+            'path': result.paths[destination]}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections open between requests
+    GET = {'/health': 'health', '/metrics': 'metrics', '/route': 'route', '/routes': 'routes', '/snap': 'snap',
+           '/sample': 'sample'}
+    POST = {'/route': 'route', '/routes': 'routes', '/matrix': 'matrix', '/snap': 'snap'}
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        arguments = dict((name, values[-1]) for name, values in urlparse.parse_qs(url.query).iteritems())
+        self._answer(self.GET.get(url.path), url.path, arguments)
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader('content-length') or 0)
+        if length > MAX_BODY:
+            self._send(413, {'error': 'Request body over %d bytes' % MAX_BODY})
+            return
+        try:
+            arguments = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            self._send(400, {'error': 'Body is not JSON'})
+            return
+        if not isinstance(arguments, dict):
+            self._send(400, {'error': 'Body is not a JSON object'})
+            return
+        self._answer(self.POST.get(url.path), url.path, arguments)
+
+    def _answer(self, method, endpoint, arguments):
+        start = time.time()
+        service = self.server.service
+        if method is None:
+            status, body = 404, {'error': 'No endpoint %s %s' % (self.command, endpoint)}
+        else:
+            try:
+                status, body = 200, getattr(service, method)(arguments)
+            except RequestError as e:
+                status, body = e.status, {'error': str(e)}
+            except Exception as e:
+                status, body = 500, {'error': repr(e)}
+        service.record(method or 'unknown', time.time() - start, status)
+        self._send(status, body)
+
+    def _send(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'  # Unix sockets have no peer address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service, host=HOST, port=PORT, socket_path=None, verbose=False):
+    '''
+    :param service: RoutingService
+    :param port: TCP port, 0 for any free one
+    :param socket_path: Unix socket to listen on instead of host and port
+    :return: server, call serve_forever on it
+    '''
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, Handler)
+    else:
+        server = HTTPServer((host, port), Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def serve(host=HOST, port=PORT, socket_path=None, workers=WORKERS, verbose=False, watch=False, listen=False,
+          interval=updates.POLL_INTERVAL):
+    '''
+    Loads the shared session and serves until interrupted.
+    :param watch: apply the edge weight deltas of updates.DELTA_TABLE, replaying them all first
+    :param listen: also wake up on NOTIFY instead of only polling every interval seconds
+    '''
+    start = time.time()
+    service = RoutingService(session.get_session(), workers)
+    service.session.spatial_index()  # Built up front so the first /snap is not slow
+    if watch:
+        service.watch_updates(updates.TableDeltas(), updates.Listener() if listen else None, interval)
+    server = make_server(service, host, port, socket_path, verbose)
+    print >> sys.stderr, "Loaded %d nodes in %.1f seconds, listening on %s" % (
+        len(service.graph), time.time() - start, socket_path or '%s:%d' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve routing queries over HTTP.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--socket', default=None, help='Unix socket path, instead of host and port')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='search processes')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    parser.add_argument('--watch-updates', action='store_true', help='apply edge weight deltas as they arrive')
+    parser.add_argument('--listen', action='store_true', help='wake up on NOTIFY %s too' % updates.CHANNEL)
+    parser.add_argument('--update-interval', type=float, default=updates.POLL_INTERVAL)
+    arguments = parser.parse_args()
+    serve(arguments.host, arguments.port, arguments.socket, arguments.workers, arguments.verbose,
+          arguments.watch_updates, arguments.listen, arguments.update_interval)
@@ -0,0 +1,355 @@
+import os
+import threading
+import cache
+import components
+import contraction
+import heuristics
+import kernels
+import landmarks
+import metrics
+import search
+import snapshot
+import spatial
+
+DIJKSTRA = 'dijkstra'  # SearchResult.fallback of A* queries answered by Dijkstra
+
+_session = None
+
+
+class SearchResult(object):
+    '''
+    Outcome of one query: the cost and node path to every destination
+    (INFINITY and None when it cannot be reached) and the nodes assessed,
+    in total and as (forward, backward) for bidirectional searches.
+    fallback names the algorithm that answered instead of the one asked
+    for, e.g. 'dijkstra' for A* while updates made the heuristic unsafe.
+    '''
+
+    def __init__(self, source, destinations, costs, paths, nodes_assessed, nodes_assessed_by_direction=None):
+        self.source = source
+        self.destinations = destinations
+        self.costs = costs
+        self.paths = paths
+        self.nodes_assessed = nodes_assessed
+        if nodes_assessed_by_direction is None:
+            nodes_assessed_by_direction = (nodes_assessed, 0)
+        self.nodes_assessed_by_direction = nodes_assessed_by_direction
+        self.cache_hits = 0
+        self.unreachable = 0
+        self.fallback = None
+
+    @property
+    def parents(self):
+        '''
+        osm_id keyed parents of the nodes on the found paths, in the form
+        display_shortest_route walks. Unreached destinations are left out,
+        so walking them raises KeyError as it always has.
+        '''
+        parents = {}
+        for path in self.paths.itervalues():
+            if path is None:
+                continue
+            parents[path[0]] = path[0]
+            for index in xrange(1, len(path)):
+                parents[path[index]] = path[index - 1]
+        return parents
+
+
+class RoutingSession(object):
+    '''
+    Holds one loaded graph, and optionally its contraction hierarchy and
+    landmarks, and answers any number of Dijkstra and A* queries against it.
+    '''
+
+    def __init__(self, graph, hierarchy=None, landmarks=None):
+        '''
+        :param graph: CompactGraph with vertex coordinates
+        :param hierarchy: ContractionHierarchy of graph, needed for CONTRACTION mode
+        :param landmarks: Landmarks of graph, needed for the ALT heuristic
+        '''
+        self.graph = graph
+        self.hierarchy = hierarchy
+        self.landmarks = landmarks
+        self.cache = None
+        self.spatial = None  # SpatialIndex, built by the first snap
+        self.reuse_workspace = True  # False allocates fresh search arrays per query
+        self._local = threading.local()
+
+    @classmethod
+    def load(cls, path=snapshot.SNAPSHOT_PATH, hierarchy_path=contraction.HIERARCHY_PATH,
+             landmarks_path=landmarks.LANDMARKS_PATH, components_path=components.COMPONENTS_PATH):
+        '''
+        :param path: snapshot file, the database is read when it does not exist
+        :param hierarchy_path: contraction hierarchy file, loaded when it exists
+        :param landmarks_path: landmarks file, loaded when it exists
+        :param components_path: component labels file, loaded when it exists, otherwise the labels are computed
+        :return: RoutingSession
+        '''
+        graph = snapshot.load_compact_graph(path)
+        if components_path and os.path.exists(components_path):
+            graph.components = components.load_components(graph, components_path)
+        else:
+            components.get_components(graph)
+        hierarchy = None
+        if hierarchy_path and os.path.exists(hierarchy_path):
+            hierarchy = contraction.load_hierarchy(graph, hierarchy_path)
+        graph_landmarks = None
+        if landmarks_path and os.path.exists(landmarks_path):
+            graph_landmarks = landmarks.load_landmarks(graph, landmarks_path)
+        return cls(graph, hierarchy, graph_landmarks)
+
+    def enable_cache(self, capacity=cache.CAPACITY, path=None):
+        '''
+        Answers repeated pairs, in either direction, from a RouteCache.
+        :param capacity: most routes kept
+        :param path: saved cache to start from, ignored when it was filled from another graph
+        :return: the RouteCache
+        '''
+        if path is not None:
+            self.cache = cache.load_cache(path, self.graph, capacity)
+        else:
+            self.cache = cache.RouteCache(capacity, self.graph)
+        return self.cache
+
+    def spatial_index(self):
+        '''
+        :return: SpatialIndex of the routable vertices, built on first use
+        '''
+        if self.spatial is None:
+            self.spatial = spatial.build_index(self.graph)
+        return self.spatial
+
+    def snap(self, points):
+        '''
+        Snaps coordinates to their nearest routable vertices in one bulk call.
+        :param points: list of (lon, lat)
+        :return: list of spatial.Snap
+        '''
+        return self.spatial_index().snap_many(points)
+
+    def dijkstra(self, source, destinations, mode=search.UNIDIRECTIONAL, query_metrics=None):
+        '''
+        Searches for the destinations that are reachable and that the route
+        cache, if enabled, cannot answer. Same parameters and result as _dijkstra.
+        '''
+        return self._answer(source, destinations, lambda missing: self._dijkstra(source, missing, mode, query_metrics))
+
+    def astar(self, source, destinations, metric=heuristics.PLANAR, mode=search.UNIDIRECTIONAL,
+              query_metrics=None):
+        '''
+        Searches for the destinations that are reachable and that the route
+        cache, if enabled, cannot answer. Same parameters and result as _astar.
+        '''
+        return self._answer(source, destinations,
+                            lambda missing: self._astar(source, missing, metric, mode, query_metrics))
+
+    def _answer(self, source, destinations, compute):
+        '''
+        Answers a destination in another connected component of the graph
+        as unreachable, and a repeated pair from the route cache, without
+        searching.
+        :param compute: function of the destinations to search for, giving a SearchResult
+        :return: SearchResult for every destination, cache_hits of them from
+                 the cache and unreachable of them in another component
+        '''
+        graph_components = self.graph.components
+        if self.cache is None and graph_components is None:
+            return compute(destinations)
+        hits = {}
+        unreachable = []
+        missing = []
+        for destination in destinations:
+            if graph_components is not None and not graph_components.connected_ids(source, destination):
+                unreachable.append(destination)
+                continue
+            route = self.cache.get(source, destination) if self.cache is not None else None
+            if route is None:
+                missing.append(destination)
+            else:
+                hits[destination] = route
+        if missing:
+            result = compute(missing)
+            if self.cache is not None:
+                for destination in missing:
+                    self.cache.put(source, destination, result.costs[destination], result.paths[destination])
+        else:
+            result = SearchResult(source, [], {}, {}, 0)
+        for destination, route in hits.iteritems():
+            result.costs[destination] = route.cost
+            result.paths[destination] = list(route.path) if route.path is not None else None
+        for destination in unreachable:
+            result.costs[destination] = search.INFINITY
+            result.paths[destination] = None
+        result.destinations = destinations
+        result.cache_hits = len(hits)
+        result.unreachable = len(unreachable)
+        return result
+
+    def _dijkstra(self, source, destinations, mode=search.UNIDIRECTIONAL, query_metrics=None):
+        '''
+        :param source: osm_id to start at
+        :param destinations: list of osm_id to finish at
+        :param mode: UNIDIRECTIONAL runs one search that stops once every
+                     destination is settled, BIDIRECTIONAL one search per destination, CONTRACTION one hierarchy
+                     query per destination
+        :param query_metrics: optional metrics.QueryMetrics to record phases and counters in
+        :return: SearchResult
+        '''
+        graph = self.graph
+        source_index = graph.index_of(source)
+        if mode == search.BIDIRECTIONAL:
+            return self._bidirectional(source, destinations, lambda destination_index: None,
+                                       query_metrics=query_metrics)
+        if mode == search.CONTRACTION:
+            if self.hierarchy is None:
+                raise ValueError("CONTRACTION mode needs a hierarchy, build one with contraction.py")
+            return self._bidirectional(source, destinations, None, self.hierarchy.query, query_metrics)
+        destination_indices = [graph.index_of(d) for d in destinations]
+        stats = {} if query_metrics is not None else None
+        with metrics.phase(query_metrics, metrics.SEARCH):
+            costs, parents, nodes_assessed = search.dijkstra(graph, source_index, destination_indices, stats,
+                                                             self._workspaces()[0])
+        result_costs = {}
+        paths = {}
+        with metrics.phase(query_metrics, metrics.PATH_RECONSTRUCTION):
+            for destination, index in zip(destinations, destination_indices):
+                result_costs[destination] = float(costs[index])
+                paths[destination] = search.path_to(graph, parents, source_index, index)
+        if stats is not None:
+            query_metrics.add_stats(stats)
+        return SearchResult(source, destinations, result_costs, paths, nodes_assessed)
+
+    def _astar(self, source, destinations, metric=heuristics.PLANAR, mode=search.UNIDIRECTIONAL,
+               query_metrics=None):
+        '''
+        One A* search from source to each destination. With the numpy kernels
+        a straight line search reads its heuristic from a table, see kernels.py.
+        While an updated road is shorter than the straight line between its
+        ends, straight line queries are answered by Dijkstra instead.
+        :param source: osm_id to start at
+        :param destinations: list of osm_id to finish at
+        :param metric: heuristics.PLANAR, heuristics.HAVERSINE or heuristics.ALT
+        :param mode: UNIDIRECTIONAL or BIDIRECTIONAL
+        :param query_metrics: optional metrics.QueryMetrics, the search phase includes the heuristic one
+        :return: SearchResult, nodes_assessed summed over the searches
+        '''
+        graph = self.graph
+        if metric != heuristics.ALT and graph.below_straight_line:
+            # An updated road is shorter than the straight line, the heuristic could overestimate
+            result = self._dijkstra(source, destinations, mode, query_metrics)
+            result.fallback = DIJKSTRA
+            return result
+        source_index = graph.index_of(source)
+        if mode == search.BIDIRECTIONAL:
+            to_source = self._heuristic(source_index, metric)
+            return self._bidirectional(source, destinations, lambda destination_index: heuristics.average_potential(
+                self._heuristic(destination_index, metric), to_source), query_metrics=query_metrics)
+        result_costs = {}
+        paths = {}
+        nodes_assessed = 0
+        stats = {} if query_metrics is not None else None
+        vectorized = metric != heuristics.ALT and kernels.get_backend() == kernels.NUMPY
+        for destination in destinations:
+            destination_index = graph.index_of(destination)
+            if vectorized:
+                with metrics.phase(query_metrics, metrics.SEARCH):
+                    with metrics.phase(query_metrics, metrics.HEURISTIC):
+                        table = kernels.heuristic_table(graph, destination_index, metric)
+                    if query_metrics is not None:
+                        query_metrics.count('heuristic_calls', len(table))
+                    costs, parents, assessed = kernels.astar(graph, source_index, destination_index, table, stats,
+                                                             self._workspaces()[0])
+            else:
+                heuristic = self._heuristic(destination_index, metric)
+                if query_metrics is not None:
+                    heuristic = query_metrics.timed_heuristic(heuristic)
+                with metrics.phase(query_metrics, metrics.SEARCH):
+                    costs, parents, assessed = search.astar(graph, source_index, destination_index, heuristic,
+                                                            stats, self._workspaces()[0])
+            with metrics.phase(query_metrics, metrics.PATH_RECONSTRUCTION):
+                result_costs[destination] = float(costs[destination_index])
+                paths[destination] = search.path_to(graph, parents, source_index, destination_index)
+            nodes_assessed = nodes_assessed + assessed
+        if stats is not None:
+            query_metrics.add_stats(stats)
+        return SearchResult(source, destinations, result_costs, paths, nodes_assessed)
+
+    def _workspaces(self):
+        '''
+        The (forward, backward) search workspaces of the calling thread,
+        allocated on its first query, so forked workers and service threads
+        each get their own. (None, None) when reuse_workspace is off.
+        '''
+        if not self.reuse_workspace:
+            return None, None
+        workspaces = getattr(self._local, 'workspaces', None)
+        if workspaces is None:
+            n = len(self.graph)
+            workspaces = self._local.workspaces = (search.SearchWorkspace(n), search.SearchWorkspace(n))
+        return workspaces
+
+    def _heuristic(self, destination_index, metric):
+        '''
+        :return: lower bound function toward destination_index for metric
+        '''
+        if metric == heuristics.ALT:
+            if self.landmarks is None:
+                raise ValueError("The ALT heuristic needs landmarks, build them with landmarks.py")
+            return self.landmarks.make_heuristic(destination_index)
+        return heuristics.make_compact_heuristic(self.graph, destination_index, metric)
+
+    def _bidirectional(self, source, destinations, make_potential, query=None, query_metrics=None):
+        '''
+        One bidirectional search per destination.
+        :param make_potential: function of a destination index giving the forward potential or None
+        :param query: function of (source index, destination index) to use instead of search.bidirectional
+        :param query_metrics: optional metrics.QueryMetrics
+        :return: SearchResult
+        '''
+        graph = self.graph
+        source_index = graph.index_of(source)
+        result_costs = {}
+        paths = {}
+        forward = 0
+        backward = 0
+        stats = {} if query_metrics is not None else None
+        for destination in destinations:
+            destination_index = graph.index_of(destination)
+            with metrics.phase(query_metrics, metrics.SEARCH):
+                if query is not None:
+                    cost, path, assessed = query(source_index, destination_index)
+                else:
+                    potential = make_potential(destination_index)
+                    if potential is not None and query_metrics is not None:
+                        potential = query_metrics.timed_heuristic(potential)
+                    cost, path, assessed = search.bidirectional(graph, source_index, destination_index,
+                                                                potential, stats, self._workspaces())
+            with metrics.phase(query_metrics, metrics.PATH_RECONSTRUCTION):
+                result_costs[destination] = cost
+                paths[destination] = [graph.ids[i] for i in path] if path is not None else None
+            forward = forward + assessed[0]
+            backward = backward + assessed[1]
+        if stats is not None:
+            query_metrics.add_stats(stats)
+        return SearchResult(source, destinations, result_costs, paths, forward + backward, (forward, backward))
+
+
+def get_session():
+    '''
+    The session shared by find_shortest_route calls in this process,
+    loaded on first use.
+    :return: RoutingSession
+    '''
+    global _session
+    if _session is None:
+        _session = RoutingSession.load()
+    return _session
+
+
+def set_session(routing_session):
+    '''
+    Replaces the shared session, e.g. with one over a different graph.
+    :param routing_session: RoutingSession or None to load again on next use
+    '''
+    global _session
+    _session = routing_session
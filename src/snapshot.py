@@ -0,0 +1,249 @@
+'''
+Versioned binary snapshot of the routing graph.
+
+Layout (little endian): a fixed header, integer header fields, a table
+of named sections, then one 8 byte aligned array per section. The header
+fields of a graph snapshot are the row counts and a content hash of
+ways_vertices_pgr and ways at export time, so a stale snapshot can be
+detected without reloading the tables. Other preprocessed structures
+reuse the same layout through write_arrays and read_arrays.
+
+Usage:
+    python snapshot.py export [path]
+    python snapshot.py check [path]
+'''
+from array import array
+import mmap
+import os
+import struct
+import sys
+import time
+import compact_graph
+import ingest
+import database
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'RGRAPH\0\0'
+VERSION = 2
+SNAPSHOT_PATH = 'denver.graph'
+# magic, version, number of header fields, number of sections
+HEADER = struct.Struct('<8sIII')
+FIELD = struct.Struct('<q')
+# name, array typecode, offset, number of items
+SECTION = struct.Struct('<16sc7xQQ')
+NUMPY_TYPES = {'d': '<f8', 'f': '<f4', 'i': '<i4', 'l': '<i8', 'b': 'i1', 'B': 'u1'}
+GRAPH_SECTIONS = ('ids', 'offsets', 'targets', 'weights', 'lons', 'lats')
+ALIGNMENT = 8
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def source_fingerprint(conn):
+    '''
+    Row counts and an order independent hash of the columns the
+    graph is built from.
+    :param conn: open database connection
+    :return: (vertex_rows, vertex_hash, edge_rows, edge_hash)
+    '''
+    cur = conn.cursor()
+    cur.execute("SELECT count(*), coalesce(sum(hashtext(osm_id::text || ',' || lon::text || ',' || lat::text)), 0) "
+                "FROM ways_vertices_pgr")
+    vertex_rows, vertex_hash = cur.fetchone()
+    cur.execute("SELECT count(*), coalesce(sum(hashtext(source_osm::text || ',' || target_osm::text || ',' || length::text)), 0) "
+                "FROM ways")
+    edge_rows, edge_hash = cur.fetchone()
+    return int(vertex_rows), int(vertex_hash), int(edge_rows), int(edge_hash)
+
+
+def write_arrays(path, magic, version, fields, sections):
+    '''
+    Writes a little endian file of integer header fields followed by
+    8 byte aligned arrays. The file is written next to path and renamed
+    over it, so readers never see a partial file.
+    :param path: file to write
+    :param magic: 8 byte file type tag
+    :param version: format version
+    :param fields: sequence of int header values
+    :param sections: list of (name, array.array) pairs
+    :return: path
+    '''
+    if sys.byteorder != 'little':
+        raise SnapshotError("Snapshots are little endian, refusing to write on a big endian host")
+    position = HEADER.size + FIELD.size * len(fields) + SECTION.size * len(sections)
+    table = []
+    for name, values in sections:
+        position += -position % ALIGNMENT
+        table.append(SECTION.pack(name, values.typecode, position, len(values)))
+        position += len(values) * values.itemsize
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(HEADER.pack(magic, version, len(fields), len(sections)))
+        for field in fields:
+            f.write(FIELD.pack(field))
+        f.write(''.join(table))
+        for (name, values), entry in zip(sections, table):
+            offset = SECTION.unpack(entry)[2]
+            f.write('\0' * (offset - f.tell()))
+            values.tofile(f)
+    os.rename(temporary_path, path)
+    return path
+
+
+def read_fields(path, magic, version):
+    '''
+    :param path: file written by write_arrays
+    :return: tuple of the header fields
+    '''
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+        fields, section_count = _parse_header(data, magic, version)
+        return struct.unpack('<%dq' % fields, f.read(FIELD.size * fields))
+
+
+def _parse_header(data, magic, version):
+    if len(data) < HEADER.size:
+        raise SnapshotError("Snapshot is truncated")
+    file_magic, file_version, fields, sections = HEADER.unpack(data[:HEADER.size])
+    if file_magic != magic:
+        raise SnapshotError("Not a %s file" % magic.rstrip('\0'))
+    if file_version != version:
+        raise SnapshotError("%s version %d, expected %d" % (magic.rstrip('\0'), file_version, version))
+    return fields, sections
+
+
+def read_arrays(path, magic, version):
+    '''
+    Memory maps a file written by write_arrays.
+    With NumPy installed the arrays are zero copy read-only views of the
+    mapped pages, so loading takes milliseconds and processes that load
+    the same file share one physical copy. Without NumPy the sections are
+    copied into array.array objects.
+    :param path: file to read
+    :return: fields tuple, dict of name -> array, and the mmap to keep alive
+    '''
+    if sys.byteorder != 'little':
+        raise SnapshotError("Snapshots are little endian, refusing to load on a big endian host")
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    field_count, section_count = _parse_header(mapped[:HEADER.size], magic, version)
+    position = HEADER.size
+    fields = struct.unpack_from('<%dq' % field_count, mapped, position)
+    position += FIELD.size * field_count
+    sections = {}
+    for k in xrange(section_count):
+        name, typecode, offset, count = SECTION.unpack_from(mapped, position)
+        position += SECTION.size
+        if numpy is not None:
+            values = numpy.frombuffer(mapped, dtype=NUMPY_TYPES[typecode], count=count, offset=offset)
+        else:
+            values = array(typecode)
+            values.fromstring(mapped[offset:offset + count * values.itemsize])
+        sections[name.rstrip('\0')] = values
+    return fields, sections, mapped
+
+
+def write_snapshot(graph, path, fingerprint=(0, 0, 0, 0)):
+    '''
+    Writes a CompactGraph to path.
+    :param graph: CompactGraph with coordinates
+    :param path: snapshot file
+    :param fingerprint: result of source_fingerprint for the rows graph came from
+    :return: path
+    '''
+    if graph.lons is None:
+        raise SnapshotError("Graph has no vertex coordinates")
+    sections = []
+    for name, typecode in zip(GRAPH_SECTIONS, (compact_graph.ID_TYPE, compact_graph.INDEX_TYPE,
+                                               compact_graph.INDEX_TYPE, compact_graph.WEIGHT_TYPE,
+                                               compact_graph.COORDINATE_TYPE, compact_graph.COORDINATE_TYPE)):
+        values = getattr(graph, name)
+        if not isinstance(values, array):
+            values = array(typecode, values)
+        sections.append((name, values))
+    return write_arrays(path, MAGIC, VERSION, tuple(fingerprint), sections)
+
+
+def read_header(path):
+    '''
+    :param path: snapshot file
+    :return: dict of the header fields
+    '''
+    return {'fingerprint': read_fields(path, MAGIC, VERSION)}
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    '''
+    Memory maps a snapshot and returns a CompactGraph over it.
+    :param path: snapshot file
+    :return: CompactGraph
+    '''
+    fingerprint, sections, mapped = read_arrays(path, MAGIC, VERSION)
+    graph = compact_graph.CompactGraph(*[sections[name] for name in GRAPH_SECTIONS])
+    graph.fingerprint = fingerprint
+    graph.mapped = mapped  # Keep the mapping open for as long as the graph is alive
+    return graph
+
+
+def is_stale(path, conn):
+    '''
+    :param path: snapshot file
+    :param conn: open database connection
+    :return: True if the tables changed since the snapshot was exported
+    '''
+    return read_header(path)['fingerprint'] != source_fingerprint(conn)
+
+
+def export_snapshot(path=SNAPSHOT_PATH):
+    '''
+    Reads the graph and coordinates from the database and writes a snapshot.
+    :param path: snapshot file
+    :return: the CompactGraph that was written
+    '''
+    with database.connection() as conn:
+        fingerprint = source_fingerprint(conn)
+        graph = ingest.load_compact_graph(conn)
+    write_snapshot(graph, path, fingerprint)
+    return graph
+
+
+def load_compact_graph(path=SNAPSHOT_PATH):
+    '''
+    Loads the CompactGraph from the snapshot at path when there is one,
+    otherwise builds it from the database.
+    :param path: snapshot file
+    :return: CompactGraph
+    '''
+    if os.path.exists(path):
+        return load_snapshot(path)
+    with database.connection() as conn:
+        return ingest.load_compact_graph(conn, verbose=False)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+    if command == 'export':
+        start = time.time()
+        graph = export_snapshot(path)
+        print "Wrote %s: %d nodes, %d directed edges, %.1f MB in %.2f seconds" % (
+            path, len(graph), graph.edge_count(), os.path.getsize(path) / 1048576.0, time.time() - start)
+    elif command == 'check':
+        start = time.time()
+        graph = load_snapshot(path)
+        print "Loaded %s: %d nodes in %.4f seconds" % (path, len(graph), time.time() - start)
+        with database.connection() as conn:
+            stale = is_stale(path, conn)
+        if stale:
+            print "Snapshot is STALE, run: python snapshot.py export " + path
+            sys.exit(1)
+        print "Snapshot is up to date"
+    else:
+        print __doc__
+        sys.exit(2)
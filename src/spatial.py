@@ -0,0 +1,292 @@
+'''
+In-memory spatial index for snapping coordinates to routable vertices.
+
+The vertices with at least one edge are bucketed into a uniform grid
+over their bounding box, stored like the graph itself: cell offsets
+into arrays of node indices and coordinates sorted by cell. A single
+point is snapped by scanning rings of cells around its own until no
+unscanned cell can hold anything closer. A bulk snap looks at the 3 x 3
+cells around every point at once with numpy, one array operation per
+candidate slot instead of one Python loop per point, and only the few
+points whose nearest vertex could lie farther out fall back to the ring
+scan. Without numpy the bulk snap runs the ring scan point by point.
+
+Distances are planar degrees, the unit of ST_Distance on SRID 4326 and
+of the length column of ways. Snap.meters gives the great circle distance.
+
+Usage:
+    python spatial.py lon,lat [lon,lat ...]
+'''
+from array import array
+import math
+import sys
+import time
+import compact_graph
+import heuristics
+import snapshot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CELL_NODES = 4  # Vertices per grid cell on average
+NONE = -1
+
+
+class Snap(object):
+    '''
+    A coordinate snapped to its nearest routable vertex.
+    '''
+
+    def __init__(self, lon, lat, osm_id, index, distance, meters, seconds=0.0):
+        '''
+        :param lon: longitude of the point
+        :param lat: latitude of the point
+        :param osm_id: id of the nearest vertex
+        :param index: node index of the nearest vertex
+        :param distance: planar distance in degrees
+        :param meters: great circle distance
+        :param seconds: time spent snapping the point
+        '''
+        self.lon = lon
+        self.lat = lat
+        self.osm_id = osm_id
+        self.index = index
+        self.distance = distance
+        self.meters = meters
+        self.seconds = seconds
+
+    def as_dict(self):
+        return {'lon': self.lon, 'lat': self.lat, 'osm_id': self.osm_id, 'distance': self.distance,
+                'meters': self.meters, 'seconds': self.seconds}
+
+
+class SpatialIndex(object):
+    '''
+    Uniform grid of vertex indices. Cell k holds nodes[cell_offsets[k]:cell_offsets[k + 1]].
+    '''
+
+    def __init__(self, graph, min_lon, min_lat, cell, columns, rows, cell_offsets, nodes, lons, lats):
+        '''
+        :param graph: CompactGraph indexed
+        :param min_lon: west edge of the grid
+        :param min_lat: south edge of the grid
+        :param cell: cell side in degrees
+        :param columns: cells across
+        :param rows: cells down
+        :param cell_offsets: array of columns * rows + 1 positions, cell k = row * columns + column
+        :param nodes: array of node indices sorted by cell
+        :param lons: longitudes in the order of nodes
+        :param lats: latitudes in the order of nodes
+        '''
+        self.graph = graph
+        self.min_lon = min_lon
+        self.min_lat = min_lat
+        self.cell = cell
+        self.columns = columns
+        self.rows = rows
+        self.cell_offsets = cell_offsets
+        self.nodes = nodes
+        self.lons = lons
+        self.lats = lats
+        self._numpy = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _cell_of(self, lon, lat):
+        column = min(max(int(math.floor((lon - self.min_lon) / self.cell)), 0), self.columns - 1)
+        row = min(max(int(math.floor((lat - self.min_lat) / self.cell)), 0), self.rows - 1)
+        return column, row
+
+    def nearest(self, lon, lat):
+        '''
+        :param lon: longitude
+        :param lat: latitude
+        :return: (node index, planar distance) of the nearest indexed vertex, (NONE, inf) for an empty index
+        '''
+        column, row = self._cell_of(lon, lat)
+        offsets = self.cell_offsets
+        lons = self.lons
+        lats = self.lats
+        columns = self.columns
+        best = NONE
+        best_squared = float('inf')
+        for ring in xrange(max(self.columns, self.rows)):
+            for r in xrange(max(row - ring, 0), min(row + ring, self.rows - 1) + 1):
+                # The ring's top and bottom rows in full, only its two side cells in between
+                if r == row - ring or r == row + ring:
+                    spans = ((max(column - ring, 0), min(column + ring, columns - 1)),)
+                else:
+                    spans = ((column - ring, column - ring), (column + ring, column + ring))
+                for first, last in spans:
+                    if first < 0 or last >= columns:
+                        continue
+                    for position in xrange(offsets[r * columns + first], offsets[r * columns + last + 1]):
+                        d_lon = lons[position] - lon
+                        d_lat = lats[position] - lat
+                        squared = d_lon * d_lon + d_lat * d_lat
+                        if squared < best_squared:
+                            best_squared = squared
+                            best = position
+            # Every cell outside this ring is at least ring cells away from the point
+            reach = ring * self.cell
+            if best != NONE and best_squared <= reach * reach:
+                break
+        if best == NONE:
+            return NONE, float('inf')
+        return self.nodes[best], math.sqrt(best_squared)
+
+    def nearest_many(self, lons, lats):
+        '''
+        Snaps many points in one call.
+        :param lons: sequence of longitudes
+        :param lats: sequence of latitudes, same length
+        :return: (node indices, planar distances), numpy arrays when numpy is installed
+        '''
+        if numpy is None or not len(self.nodes):
+            indices = array(compact_graph.INDEX_TYPE)
+            distances = array('d')
+            for lon, lat in zip(lons, lats):
+                index, distance = self.nearest(lon, lat)
+                indices.append(index)
+                distances.append(distance)
+            return indices, distances
+        return self._nearest_numpy(numpy.asarray(lons, dtype=numpy.float64),
+                                   numpy.asarray(lats, dtype=numpy.float64))
+
+    def _arrays(self):
+        if self._numpy is None:
+            self._numpy = (numpy.asarray(self.cell_offsets, dtype=numpy.int64),
+                           numpy.asarray(self.nodes, dtype=numpy.int64),
+                           numpy.asarray(self.lons, dtype=numpy.float64),
+                           numpy.asarray(self.lats, dtype=numpy.float64))
+        return self._numpy
+
+    def _nearest_numpy(self, lons, lats):
+        offsets, nodes, node_lons, node_lats = self._arrays()
+        count = len(lons)
+        columns = numpy.clip(numpy.floor((lons - self.min_lon) / self.cell), 0, self.columns - 1).astype(numpy.int64)
+        rows = numpy.clip(numpy.floor((lats - self.min_lat) / self.cell), 0, self.rows - 1).astype(numpy.int64)
+        best = numpy.full(count, NONE, dtype=numpy.int64)
+        best_squared = numpy.full(count, numpy.inf)
+        # Each row of the 3 x 3 block is one contiguous run of the cell sorted arrays
+        left = numpy.maximum(columns - 1, 0)
+        right = numpy.minimum(columns + 1, self.columns - 1)
+        for d_row in (-1, 0, 1):
+            r = rows + d_row
+            inside = (r >= 0) & (r < self.rows)
+            r = numpy.clip(r, 0, self.rows - 1)
+            starts = numpy.where(inside, offsets[r * self.columns + left], 0)
+            ends = numpy.where(inside, offsets[r * self.columns + right + 1], 0)
+            slot = 0
+            active = numpy.flatnonzero(starts < ends)
+            while len(active):
+                positions = starts[active] + slot
+                d_lon = node_lons[positions] - lons[active]
+                d_lat = node_lats[positions] - lats[active]
+                squared = d_lon * d_lon + d_lat * d_lat
+                closer = squared < best_squared[active]
+                best_squared[active[closer]] = squared[closer]
+                best[active[closer]] = positions[closer]
+                slot += 1
+                active = active[starts[active] + slot < ends[active]]
+        # The block covers everything within one cell of the point, farther answers need the ring scan
+        indices = numpy.where(best == NONE, NONE, nodes[numpy.maximum(best, 0)])
+        distances = numpy.sqrt(best_squared)
+        for k in numpy.flatnonzero(distances > self.cell):
+            indices[k], distances[k] = self.nearest(float(lons[k]), float(lats[k]))
+        return indices, distances
+
+    def snap(self, lon, lat):
+        '''
+        :return: Snap of the point, raises ValueError for an empty index
+        '''
+        start = time.time()
+        index, distance = self.nearest(lon, lat)
+        if index == NONE:
+            raise ValueError("No routable vertex to snap to")
+        return self._snap(lon, lat, index, distance, time.time() - start)
+
+    def snap_many(self, points):
+        '''
+        :param points: list of (lon, lat)
+        :return: list of Snap, each carrying an equal share of the bulk call's time
+        '''
+        if not points:
+            return []
+        start = time.time()
+        lons = [point[0] for point in points]
+        lats = [point[1] for point in points]
+        indices, distances = self.nearest_many(lons, lats)
+        if len(points) and indices[0] == NONE:
+            raise ValueError("No routable vertex to snap to")
+        seconds = (time.time() - start) / len(points)
+        return [self._snap(lons[k], lats[k], int(indices[k]), float(distances[k]), seconds)
+                for k in xrange(len(points))]
+
+    def _snap(self, lon, lat, index, distance, seconds):
+        vertex = self.graph.coordinates_of(index)
+        return Snap(lon, lat, self.graph.ids[index], index, distance,
+                    heuristics.haversine_distance((lon, lat), vertex), seconds)
+
+
+def build_index(graph, cell_nodes=CELL_NODES, component=None):
+    '''
+    :param graph: CompactGraph with coordinates
+    :param cell_nodes: average vertices per grid cell
+    :param component: only index vertices with this component label, e.g. 0 for
+                      the largest, needs graph.components
+    :return: SpatialIndex of the vertices with at least one edge
+    '''
+    if graph.lons is None:
+        raise ValueError("The graph has no vertex coordinates to index")
+    offsets = graph.offsets
+    labels = graph.components.labels if component is not None else None
+    kept = [i for i in xrange(len(graph)) if offsets[i + 1] > offsets[i]
+            and (labels is None or labels[i] == component)]
+    if kept:
+        min_lon = min(graph.lons[i] for i in kept)
+        min_lat = min(graph.lats[i] for i in kept)
+        width = max(graph.lons[i] for i in kept) - min_lon
+        height = max(graph.lats[i] for i in kept) - min_lat
+    else:
+        min_lon = min_lat = width = height = 0.0
+    cells = max(1, len(kept) // cell_nodes)
+    cell = math.sqrt(width * height / cells) if width and height else max(width, height) / cells
+    cell = cell or 1.0
+    columns = int(width / cell) + 1
+    rows = int(height / cell) + 1
+    index = SpatialIndex(graph, min_lon, min_lat, cell, columns, rows, None, None, None, None)
+
+    keys = []
+    counts = array(compact_graph.INDEX_TYPE, [0]) * (columns * rows + 1)
+    for i in kept:
+        column, row = index._cell_of(graph.lons[i], graph.lats[i])
+        key = row * columns + column
+        keys.append(key)
+        counts[key + 1] += 1
+    for k in xrange(columns * rows):
+        counts[k + 1] += counts[k]
+    order = sorted(xrange(len(kept)), key=keys.__getitem__)
+    index.cell_offsets = counts
+    index.nodes = array(compact_graph.INDEX_TYPE, (kept[k] for k in order))
+    index.lons = array(compact_graph.COORDINATE_TYPE, (graph.lons[i] for i in index.nodes))
+    index.lats = array(compact_graph.COORDINATE_TYPE, (graph.lats[i] for i in index.nodes))
+    return index
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(2)
+    points = [tuple(float(value) for value in argument.split(',')) for argument in sys.argv[1:]]
+    start = time.time()
+    graph = snapshot.load_compact_graph()
+    spatial_index = build_index(graph)
+    print "Indexed %d vertices in %d x %d cells in %.2f seconds" % (
+        len(spatial_index), spatial_index.columns, spatial_index.rows, time.time() - start)
+    for snapped in spatial_index.snap_many(points):
+        print "%s,%s -> %s, %.1f m, %.3f ms" % (snapped.lon, snapped.lat, snapped.osm_id, snapped.meters,
+                                                snapped.seconds * 1000)
@@ -0,0 +1,585 @@
+'''
+Incremental edge weight updates.
+
+Traffic and closures change the length of roads that already exist, so
+instead of reloading ways a batch of (source_osm, target_osm, length)
+deltas is written into the graph's weight array in place, both ways of
+every road. A graph memory mapped from a snapshot gets a private copy of
+its weights on the first update; the snapshot file is left alone, the
+delta table being the durable record that a restarted process replays.
+
+Only what depends on the changed edges is repaired:
+  - the route cache keeps every route that does not use a changed edge
+    when weights only went up, and is cleared when one went down,
+  - landmark bounds stay valid when weights only go up, and the
+    landmarks are dropped when one went down: lowering every bound would
+    keep it admissible but not consistent, and A* never reopens a
+    settled node,
+  - a contraction hierarchy holds shortcuts summed from the old weights
+    and is dropped,
+  - a Rebuilder, when there is one, builds the dropped landmarks and
+    hierarchy again off the update thread and swaps them in,
+  - roads updated below the straight line between their ends are kept
+    in graph.below_straight_line, and while there are any the session
+    answers straight line A* queries with Dijkstra,
+  - connected components and the spatial index do not depend on weights.
+The graph version is bumped, which clears any other route cache over it.
+
+Deltas come from a table polled by id, or from the same table after a
+LISTEN/NOTIFY wake up. MemoryDeltas and LocalChannel stand in for the
+table and the notification channel in tests and benchmarks.
+
+Usage:
+    python updates.py setup
+    python updates.py bench [--nodes N] [--changes 1000,100000] [--mixed]
+'''
+from array import array
+import argparse
+import contextlib
+import json
+import random
+import select
+import sys
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import benchmark
+import compact_graph
+import contraction
+import database
+import heuristics
+import landmarks
+import session
+
+DELTA_TABLE = 'public.edge_updates'
+CHANNEL = 'edge_updates'
+BATCH_SIZE = 10000
+POLL_INTERVAL = 5.0
+CHANGES = (1000, 100000)
+STRAIGHT_LINE_TOLERANCE = 1e-9  # A straight road's length may round just below its straight line
+DELTA_QUERY = 'SELECT id, source_osm, target_osm, length FROM %s WHERE id > %%s ORDER BY id LIMIT %%s'
+# The trigger only rings the bell, the listener reads the rows from the table
+SETUP_SQL = '''
+CREATE TABLE IF NOT EXISTS %(table)s (
+    id bigserial PRIMARY KEY,
+    source_osm bigint NOT NULL,
+    target_osm bigint NOT NULL,
+    length double precision NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE OR REPLACE FUNCTION notify_%(channel)s() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('%(channel)s', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS %(channel)s_notify ON %(table)s;
+CREATE TRIGGER %(channel)s_notify AFTER INSERT ON %(table)s
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_%(channel)s();
+'''
+
+
+class UpdateReport(object):
+    '''
+    What one batch of deltas changed and repaired.
+    '''
+
+    def __init__(self):
+        self.applied = 0
+        self.increased = 0
+        self.decreased = 0
+        self.unchanged = 0
+        self.missing = []  # (source_osm, target_osm) of deltas for roads not in the graph
+        self.below_straight_line = 0  # Roads now shorter than the straight line, inadmissible for planar A*
+        self.cache_dropped = 0
+        self.landmarks_dropped = False
+        self.hierarchy_dropped = False
+        self.version = None
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {'applied': self.applied, 'increased': self.increased, 'decreased': self.decreased,
+                'unchanged': self.unchanged, 'missing': len(self.missing),
+                'below_straight_line': self.below_straight_line, 'cache_dropped': self.cache_dropped,
+                'landmarks_dropped': self.landmarks_dropped, 'hierarchy_dropped': self.hierarchy_dropped,
+                'version': self.version, 'seconds': self.seconds}
+
+
+def edge_positions(graph, source_osm, target_osm):
+    '''
+    :param graph: CompactGraph
+    :return: (position of source -> target, position of target -> source) in
+             targets/weights, raises KeyError when the road is not in the graph
+    '''
+    i = graph.index_of(source_osm)
+    j = graph.index_of(target_osm)
+    return _position(graph, i, j), _position(graph, j, i)
+
+
+def _position(graph, i, j):
+    targets = graph.targets
+    for position in xrange(graph.offsets[i], graph.offsets[i + 1]):
+        if targets[position] == j:
+            return position
+    raise KeyError((graph.ids[i], graph.ids[j]))
+
+
+def writable_weights(graph):
+    '''
+    Replaces weights memory mapped from a snapshot with a private copy.
+    :return: the graph's weight array, safe to assign to
+    '''
+    if not isinstance(graph.weights, array):
+        weights = array(compact_graph.WEIGHT_TYPE)
+        weights.fromstring(str(buffer(graph.weights)))
+        graph.weights = weights
+    return graph.weights
+
+
+def apply_updates(graph, updates, routing_session=None):
+    '''
+    Sets the length of existing roads, in both directions.
+    :param graph: CompactGraph
+    :param updates: iterable of (source_osm, target_osm, length), a later delta for a road wins
+    :param routing_session: RoutingSession over graph whose route cache, landmarks and hierarchy are repaired
+    :return: UpdateReport
+    '''
+    start = time.time()
+    report = UpdateReport()
+    weights = writable_weights(graph)
+    lons = graph.lons
+    lats = graph.lats
+    changed = []
+    decrease = 0.0
+    for source_osm, target_osm, length in updates:
+        try:
+            forward, backward = edge_positions(graph, source_osm, target_osm)
+        except KeyError:
+            report.missing.append((source_osm, target_osm))
+            continue
+        length = float(length)
+        old = weights[forward]
+        if length == old:
+            report.unchanged += 1
+            continue
+        weights[forward] = length
+        weights[backward] = length
+        if length < old:
+            report.decreased += 1
+            decrease += old - length
+        else:
+            report.increased += 1
+        if lons is not None:
+            i = graph.targets[backward]
+            j = graph.targets[forward]
+            road = (min(i, j), max(i, j))
+            straight_line = heuristics.planar_distance((lons[i], lats[i]), (lons[j], lats[j]))
+            if length < straight_line * (1 - STRAIGHT_LINE_TOLERANCE):
+                report.below_straight_line += 1
+                graph.below_straight_line.add(road)
+            else:
+                graph.below_straight_line.discard(road)
+        changed.append((float(source_osm), float(target_osm)))
+    report.applied = len(changed)
+    if changed:
+        previous_version = graph.version
+        graph.version += 1
+        if routing_session is not None:
+            _repair(routing_session, changed, decrease, previous_version, report)
+    report.version = graph.version
+    report.seconds = time.time() - start
+    return report
+
+
+def _repair(routing_session, changed, decrease, previous_version, report):
+    if routing_session.cache is not None:
+        report.cache_dropped = routing_session.cache.repair(changed, decrease > 0, previous_version)
+    if routing_session.landmarks is not None and decrease > 0:
+        routing_session.landmarks = None
+        report.landmarks_dropped = True
+    if routing_session.hierarchy is not None:
+        routing_session.hierarchy = None
+        report.hierarchy_dropped = True
+
+
+class ReadWriteLock(object):
+    '''
+    Shared by any number of searches, or held by one batch of updates
+    alone, so no search sees half a batch. A waiting batch keeps new
+    searches out.
+    '''
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self.condition:
+            while self.writer:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self.condition:
+            while self.writer:
+                self.condition.wait()
+            self.writer = True
+            while self.readers:
+                self.condition.wait()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class Rebuilder(object):
+    '''
+    Builds the landmarks and contraction hierarchy that updates dropped
+    again, on a daemon thread so updates and searches go on meanwhile.
+    The build runs on a copy of the weights and is swapped in under the
+    update lock, unless more deltas were applied since the copy, in which
+    case it starts over from the newer weights. Only what the session had
+    when the rebuilder was made is rebuilt.
+    '''
+
+    def __init__(self, routing_session, lock, seed=0):
+        '''
+        :param routing_session: RoutingSession whose landmarks and hierarchy are kept
+        :param lock: ReadWriteLock the updates are applied under, see Poller.poll
+        :param seed: seed of the landmark selection
+        '''
+        self.session = routing_session
+        self.lock = lock
+        self.seed = seed
+        self.landmark_count = len(routing_session.landmarks) if routing_session.landmarks is not None else 0
+        self.hierarchy = routing_session.hierarchy is not None
+        self.followers = []  # Objects whose reload() is called after a swap, e.g. service.SearchPool
+        self.rebuilding = False
+        self.rebuilds = 0
+        self.wake = threading.Event()
+        self.stopped = False
+
+    def missing(self):
+        '''
+        :return: list of 'landmarks' and 'hierarchy', what updates dropped and is not rebuilt yet
+        '''
+        missing = []
+        if self.landmark_count and self.session.landmarks is None:
+            missing.append('landmarks')
+        if self.hierarchy and self.session.hierarchy is None:
+            missing.append('hierarchy')
+        return missing
+
+    def apply_updates(self, updates):
+        '''
+        As a follower of a Poller: wakes the rebuild thread once a batch dropped something.
+        '''
+        if self.missing():
+            self.wake.set()
+
+    def start(self):
+        '''
+        :return: the daemon thread rebuilding whenever woken
+        '''
+        thread = threading.Thread(target=self._run, name='rebuild')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.stopped:
+                return
+            try:
+                self.rebuild()
+            except Exception as e:
+                print >> sys.stderr, "Rebuilding %s failed: %r" % (', '.join(self.missing()), e)
+
+    def rebuild(self):
+        '''
+        Builds what is missing until one build is swapped in.
+        :return: list of what was rebuilt
+        '''
+        self.rebuilding = True
+        try:
+            while not self.stopped:
+                missing = self.missing()
+                if not missing:
+                    return []
+                with self.lock.shared():
+                    graph = self.session.graph
+                    version = graph.version
+                    weights = array(compact_graph.WEIGHT_TYPE, graph.weights)
+                copy = compact_graph.CompactGraph(graph.ids, graph.offsets, graph.targets, weights,
+                                                  graph.lons, graph.lats)
+                graph_landmarks = None
+                hierarchy = None
+                if 'landmarks' in missing:
+                    graph_landmarks = landmarks.select_landmarks(copy, self.landmark_count, self.seed, verbose=False)
+                if 'hierarchy' in missing:
+                    hierarchy = contraction.build_hierarchy(copy, verbose=False)
+                with self.lock.exclusive():
+                    if self.stopped:
+                        return []
+                    if graph is not self.session.graph or graph.version != version:
+                        continue  # Deltas were applied since the copy
+                    if graph_landmarks is not None:
+                        graph_landmarks.graph = graph
+                        self.session.landmarks = graph_landmarks
+                    if hierarchy is not None:
+                        hierarchy.graph = graph
+                        self.session.hierarchy = hierarchy
+                    for follower in self.followers:
+                        follower.reload()
+                self.rebuilds += 1
+                return missing
+            return []
+        finally:
+            self.rebuilding = False
+
+
+class TableDeltas(object):
+    '''
+    Rows of the delta table: id, source_osm, target_osm, length.
+    '''
+
+    def __init__(self, table=DELTA_TABLE):
+        self.table = table
+
+    def fetch(self, after_id, limit=BATCH_SIZE):
+        '''
+        :return: list of (id, source_osm, target_osm, length) with id > after_id, by id
+        '''
+        with database.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(DELTA_QUERY % self.table, (after_id, limit))
+            return cur.fetchall()
+
+
+class MemoryDeltas(object):
+    '''
+    Stands in for the delta table.
+    '''
+
+    def __init__(self):
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def append(self, source_osm, target_osm, length):
+        '''
+        :return: id of the new row
+        '''
+        with self.lock:
+            row_id = len(self.rows) + 1
+            self.rows.append((row_id, source_osm, target_osm, length))
+            return row_id
+
+    def fetch(self, after_id, limit=BATCH_SIZE):
+        with self.lock:
+            return self.rows[after_id:after_id + limit]  # Ids are positions + 1
+
+
+class Poller(object):
+    '''
+    Applies the deltas added since the last one it saw.
+    '''
+
+    def __init__(self, routing_session, deltas, last_id=0, batch_size=BATCH_SIZE):
+        '''
+        :param routing_session: RoutingSession whose graph is updated
+        :param deltas: TableDeltas or MemoryDeltas
+        :param last_id: id of the last delta already applied, 0 replays them all
+        :param batch_size: deltas applied and repaired together
+        '''
+        self.session = routing_session
+        self.deltas = deltas
+        self.last_id = last_id
+        self.batch_size = batch_size
+        self.followers = []  # Objects whose apply_updates(deltas) gets every batch, e.g. service.SearchPool
+
+    def poll(self, lock=None):
+        '''
+        :param lock: optional ReadWriteLock, held exclusively while each batch is applied
+        :return: list of UpdateReport, one per batch applied
+        '''
+        reports = []
+        while True:
+            rows = self.deltas.fetch(self.last_id, self.batch_size)
+            if not rows:
+                return reports
+            updates = [(row[1], row[2], row[3]) for row in rows]
+            if lock is not None:
+                with lock.exclusive():
+                    reports.append(self._apply(updates))
+            else:
+                reports.append(self._apply(updates))
+            self.last_id = rows[-1][0]
+
+    def _apply(self, updates):
+        report = apply_updates(self.session.graph, updates, self.session)
+        for follower in self.followers:
+            follower.apply_updates(updates)
+        return report
+
+
+class Listener(object):
+    '''
+    LISTEN on a dedicated autocommit connection.
+    '''
+
+    def __init__(self, channel=CHANNEL):
+        self.conn = psycopg2.connect(database.DSN % database.read_password())
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self.conn.cursor().execute('LISTEN ' + channel)
+
+    def wait(self, timeout):
+        '''
+        :return: payloads of the notifications that arrived within timeout seconds
+        '''
+        if select.select([self.conn], [], [], timeout)[0]:
+            self.conn.poll()
+        payloads = [notify.payload for notify in self.conn.notifies]
+        del self.conn.notifies[:]
+        return payloads
+
+    def close(self):
+        self.conn.close()
+
+
+class LocalChannel(object):
+    '''
+    Stands in for a LISTEN connection within one process.
+    '''
+
+    def __init__(self):
+        self.payloads = []
+        self.condition = threading.Condition()
+
+    def notify(self, payload=''):
+        with self.condition:
+            self.payloads.append(payload)
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        with self.condition:
+            if not self.payloads:
+                self.condition.wait(timeout)
+            payloads = self.payloads
+            self.payloads = []
+            return payloads
+
+    def close(self):
+        self.notify()
+
+
+def watch(poller, channel=None, interval=POLL_INTERVAL, stop=None, lock=None, verbose=True):
+    '''
+    Polls for deltas until stop is set, right after a notification on
+    channel or every interval seconds, so a lost notification only
+    delays the deltas until the next poll.
+    :param poller: Poller
+    :param channel: Listener or LocalChannel, None to only poll
+    :param stop: threading.Event ending the loop
+    :param lock: passed to Poller.poll
+    '''
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        for report in poller.poll(lock):
+            if verbose:
+                print >> sys.stderr, "Applied %d edge updates up to delta %d in %.3f seconds, %d unknown roads" % (
+                    report.applied, poller.last_id, report.seconds, len(report.missing))
+        if channel is not None:
+            channel.wait(interval)
+        else:
+            stop.wait(interval)
+
+
+def start_watcher(poller, channel=None, interval=POLL_INTERVAL, lock=None):
+    '''
+    Runs watch on a daemon thread.
+    :return: (thread, stop event)
+    '''
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(poller, channel, interval, stop, lock), name='edge-updates')
+    thread.daemon = True
+    thread.start()
+    return thread, stop
+
+
+def random_updates(graph, count, seed=0, factor=(0.5, 2.0)):
+    '''
+    :param count: number of distinct roads changed
+    :param factor: range the current lengths are scaled by
+    :return: list of (source_osm, target_osm, length)
+    '''
+    rng = random.Random(seed)
+    roads = [(i, graph.targets[position]) for i in xrange(len(graph))
+             for position in xrange(graph.offsets[i], graph.offsets[i + 1]) if graph.targets[position] > i]
+    chosen = rng.sample(roads, min(count, len(roads)))
+    weights = graph.weights
+    updates = []
+    for i, j in chosen:
+        position = _position(graph, i, j)
+        updates.append((graph.ids[i], graph.ids[j], weights[position] * rng.uniform(*factor)))
+    return updates
+
+
+def time_updates(nodes=250000, changes=CHANGES, seed=0, factor=(1.0, 2.0)):
+    '''
+    Times apply_updates on a grid graph for batches of each size, with a
+    route cache of short trips and landmarks attached so their repair is
+    included. The default factor only slows roads down, like congestion,
+    which keeps the cache routes that avoid the changed roads.
+    :return: dict of batch size -> UpdateReport.as_dict plus microseconds per road
+    '''
+    graph = benchmark.grid_graph(nodes, seed)
+    routing_session = session.RoutingSession(graph)
+    routing_session.landmarks = landmarks.select_landmarks(graph, 4, seed, verbose=False)
+    report = {'nodes': len(graph), 'roads': graph.edge_count() // 2}
+    for count in changes:
+        routing_session.enable_cache()
+        for source, destination in benchmark.local_pairs(graph, 1000, benchmark.LOCAL_HOPS, seed):
+            routing_session.dijkstra(source, [destination])
+        deltas = random_updates(graph, count, seed, factor)
+        result = apply_updates(graph, deltas, routing_session).as_dict()
+        result['us_per_road'] = result['seconds'] / max(len(deltas), 1) * 1e6
+        report[count] = result
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Edge weight updates.')
+    parser.add_argument('command', choices=('setup', 'bench'))
+    parser.add_argument('--nodes', type=int, default=250000)
+    parser.add_argument('--changes', default=','.join(str(count) for count in CHANGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mixed', action='store_true',
+                        help='also shorten roads, which clears the route cache and drops the landmarks')
+    arguments = parser.parse_args()
+    if arguments.command == 'setup':
+        with database.connection() as conn:
+            conn.cursor().execute(SETUP_SQL % {'table': DELTA_TABLE, 'channel': CHANNEL})
+        print "Created %s, inserts notify %s" % (DELTA_TABLE, CHANNEL)
+    else:
+        print json.dumps(time_updates(arguments.nodes, [int(count) for count in arguments.changes.split(',')],
+                                   arguments.seed, (0.5, 2.0) if arguments.mixed else (1.0, 2.0)),
+                         indent=2, sort_keys=True)
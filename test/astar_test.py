@@ -1,5 +1,8 @@
 import unittest
 import src.astar as astar
+import src.compact_graph as compact_graph
+import src.session as session
+from test.session_test import VERTICES, LONS, LATS, EDGES
 
 
 class TestGraphAStar(unittest.TestCase):
@@ -35,6 +38,21 @@ class TestGraphAStar(unittest.TestCase):
     def test_get_distance(self):
         self.assertEquals(astar.distance_to_destination(60642422, 83997901), 0.0658882536679388)
 
+    def test_distance_from_session_graph(self):
+        session.set_session(session.RoutingSession(compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)))
+        try:
+            self.assertAlmostEquals(astar.distance_to_destination(0, 15), (0.003 ** 2 * 2) ** 0.5)
+        finally:
+            session.set_session(None)
+
+    def test_heuristic(self):
+        coordinates = astar.init_coordinates()
+        self.assertEquals(coordinates.__len__(), 240188)
+        heuristic = astar.make_heuristic(coordinates, 83997901)
+        self.assertAlmostEquals(heuristic(60642422), 0.0658882536679388)
+        # One degree of latitude is roughly 111.2km
+        self.assertAlmostEquals(astar.haversine_distance((-104.99, 39.0), (-104.99, 40.0)), 111195, delta=1)
+
     def test_astar(self):
         self.assertEquals(astar.find_shortest_route(60642422, [60642896]), [[60642896, 60642422.0]])
         self.assertEquals(astar.find_shortest_route(60642422, [60642900]), [[60642900, 60642896.0, 60642422.0]])
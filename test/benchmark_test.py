@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import src.benchmark as benchmark
+import src.search as search
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_grid_graph(self):
+        graph = benchmark.grid_graph(100)
+        self.assertEquals(len(graph), 100)
+        self.assertEquals(graph.edge_count(), 2 * 2 * 10 * 9)
+
+    def test_geometric_graph_is_seeded(self):
+        first = benchmark.geometric_graph(500, seed=3)
+        second = benchmark.geometric_graph(500, seed=3)
+        self.assertEquals(len(first), 500)
+        self.assertEquals(list(first.targets), list(second.targets))
+        self.assertEquals(list(first.weights), list(second.weights))
+
+    def test_sqlite_fixture_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            graph = benchmark.geometric_graph(300)
+            path = benchmark.write_sqlite_fixture(graph, os.path.join(directory, 'fixture.sqlite'))
+            loaded = benchmark.load_graph(benchmark.SQLITE, path=path)
+            self.assertEquals(list(loaded.ids), list(graph.ids))
+            self.assertEquals(list(loaded.offsets), list(graph.offsets))
+            costs, parents, nodes_assessed = search.dijkstra(graph, 0, [])
+            loaded_costs, parents, nodes_assessed = search.dijkstra(loaded, 0, [])
+            for v in xrange(len(graph)):
+                self.assertAlmostEquals(loaded_costs[v], costs[v])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEquals(benchmark.percentile(values, 50), 50)
+        self.assertEquals(benchmark.percentile(values, 99), 99)
+        self.assertEquals(benchmark.percentile([7], 95), 7)
+
+    def test_report(self):
+        report = benchmark.run_benchmark(benchmark.GRID, 400, queries=5, preprocess=True, verbose=False)
+        report = json.loads(json.dumps(report))
+        self.assertEquals(report['nodes'], 400)
+        self.assertEquals(sorted(report['methods'].keys()),
+                          ['astar', 'astar-alt', 'astar-alt-bidirectional', 'astar-bidirectional',
+                           'contraction', 'dijkstra', 'dijkstra-bidirectional'])
+        for summary in report['methods'].values():
+            self.assertTrue(summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms'])
+        self.assertTrue(report['peak_rss_mb'] > 0)
+        self.assertEquals(report['local']['dijkstra-workspace']['nodes_assessed_total'],
+                          report['local']['dijkstra-allocated']['nodes_assessed_total'])
+        self.assertEquals(report['snap']['points'], benchmark.SNAP_POINTS)
+        self.assertTrue(report['snap']['meters_p50'] <= report['snap']['meters_max'])
+        changes = benchmark.compare(report, report)
+        self.assertEquals(changes['dijkstra']['p50_ms'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
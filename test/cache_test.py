@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from shapely.geometry import LineString
+import src.cache as cache
+import src.compact_graph as compact_graph
+import src.session as session
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+class TestRouteCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reverse_pair_hits(self):
+        route_cache = cache.RouteCache(10)
+        route_cache.put(3, 0, 0.003, [3, 2, 1, 0])
+        route = route_cache.get(0, 3)
+        self.assertEquals(route.cost, 0.003)
+        self.assertEquals(list(route.path), [0, 1, 2, 3])
+        self.assertEquals(list(route_cache.get(3, 0).path), [3, 2, 1, 0])
+        self.assertIsNone(route_cache.get(0, 4))
+        self.assertEquals((route_cache.hits, route_cache.misses), (2, 1))
+
+    def test_geometry_is_reversed(self):
+        route_cache = cache.RouteCache(10)
+        line = LineString([(0, 0), (1, 0), (1, 1)])
+        route_cache.put(0, 2, 2.0, [0, 1, 2], line.wkb_hex)
+        reverse = route_cache.get(2, 0)
+        self.assertEquals(reverse.geometry_hex, LineString([(1, 1), (1, 0), (0, 0)]).wkb_hex)
+        route_cache.put(2, 0, 2.0, [2, 1, 0])
+        self.assertEquals(route_cache.get(0, 2).geometry_hex, line.wkb_hex)
+
+    def test_least_recently_used_is_evicted(self):
+        route_cache = cache.RouteCache(2)
+        route_cache.put(0, 1, 1.0, [0, 1])
+        route_cache.put(0, 2, 2.0, [0, 1, 2])
+        route_cache.get(1, 0)
+        route_cache.put(0, 3, 3.0, [0, 1, 2, 3])
+        self.assertIsNone(route_cache.get(0, 2))
+        self.assertIsNotNone(route_cache.get(0, 1))
+        stats = route_cache.stats()
+        self.assertEquals((stats['size'], stats['evictions']), (2, 1))
+        self.assertAlmostEquals(stats['hit_rate'], 2 / 3.0)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, 'routes')
+        route_cache = cache.RouteCache(10, self.graph)
+        route_cache.put(0, 15, 0.006, [0, 1, 2, 3, 7, 11, 15])
+        route_cache.save(path)
+        loaded = cache.load_cache(path, self.graph)
+        self.assertEquals(list(loaded.get(15, 0).path), [15, 11, 7, 3, 2, 1, 0])
+
+    def test_other_graph_starts_empty(self):
+        path = os.path.join(self.directory, 'routes')
+        route_cache = cache.RouteCache(10, self.graph)
+        route_cache.put(0, 15, 0.006, [0, 15])
+        route_cache.save(path)
+        other = compact_graph.build_compact_graph(VERTICES, EDGES[:-1] + [(0, 15, 0.02)], LONS, LATS)
+        self.assertEquals(len(cache.load_cache(path, other)), 0)
+        self.assertEquals(len(cache.load_cache(os.path.join(self.directory, 'missing'), self.graph)), 0)
+
+    def test_weight_change_clears(self):
+        route_cache = cache.RouteCache(10, self.graph)
+        route_cache.put(0, 15, 0.006, [0, 15])
+        self.graph.version += 1
+        self.assertIsNone(route_cache.get(0, 15))
+        self.assertEquals(route_cache.stats()['invalidations'], 1)
+
+
+class TestSessionCache(unittest.TestCase):
+    def setUp(self):
+        self.routing = session.RoutingSession(compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS))
+
+    def test_cached_results_match(self):
+        expected = self.routing.dijkstra(0, [5, 15, 3])
+        self.routing.enable_cache(10)
+        self.routing.dijkstra(15, [0])
+        result = self.routing.dijkstra(0, [5, 15, 3])
+        self.assertEquals(result.cache_hits, 1)
+        self.assertEquals(result.destinations, [5, 15, 3])
+        for destination in (5, 15, 3):
+            self.assertAlmostEquals(result.costs[destination], expected.costs[destination])
+            self.assertEquals(result.paths[destination][0], 0)
+            self.assertEquals(result.paths[destination][-1], destination)
+        result = self.routing.astar(3, [0, 15])
+        self.assertEquals(result.cache_hits, 1)
+        self.assertEquals(result.paths[0], expected.paths[3][::-1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+import src.checkpoint as checkpoint
+import src.dijkstras as dijkstras
+import src.results as results
+
+
+class FlushCounter(object):
+    '''
+    Stands in for a ResultWriter: only its flush count is read.
+    '''
+
+    def __init__(self):
+        self.flushes = 0
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pairs.csv.checkpoint')
+        self.pairs = [(float(index), float(index + 100)) for index in xrange(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_pairs_streams(self):
+        path = os.path.join(self.directory, 'pairs.csv')
+        with open(path, 'wb') as f:
+            f.write('1,2\n3,4\n')
+        pairs = checkpoint.read_pairs(path)
+        self.assertEquals(next(pairs), (1.0, 2.0))
+        self.assertEquals(list(pairs), [(3.0, 4.0)])
+
+    def test_resume_skips_answered(self):
+        progress = checkpoint.Checkpoint(self.path)
+        progress.record(0, checkpoint.DONE)
+        progress.record(1, checkpoint.MISSING)
+        progress.record(3, checkpoint.TIMED_OUT)
+        resumed = checkpoint.Checkpoint(self.path)
+        self.assertEquals([index for index, source, destination in resumed.pending(self.pairs)][:3], [2, 4, 5])
+        retried = checkpoint.Checkpoint(self.path, retry_failed=True)
+        self.assertEquals([index for index, source, destination in retried.pending(self.pairs)][:3], [1, 2, 3])
+
+    def test_done_waits_for_flush(self):
+        writer = FlushCounter()
+        progress = checkpoint.Checkpoint(self.path, writer)
+        progress.record(0, checkpoint.DONE)
+        progress.record(1, checkpoint.DONE)
+        self.assertEquals(len(checkpoint.Checkpoint(self.path)), 0)
+        writer.flushes += 1
+        progress.record(2, checkpoint.DONE)
+        self.assertEquals(len(checkpoint.Checkpoint(self.path)), 3)
+
+    def test_cut_line_is_ignored(self):
+        with open(self.path, 'wb') as f:
+            f.write('0 d\n1 d\n2')
+        self.assertEquals(len(checkpoint.Checkpoint(self.path)), 2)
+
+    def test_close_writes_ranges(self):
+        with checkpoint.Checkpoint(self.path) as progress:
+            for index in (0, 1, 2, 5, 6):
+                progress.record(index, checkpoint.DONE)
+            progress.record(3, checkpoint.FAILED)
+        with open(self.path, 'rb') as f:
+            self.assertEquals(f.read(), '0-2 d\n3 f\n5-6 d\n')
+        reopened = checkpoint.Checkpoint(self.path)
+        self.assertEquals(reopened.counts()[checkpoint.DONE], 5)
+        self.assertEquals([index for index, source, destination in reopened.pending(self.pairs)], [4, 7, 8, 9])
+
+    def test_default_path_per_table(self):
+        self.assertNotEquals(checkpoint.checkpoint_path('pairs.csv', results.DIJKSTRAS),
+                             checkpoint.checkpoint_path('pairs.csv', results.ASTAR))
+
+    def test_reopen_resumes_run_id(self):
+        with checkpoint.open_checkpoint(self.path, results.DIJKSTRAS) as progress:
+            first = results.run_id()
+            self.assertEquals(progress.run_id, first)
+            progress.record(0, checkpoint.MISSING)
+        results.new_run()
+        with checkpoint.open_checkpoint(self.path, results.DIJKSTRAS) as progress:
+            self.assertEquals(results.run_id(), first)
+            self.assertEquals(len(progress), 1)
+        with open(self.path, 'rb') as f:
+            self.assertEquals(f.read(), 'run %s\n0 m\n' % first)
+        results.new_run()
+
+    def test_pairs_from_results_count_either_way(self):
+        progress = checkpoint.Checkpoint(self.path)
+        progress.pairs.add((100.0, 0.0))
+        self.assertTrue(progress.answered(0, 0.0, 100.0))
+        self.assertFalse(progress.answered(1, 1.0, 101.0))
+
+
+class TestEngineResume(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.find_shortest_route = dijkstras.find_shortest_route
+
+    def tearDown(self):
+        dijkstras.find_shortest_route = self.find_shortest_route
+        shutil.rmtree(self.directory)
+
+    def test_rerun_routes_only_pending_pairs(self):
+        routed = []
+
+        def find_shortest_route(source, destinations):
+            routed.append((source, destinations[0]))
+            if source == 3:
+                raise KeyError(source)
+        dijkstras.find_shortest_route = find_shortest_route
+        path = os.path.join(self.directory, 'checkpoint')
+        pairs = [(1.0, 2.0), (3.0, 1.0), (2.0, 5.0)]
+        with checkpoint.Checkpoint(path) as progress:
+            dijkstras.run_experiment(pairs[:2], progress)
+        self.assertEquals(routed, [(2.0, 1.0), (3.0, 1.0)])
+        with checkpoint.Checkpoint(path) as progress:
+            self.assertEquals(dijkstras.run_experiment(pairs, progress), 1)
+            self.assertEquals(progress.counts()[checkpoint.MISSING], 1)
+        self.assertEquals(routed[-1], (5.0, 2.0))
+
+if __name__ == '__main__':
+    unittest.main()
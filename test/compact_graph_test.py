@@ -0,0 +1,45 @@
+import unittest
+import src.compact_graph as compact_graph
+import src.search as search
+
+VERTICES = [1, 2, 3, 4, 5]
+EDGES = [(1, 2, 1.0), (2, 3, 2.0), (1, 3, 4.0), (3, 4, 1.0), (2, 3, 1.5)]
+
+
+class TestCompactGraph(unittest.TestCase):
+    def test_build(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES)
+        self.assertEquals(graph.__len__(), 5)
+        # Stored both ways, and the repeated 2-3 row overwrites the first one
+        self.assertEquals(graph.edge_count(), 8)
+        self.assertEquals(sorted(graph.neighbors(graph.index_of(2))), [(0, 1.0), (2, 1.5)])
+        self.assertEquals(list(graph.neighbors(graph.index_of(5))), [])
+        self.assertEquals(graph.ids[graph.index_of(4)], 4.0)
+
+    def test_from_dict_graph(self):
+        graph = {1.0: {2.0: 1.0, 3.0: 4.0}, 2.0: {1.0: 1.0, 3.0: 1.5}, 3.0: {1.0: 4.0, 2.0: 1.5}}
+        compact = compact_graph.from_dict_graph(graph)
+        for osm_id in graph:
+            neighbors = dict((compact.ids[t], w) for t, w in compact.neighbors(compact.index_of(osm_id)))
+            self.assertEquals(neighbors, graph[osm_id])
+        report = compact_graph.compare_memory(graph, compact)
+        self.assertTrue(report['dict'] > 0 and report['total'] > 0)
+
+    def test_dijkstra(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES)
+        source = graph.index_of(1)
+        targets = [graph.index_of(4)]
+        costs, parents, nodes_assessed = search.dijkstra(graph, source, targets)
+        self.assertEquals(costs[targets[0]], 3.5)
+        self.assertEquals(search.path_to(graph, parents, source, targets[0]), [1.0, 2.0, 3.0, 4.0])
+
+    def test_unreachable(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES)
+        source = graph.index_of(1)
+        target = graph.index_of(5)
+        costs, parents, nodes_assessed = search.dijkstra(graph, source, [target])
+        self.assertEquals(costs[target], float("inf"))
+        self.assertEquals(nodes_assessed, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+import src.components as components
+import src.compact_graph as compact_graph
+import src.geometry as geometry
+import src.runner as runner
+import src.search as search
+import src.session as session
+from test.runner_test import grid_store
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+# The 4x4 grid plus a three node road and an isolated vertex
+ISLAND_VERTICES = VERTICES + [16, 17, 18, 19]
+ISLAND_LONS = LONS + [-104.90, -104.899, -104.898, -104.80]
+ISLAND_LATS = LATS + [39.70, 39.70, 39.70, 39.80]
+ISLAND_EDGES = EDGES + [(16, 17, 0.001), (17, 18, 0.001)]
+
+
+def island_graph():
+    return compact_graph.build_compact_graph(ISLAND_VERTICES, ISLAND_EDGES, ISLAND_LONS, ISLAND_LATS)
+
+
+class TestComponents(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.graph = island_graph()
+        self.components = components.label_components(self.graph)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_labels_largest_first(self):
+        self.assertEquals(list(self.components.sizes), [16, 3, 1])
+        self.assertEquals(self.components.label_of(15), 0)
+        self.assertEquals(self.components.label_of(16), 1)
+        self.assertEquals(self.components.label_of(19), 2)
+        self.assertTrue(self.components.connected_ids(16, 18))
+        self.assertFalse(self.components.connected_ids(0, 18))
+        self.assertRaises(KeyError, self.components.connected_ids, 0, 99)
+        stats = self.components.stats()
+        self.assertEquals((stats['components'], stats['largest'], stats['isolated']), (3, 16, 1))
+
+    def test_prune_keeps_distances(self):
+        pruned = components.prune_to_largest(self.graph, self.components)
+        self.assertEquals(len(pruned), 16)
+        self.assertFalse(16 in pruned)
+        self.assertEquals(len(pruned.components), 1)
+        for target in (5, 15):
+            costs, parents, assessed = search.dijkstra(pruned, pruned.index_of(0), [pruned.index_of(target)])
+            expected, parents, assessed = search.dijkstra(self.graph, 0, [target])
+            self.assertAlmostEquals(costs[pruned.index_of(target)], expected[target])
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, 'graph.components')
+        components.write_components(self.components, path)
+        loaded = components.load_components(self.graph, path)
+        self.assertEquals(list(loaded.labels), list(self.components.labels))
+        self.assertRaises(Exception, components.load_components,
+                          compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS), path)
+
+    def test_pair_stats(self):
+        report = components.pair_stats(self.components, [(0, 15), (16, 18), (0, 18), (0, 99)])
+        self.assertEquals((report['largest'], report['smaller'], report['across'], report['unknown']), (1, 1, 1, 1))
+        self.assertEquals(report['by_component'], {0: 1, 1: 1})
+
+
+class TestUnreachable(unittest.TestCase):
+    def setUp(self):
+        graph = island_graph()
+        components.get_components(graph)
+        self.routing = session.RoutingSession(graph)
+
+    def tearDown(self):
+        session.set_session(None)
+        geometry.set_store(None)
+
+    def test_session_skips_search(self):
+        for result in (self.routing.dijkstra(0, [18]), self.routing.astar(0, [18]),
+                       self.routing.dijkstra(0, [18], search.BIDIRECTIONAL)):
+            self.assertEquals(result.costs[18], search.INFINITY)
+            self.assertIsNone(result.paths[18])
+            self.assertEquals(result.nodes_assessed, 0)
+            self.assertEquals(result.unreachable, 1)
+        result = self.routing.dijkstra(16, [18, 0])
+        self.assertAlmostEquals(result.costs[18], 0.002)
+        self.assertEquals(result.unreachable, 1)
+
+    def test_runner_answers_unreachable(self):
+        session.set_session(self.routing)
+        geometry.set_store(grid_store())
+        outcomes = list(runner.run_parallel([(0, 15), (0, 18), (16, 99)], runner.DIJKSTRA, workers=1, timeout=60))
+        statuses = dict((outcome[0], outcome[3]) for outcome in outcomes)
+        self.assertEquals(statuses, {0: runner.DONE, 1: runner.UNREACHABLE, 2: runner.MISSING})
+
+if __name__ == '__main__':
+    unittest.main()
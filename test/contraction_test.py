@@ -0,0 +1,87 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import src.compact_graph as compact_graph
+import src.contraction as contraction
+import src.search as search
+import src.session as session
+import src.snapshot as snapshot
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+def random_graph(count, seed):
+    rng = random.Random(seed)
+    lons = [rng.random() for v in xrange(count)]
+    lats = [rng.random() for v in xrange(count)]
+    edges = []
+    for v in xrange(count):
+        for u in rng.sample(xrange(count), 2):
+            straight = math.hypot(lons[u] - lons[v], lats[u] - lats[v])
+            edges.append((v, u, straight * (1 + rng.random())))
+    return compact_graph.build_compact_graph(range(count), edges, lons, lats)
+
+
+class TestContractionHierarchy(unittest.TestCase):
+    def assertMatchesDijkstra(self, graph, hierarchy, source, target):
+        costs, parents, nodes_assessed = search.dijkstra(graph, source, [target])
+        cost, path, assessed = hierarchy.query(source, target)
+        if costs[target] == search.INFINITY:
+            self.assertEquals(cost, search.INFINITY)
+            self.assertEquals(path, None)
+            return
+        self.assertAlmostEquals(cost, costs[target])
+        self.assertEquals(path[0], source)
+        self.assertEquals(path[-1], target)
+        length = sum(dict(graph.neighbors(path[i]))[path[i + 1]] for i in xrange(len(path) - 1))
+        self.assertAlmostEquals(length, costs[target])
+
+    def test_grid(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+        hierarchy = contraction.build_hierarchy(graph, verbose=False)
+        self.assertEquals(sorted(hierarchy.rank), range(len(graph)))
+        for source in xrange(len(graph)):
+            for target in xrange(len(graph)):
+                self.assertMatchesDijkstra(graph, hierarchy, source, target)
+
+    def test_random_graph(self):
+        graph = random_graph(300, 11)
+        hierarchy = contraction.build_hierarchy(graph, verbose=False)
+        rng = random.Random(3)
+        for query in xrange(100):
+            self.assertMatchesDijkstra(graph, hierarchy, rng.randrange(300), rng.randrange(300))
+
+    def test_upward_edges_only(self):
+        graph = random_graph(100, 5)
+        hierarchy = contraction.build_hierarchy(graph, verbose=False)
+        for v in xrange(len(graph)):
+            for position in xrange(hierarchy.up_offsets[v], hierarchy.up_offsets[v + 1]):
+                self.assertTrue(hierarchy.rank[hierarchy.up_targets[position]] > hierarchy.rank[v])
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            graph = random_graph(100, 5)
+            graph.fingerprint = (1, 2, 3, 4)
+            hierarchy = contraction.build_hierarchy(graph, verbose=False)
+            path = contraction.write_hierarchy(hierarchy, os.path.join(directory, 'test.ch'))
+            loaded = contraction.load_hierarchy(graph, path)
+            self.assertEquals(list(loaded.up_targets), list(hierarchy.up_targets))
+            self.assertEquals(loaded.query(0, 99)[0], hierarchy.query(0, 99)[0])
+            graph.fingerprint = (1, 2, 3, 5)
+            self.assertRaises(snapshot.SnapshotError, contraction.load_hierarchy, graph, path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_session_mode(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+        routing = session.RoutingSession(graph, contraction.build_hierarchy(graph, verbose=False))
+        result = routing.dijkstra(0, [15, 3], search.CONTRACTION)
+        self.assertAlmostEquals(result.costs[15], 0.006)
+        self.assertEquals(result.paths[3], [0.0, 1.0, 2.0, 3.0])
+        self.assertRaises(ValueError, session.RoutingSession(graph).dijkstra, 0, [15], search.CONTRACTION)
+
+if __name__ == '__main__':
+    unittest.main()
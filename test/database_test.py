@@ -0,0 +1,27 @@
+import unittest
+import src.database as database
+
+
+class TestDatabase(unittest.TestCase):
+    def test_shared_connection_is_reused(self):
+        self.assertIs(database.connect_to_database(), database.connect_to_database())
+
+    def test_connection_context(self):
+        with database.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            self.assertEquals(cur.fetchone()[0], 1)
+        self.assertFalse(conn.closed)
+
+    def test_prepared_statement(self):
+        with database.connection() as conn:
+            cur = conn.cursor()
+            database.execute_prepared(cur, 'edge_geometry', (60642422, 60642896))
+            self.assertIsNotNone(cur.fetchone())
+            # Second use runs the already prepared statement
+            database.execute_prepared(cur, 'edge_geometry', (60642896, 60642422))
+            self.assertIsNotNone(cur.fetchone())
+            self.assertIn('edge_geometry', conn.prepared)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from array import array
+import os
+import shutil
+import tempfile
+import unittest
+import shapely.wkb
+from shapely.geometry import LineString
+from shapely.ops import linemerge
+import src.database as database
+import src.geometry as geometry
+import src.ingest as ingest
+
+# Ways 1 -> 2 -> 3 stored in mixed directions, 2 -> 3 with a bend
+SOURCES = [1.0, 3.0]
+TARGETS = [2.0, 2.0]
+OFFSETS = [0, 2, 5]
+LONS = [0.0, 1.0, 2.0, 1.5, 1.0]
+LATS = [0.0, 0.0, 0.0, 0.5, 0.0]
+
+
+class TestEdgeGeometryStore(unittest.TestCase):
+    def setUp(self):
+        self.store = geometry.EdgeGeometryStore(array('d', SOURCES), array('d', TARGETS), array('i', OFFSETS),
+                                                array('d', LONS), array('d', LATS))
+
+    def test_orientation(self):
+        self.assertEquals(list(self.store.line(1, 2).coords), [(0.0, 0.0), (1.0, 0.0)])
+        self.assertEquals(list(self.store.line(2, 1).coords), [(1.0, 0.0), (0.0, 0.0)])
+        self.assertEquals(list(self.store.line(2, 3).coords), [(1.0, 0.0), (1.5, 0.5), (2.0, 0.0)])
+        self.assertIsNone(self.store.line(1, 3))
+
+    def test_route_lines_merge(self):
+        merged = linemerge(self.store.route_lines([1.0, 2.0, 3.0]))
+        self.assertEquals(merged.geom_type, 'LineString')
+        self.assertEquals(merged.coords[0], (0.0, 0.0))
+        self.assertEquals(merged.coords[-1], (2.0, 0.0))
+
+    def test_route_edges(self):
+        self.assertEquals(geometry.route_edges([1.0, 2.0, 3.0]), [(1, 2), (2, 3)])
+        self.assertEquals(geometry.route_edges([1.0]), [])
+
+    def test_file_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = geometry.write_geometry_store(self.store, os.path.join(directory, 'test.geometry'), (1, 2, 3, 4))
+            loaded = geometry.load_geometry_file(path)
+            self.assertEquals(tuple(loaded.fingerprint), (1, 2, 3, 4))
+            self.assertEquals(len(loaded), 2)
+            self.assertEquals(list(loaded.line(3, 2).coords), list(self.store.line(3, 2).coords))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_keeps_shortest_way_in_either_direction(self):
+        rows = [(1, 2, LineString([(0, 0), (0.5, 0.5), (1, 0)]).wkb),  # Longest first, as GEOMETRY_QUERY orders them
+                (2, 1, LineString([(1, 0), (0, 0)]).wkb),
+                (2, 3, LineString([(1, 0), (2, 0)]).wkb)]
+        iter_rows = ingest.iter_rows
+        ingest.iter_rows = lambda conn, query: iter(rows)
+        try:
+            store = geometry.load_geometry_store(None, verbose=False)
+        finally:
+            ingest.iter_rows = iter_rows
+        self.assertEquals(len(store), 2)
+        self.assertEquals(list(store.line(1, 2).coords), [(0.0, 0.0), (1.0, 0.0)])
+        self.assertEquals(list(store.line(2, 1).coords), [(1.0, 0.0), (0.0, 0.0)])
+
+    def test_batched_query_matches_per_edge(self):
+        route = [60642422, 60642896]
+        with database.connection() as conn:
+            cur = conn.cursor()
+            lines = geometry.fetch_route_lines(cur, route)
+            self.assertEquals(len(lines), 1)
+            database.execute_prepared(cur, 'edge_geometry', tuple(route))
+            single = shapely.wkb.loads(cur.fetchone()[0], hex=True)
+            self.assertAlmostEquals(lines[0].length, single.length)
+
+if __name__ == '__main__':
+    unittest.main()
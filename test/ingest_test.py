@@ -0,0 +1,33 @@
+import unittest
+import src.ingest as ingest
+
+
+class TestIngest(unittest.TestCase):
+    def test_copy_sink_splits_rows_across_chunks(self):
+        rows = []
+        sink = ingest.CopySink(rows.append)
+        sink.write('60642422\t-104.9\t39.7\n6064')
+        sink.write('2896\t-104.8\t39.6\n1900216568\t-104.7')
+        sink.write('\t39.5\n')
+        sink.close()
+        self.assertEquals(sink.rows, 3)
+        self.assertEquals(rows, [['60642422', '-104.9', '39.7'],
+                                 ['60642896', '-104.8', '39.6'],
+                                 ['1900216568', '-104.7', '39.5']])
+
+    def test_copy_sink_without_trailing_newline(self):
+        rows = []
+        sink = ingest.CopySink(rows.append)
+        sink.write('1\t2\t0.5')
+        sink.close()
+        self.assertEquals(rows, [['1', '2', '0.5']])
+
+    def test_load_compact_graph(self):
+        with ingest.database.connection() as conn:
+            graph = ingest.load_compact_graph(conn)
+        self.assertEquals(graph.__len__(), 240188)
+        neighbors = dict(graph.neighbors(graph.index_of(60642422)))
+        self.assertEquals(neighbors[graph.index_of(60642896)], 0.000192337879785143)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import src.benchmark as benchmark
+import src.compact_graph as compact_graph
+import src.heuristics as heuristics
+import src.kernels as kernels
+import src.metrics as metrics
+import src.search as search
+import src.session as session
+import src.snapshot as snapshot
+import src.updates as updates
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+class TestHeuristicTable(unittest.TestCase):
+    def setUp(self):
+        self.numpy = kernels.numpy
+        self.graph = benchmark.geometric_graph(500, seed=2)
+
+    def tearDown(self):
+        kernels.numpy = self.numpy
+
+    def test_matches_memoized_heuristic(self):
+        for metric in (heuristics.PLANAR, heuristics.HAVERSINE):
+            expected = heuristics.make_compact_heuristic(self.graph, 7, metric)
+            for module_numpy in (self.numpy, None):
+                kernels.numpy = module_numpy
+                table = kernels.heuristic_table(self.graph, 7, metric)
+                self.assertEquals(len(table), len(self.graph))
+                for node in xrange(0, len(self.graph), 13):
+                    self.assertAlmostEquals(table[node], expected(node), places=6)
+        self.assertRaises(ValueError, kernels.heuristic_table, self.graph, 7, heuristics.ALT)
+
+
+class TestKernels(unittest.TestCase):
+    def setUp(self):
+        self.graph = benchmark.geometric_graph(2000, seed=4)
+        self.pairs = [(self.graph.index_of(s), self.graph.index_of(t))
+                      for s, t in benchmark.query_pairs(self.graph, 20, seed=1)]
+
+    def test_astar_matches_scalar_search(self):
+        workspace = search.SearchWorkspace(len(self.graph))
+        for source, target in self.pairs:
+            table = kernels.heuristic_table(self.graph, target)
+            expected = search.astar(self.graph, source, target, heuristics.make_compact_heuristic(self.graph, target))
+            costs, parents, nodes_assessed = kernels.astar(self.graph, source, target, table, None, workspace)
+            self.assertAlmostEquals(costs[target], expected[0][target])
+            self.assertEquals(nodes_assessed, expected[2])
+            self.assertEquals(search.path_to(self.graph, parents, source, target),
+                              search.path_to(self.graph, expected[1], source, target))
+
+    def test_follows_weight_updates(self):
+        directory = tempfile.mkdtemp()
+        try:
+            graph = snapshot.load_snapshot(snapshot.write_snapshot(
+                compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS), os.path.join(directory, 'grid.graph')))
+            workspace = search.SearchWorkspace(len(graph))
+            table = kernels.heuristic_table(graph, 1)
+            self.assertAlmostEquals(kernels.astar(graph, 0, 1, table, workspace=workspace)[0][1], 0.001)
+            updates.apply_updates(graph, [(0, 1, 1.0)])
+            self.assertAlmostEquals(kernels.astar(graph, 0, 1, table, workspace=workspace)[0][1], 0.003)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestBackend(unittest.TestCase):
+    def setUp(self):
+        self.numpy = kernels.numpy
+        self.backend = kernels.get_backend()
+        self.graph = benchmark.grid_graph(400)
+
+    def tearDown(self):
+        kernels.numpy = self.numpy
+        kernels.set_backend(self.backend)
+
+    def test_switch(self):
+        self.assertRaises(ValueError, kernels.set_backend, 'fortran')
+        kernels.set_backend(kernels.NUMPY)
+        self.assertEquals(kernels.get_backend(), kernels.NUMPY)
+        kernels.numpy = None
+        self.assertEquals(kernels.get_backend(), kernels.PYTHON)
+
+    def test_environment(self):
+        previous = os.environ.get('ROUTING_KERNELS')
+        try:
+            for value, expected in (('numpy', kernels.NUMPY), ('fortran', kernels.PYTHON), ('', kernels.PYTHON)):
+                os.environ['ROUTING_KERNELS'] = value
+                kernels._backend = None
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    self.assertEquals(kernels.get_backend(), expected)
+                self.assertEquals(len(caught), 1 if value == 'fortran' else 0)
+        finally:
+            if previous is None:
+                del os.environ['ROUTING_KERNELS']
+            else:
+                os.environ['ROUTING_KERNELS'] = previous
+
+    def test_session_backends_agree(self):
+        routing = session.RoutingSession(self.graph)
+        pairs = benchmark.query_pairs(self.graph, 10, seed=3)
+        answers = {}
+        for backend in kernels.BACKENDS:
+            kernels.set_backend(backend)
+            for reuse in (True, False):
+                routing.reuse_workspace = reuse
+                answers[backend, reuse] = [(routing.dijkstra(s, [t]).costs[t], routing.astar(s, [t]).paths[t])
+                                           for s, t in pairs]
+        expected = answers[kernels.PYTHON, True]
+        for answer in answers.values():
+            for (cost, path), (expected_cost, expected_path) in zip(answer, expected):
+                self.assertAlmostEquals(cost, expected_cost)
+                self.assertEquals(path[0], expected_path[0])
+                self.assertEquals(path[-1], expected_path[-1])
+
+    def test_heuristic_table_in_metrics(self):
+        kernels.set_backend(kernels.NUMPY)
+        query_metrics = metrics.QueryMetrics('astar', run_id='run')
+        routing = session.RoutingSession(self.graph)
+        routing.astar(self.graph.ids[0], [self.graph.ids[399]], query_metrics=query_metrics)
+        self.assertEquals(query_metrics.counters['heuristic_calls'], len(self.graph))
+        self.assertTrue(query_metrics.phases[metrics.SEARCH] >= query_metrics.phases[metrics.HEURISTIC] > 0)
+
+    def test_kernel_lengths_report(self):
+        report = benchmark.kernel_lengths(self.graph, hops=(5,), queries=5, verbose=False)
+        self.assertEquals(sorted(report.keys()), ['5', 'random'])
+        for trips in report.values():
+            self.assertEquals(trips['astar-python']['nodes_assessed_total'],
+                              trips['astar-numpy']['nodes_assessed_total'])
+            self.assertTrue(trips['heuristic_table_ms'] > 0)
+        self.assertEquals(kernels.get_backend(), self.backend)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import src.compact_graph as compact_graph
+import src.heuristics as heuristics
+import src.landmarks as landmarks
+import src.search as search
+import src.session as session
+import src.snapshot as snapshot
+from test.contraction_test import random_graph
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+class TestLandmarks(unittest.TestCase):
+    def setUp(self):
+        self.graph = random_graph(300, 11)
+        self.landmarks = landmarks.select_landmarks(self.graph, 4, verbose=False)
+
+    def test_float32_distances(self):
+        self.assertEquals(len(self.landmarks), 4)
+        self.assertEquals(self.landmarks.distances.itemsize, 4)
+        self.assertEquals(len(self.landmarks.distances), 4 * len(self.graph))
+        self.assertEquals(len(set(self.landmarks.indices)), 4)
+
+    def test_lower_bound(self):
+        rng = random.Random(1)
+        for query in xrange(20):
+            target = rng.randrange(len(self.graph))
+            costs, parents, nodes_assessed = search.dijkstra(self.graph, target, [])
+            heuristic = self.landmarks.make_heuristic(target)
+            for v in xrange(len(self.graph)):
+                self.assertTrue(heuristic(v) <= costs[v])
+
+    def test_alt_astar_matches_dijkstra(self):
+        routing = session.RoutingSession(self.graph, landmarks=self.landmarks)
+        rng = random.Random(2)
+        for query in xrange(30):
+            source, destination = rng.sample(xrange(len(self.graph)), 2)
+            expected = routing.dijkstra(source, [destination])
+            for mode in (search.UNIDIRECTIONAL, search.BIDIRECTIONAL):
+                result = routing.astar(source, [destination], heuristics.ALT, mode)
+                self.assertAlmostEquals(result.costs[destination], expected.costs[destination])
+            self.assertTrue(routing.astar(source, [destination], heuristics.ALT).nodes_assessed <=
+                            expected.nodes_assessed)
+
+    def test_rounding_slack_without_numpy(self):
+        module_numpy = landmarks.numpy
+        try:
+            landmarks.numpy = None
+            slack = landmarks.rounding_slack(self.landmarks.distances, len(self.graph), 4)
+        finally:
+            landmarks.numpy = module_numpy
+        self.assertEquals(slack, self.landmarks.slack)
+        self.assertTrue(all(value > 0 for value in slack))
+
+    def test_needs_landmarks(self):
+        routing = session.RoutingSession(compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS))
+        self.assertRaises(ValueError, routing.astar, 0, [15], heuristics.ALT)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = landmarks.write_landmarks(self.landmarks, os.path.join(directory, 'test.landmarks'))
+            loaded = landmarks.load_landmarks(self.graph, path)
+            self.assertEquals(list(loaded.indices), list(self.landmarks.indices))
+            self.assertEquals(list(loaded.distances), list(self.landmarks.distances))
+            self.assertAlmostEquals(loaded.lower_bound(0, 1), self.landmarks.lower_bound(0, 1))
+            self.assertEquals(loaded.slack, self.landmarks.slack)
+            self.graph.fingerprint = (1, 2, 3, 4)
+            self.assertRaises(snapshot.SnapshotError, landmarks.load_landmarks, self.graph, path)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
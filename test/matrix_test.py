@@ -0,0 +1,38 @@
+import unittest
+import numpy
+import src.compact_graph as compact_graph
+import src.matrix as matrix
+import src.session as session
+from test.session_test import VERTICES, EDGES, LONS, LATS
+
+
+class TestDistanceMatrix(unittest.TestCase):
+    def setUp(self):
+        # Vertex 16 has no roads, so it is unreachable from everything else
+        graph = compact_graph.build_compact_graph(VERTICES + [16], EDGES, LONS + [-104.9], LATS + [39.7])
+        self.session = session.RoutingSession(graph)
+
+    def assert_matches_single_queries(self, sources, targets):
+        costs, paths = matrix.distance_matrix(self.session, sources, targets, with_paths=True)
+        self.assertEquals(costs.shape, (len(sources), len(targets)))
+        for row, source in enumerate(sources):
+            result = self.session.dijkstra(source, targets)
+            for column, target in enumerate(targets):
+                self.assertAlmostEquals(costs[row, column], result.costs[target])
+                path = paths[row][column]
+                self.assertEquals(path[0], source)
+                self.assertEquals(path[-1], target)
+
+    def test_more_targets_than_sources(self):
+        self.assert_matches_single_queries([0, 5], [3, 12, 15, 9, 0])
+
+    def test_more_sources_than_targets(self):
+        self.assert_matches_single_queries([0, 5, 10, 15, 5], [3, 6])
+
+    def test_unreachable(self):
+        costs, paths = matrix.distance_matrix(self.session, [0, 16], [15])
+        self.assertTrue(numpy.isinf(costs[1, 0]))
+        self.assertIsNone(paths)
+
+if __name__ == '__main__':
+    unittest.main()
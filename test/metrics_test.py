@@ -0,0 +1,108 @@
+import csv
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import src.compact_graph as compact_graph
+import src.heuristics as heuristics
+import src.metrics as metrics
+import src.search as search
+import src.session as session
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+class TestSearchStats(unittest.TestCase):
+    def setUp(self):
+        self.graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+
+    def test_full_search_relaxes_every_edge(self):
+        stats = {}
+        search.dijkstra(self.graph, 0, [], stats)
+        self.assertEquals(stats['edge_relaxations'], self.graph.edge_count())
+        self.assertEquals(stats['heap_pops'], stats['heap_pushes'])
+
+    def test_stats_add_up(self):
+        stats = {}
+        search.dijkstra(self.graph, 0, [5], stats)
+        search.dijkstra(self.graph, 0, [5], stats)
+        single = {}
+        search.dijkstra(self.graph, 0, [5], single)
+        self.assertEquals(stats['heap_pushes'], 2 * single['heap_pushes'])
+        self.assertTrue(single['heap_pops'] <= single['heap_pushes'])
+
+    def test_stats_do_not_change_results(self):
+        heuristic = heuristics.make_compact_heuristic(self.graph, 15)
+        self.assertEquals(search.astar(self.graph, 0, 15, heuristic, {}), search.astar(self.graph, 0, 15, heuristic))
+        self.assertEquals(search.bidirectional(self.graph, 0, 15, None, {}), search.bidirectional(self.graph, 0, 15))
+
+
+class TestQueryMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.routing = session.RoutingSession(compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS))
+
+    def tearDown(self):
+        metrics.set_sinks([])
+        metrics.set_profiler(None, None)
+        shutil.rmtree(self.directory)
+
+    def test_disabled_without_sinks(self):
+        metrics.set_sinks([])
+        self.assertIsNone(metrics.start('dijkstra'))
+        with metrics.phase(None, metrics.SEARCH):
+            pass
+
+    def test_session_records_phases_and_counters(self):
+        query_metrics = metrics.QueryMetrics('astar', 0, [15], run_id='test')
+        self.routing.astar(0, [15], query_metrics=query_metrics)
+        self.assertTrue(query_metrics.phases[metrics.SEARCH] > 0)
+        self.assertTrue(query_metrics.counters['heuristic_calls'] > 0)
+        self.assertTrue(query_metrics.counters['heap_pushes'] > 0)
+        self.assertTrue(query_metrics.counters['edge_relaxations'] > 0)
+        for mode in (search.UNIDIRECTIONAL, search.BIDIRECTIONAL):
+            query_metrics = metrics.QueryMetrics('dijkstra', 0, [15], run_id='test')
+            self.routing.dijkstra(0, [15], mode, query_metrics)
+            self.assertTrue(query_metrics.counters['heap_pops'] > 0)
+
+    def test_sinks(self):
+        path = os.path.join(self.directory, 'metrics.csv')
+        stream = StringIO.StringIO()
+        metrics.set_sinks([metrics.LogSink(stream), metrics.CsvSink(path)])
+        for query in xrange(2):
+            query_metrics = metrics.start('dijkstra', 0, [15])
+            self.routing.dijkstra(0, [15], query_metrics=query_metrics)
+            query_metrics.emit()
+        metrics.set_sinks([])
+        self.assertEquals(len(stream.getvalue().splitlines()), 2)
+        with open(path, 'rb') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEquals(len(rows), 2)
+        self.assertTrue(int(rows[0]['heap_pushes']) > 0)
+
+    def test_parse_sinks(self):
+        sinks = metrics.parse_sinks('log,csv:' + os.path.join(self.directory, 'm.csv'))
+        self.assertEquals([type(sink) for sink in sinks], [metrics.LogSink, metrics.CsvSink])
+        self.assertRaises(ValueError, metrics.parse_sinks, 'nowhere')
+        for sink in sinks:
+            sink.close()
+
+    def test_configure_from_environment(self):
+        profiles = os.path.join(self.directory, 'profiles')
+        metrics.configure_from_environment({'ROUTING_METRICS': 'log', 'ROUTING_PROFILE': 'sample:' + profiles})
+        self.assertEquals([type(sink) for sink in metrics._sinks], [metrics.LogSink])
+        self.assertTrue(os.path.isdir(profiles))
+        self.assertRaises(ValueError, metrics.configure_from_environment, {'ROUTING_PROFILE': 'cprofile'})
+        metrics.configure_from_environment({})
+        self.assertEquals(len(metrics._sinks), 1)
+
+    def test_profiles_are_saved(self):
+        for kind, extension in ((metrics.CPROFILE, '.prof'), (metrics.SAMPLE, '.folded')):
+            metrics.set_profiler(kind, self.directory)
+            with metrics.profiled('query'):
+                for repeat in xrange(50):
+                    self.routing.dijkstra(0, [15])
+            self.assertTrue(any(name.endswith(extension) for name in os.listdir(self.directory)))
+
+if __name__ == '__main__':
+    unittest.main()
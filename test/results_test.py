@@ -0,0 +1,88 @@
+import contextlib
+import unittest
+import uuid
+import psycopg2
+import src.database as database
+import src.results as results
+
+GEOM_HEX = '0102000000020000000000000000000000000000000000000000000000000000000000F03F'
+
+
+class FailingCursor(object):
+    '''
+    Cursor of a database that rejects every statement.
+    '''
+
+    class connection(object):
+        encoding = 'UTF8'
+
+    def mogrify(self, template, args):
+        return '()'
+
+    def execute(self, statement):
+        raise psycopg2.Error('database is down')
+
+
+class FailingConnection(object):
+    def cursor(self):
+        return FailingCursor()
+
+
+@contextlib.contextmanager
+def failing_connection():
+    yield FailingConnection()
+
+
+class TestResultWriter(unittest.TestCase):
+    def test_rows_are_buffered(self):
+        writer = results.ResultWriter(results.DIJKSTRAS, batch_size=10, flush_interval=3600, verbose=False)
+        for row in xrange(9):
+            writer.add(GEOM_HEX, 0.5, 'run', 10, 1.0, [2.0])
+        self.assertEquals(len(writer.rows), 9)
+        self.assertEquals(writer.rows_written, 0)
+
+    def test_empty_flush(self):
+        writer = results.ResultWriter(results.ASTAR, verbose=False)
+        self.assertEquals(writer.flush(), 0)
+        self.assertEquals(writer.rows_per_second(), 0.0)
+
+    def test_failed_flush_keeps_rows(self):
+        connection = database.connection
+        database.connection = failing_connection
+        try:
+            writer = results.ResultWriter(results.DIJKSTRAS, batch_size=2, verbose=False, max_failed_flushes=3)
+            for row in xrange(3):
+                writer.add(GEOM_HEX, 0.5, 'run', 10, 1.0, [2.0])  # Flushes at the second and third row
+            self.assertEquals(len(writer.rows), 3)
+            self.assertEquals(writer.failed_flushes, 2)
+            self.assertEquals(writer.rows_written, 0)
+            self.assertRaises(psycopg2.Error, writer.add, GEOM_HEX, 0.5, 'run', 10, 1.0, [2.0])
+            self.assertEquals(len(writer.rows), 4)
+        finally:
+            database.connection = connection
+
+    def test_run_id(self):
+        first = results.run_id()
+        self.assertEquals(results.run_id(), first)
+        self.assertEquals(str(uuid.UUID(first)), first)
+        self.assertNotEquals(results.new_run(), first)
+
+    def test_shared_writer(self):
+        self.assertIs(results.get_writer(results.ASTAR), results.get_writer(results.ASTAR))
+        self.assertIsNot(results.get_writer(results.ASTAR), results.get_writer(results.DIJKSTRAS))
+
+    def test_flush_writes_batch(self):
+        id = str(uuid.uuid4())
+        with results.ResultWriter(results.DIJKSTRAS, batch_size=2, verbose=False) as writer:
+            for row in xrange(5):
+                writer.add(GEOM_HEX, 0.5, id, 10, 1.0, [2.0])
+            self.assertEquals(writer.rows_written, 4)
+        self.assertEquals(writer.rows_written, 5)
+        with database.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT count(*) FROM ' + results.DIJKSTRAS + ' WHERE id = %s', (id,))
+            self.assertEquals(cur.fetchone()[0], 5)
+            cur.execute('DELETE FROM ' + results.DIJKSTRAS + ' WHERE id = %s', (id,))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+from array import array
+import os
+import time
+import unittest
+import src.compact_graph as compact_graph
+import src.geometry as geometry
+import src.runner as runner
+import src.session as session
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+def grid_store():
+    sources = array('d')
+    targets = array('d')
+    offsets = array('i', [0])
+    lons = array('d')
+    lats = array('d')
+    for source, target, length in EDGES:
+        sources.append(source)
+        targets.append(target)
+        lons.extend([LONS[source], LONS[target]])
+        lats.extend([LATS[source], LATS[target]])
+        offsets.append(len(lons))
+    return geometry.EdgeGeometryStore(sources, targets, offsets, lons, lats)
+
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+        session.set_session(session.RoutingSession(graph))
+        geometry.set_store(grid_store())
+        self.route_pair = runner.route_pair
+
+    def tearDown(self):
+        runner.route_pair = self.route_pair
+        session.set_session(None)
+        geometry.set_store(None)
+
+    def test_route_pair(self):
+        route_geom_hex, total_time, nodes_assessed, source, destination, cost, path = runner.route_pair(
+            session.get_session(), runner.ASTAR, 0, 15)
+        self.assertEquals((source, destination), (15, 0))
+        self.assertTrue(nodes_assessed > 0)
+        self.assertTrue(route_geom_hex)
+        self.assertEquals((path[0], path[-1]), (15, 0))
+
+    def test_every_pair_streams_back(self):
+        pairs = [(0, 15), (3, 12), (5, 6), (0, 99)]
+        outcomes = list(runner.run_parallel(pairs, runner.DIJKSTRA, workers=2, timeout=60))
+        self.assertEquals(sorted(outcome[0] for outcome in outcomes), [0, 1, 2, 3])
+        statuses = dict((outcome[0], outcome[3]) for outcome in outcomes)
+        self.assertEquals(statuses, {0: runner.DONE, 1: runner.DONE, 2: runner.DONE, 3: runner.MISSING})
+
+    def test_group_pairs_by_shared_end(self):
+        groups = runner.group_pairs([(0, 15), (3, 0), (5, 6), (0, 12), (6, 9)])
+        self.assertEquals(groups, [(0, [(0, 15), (1, 3), (3, 12)]), (6, [(2, 5), (4, 9)])])
+        self.assertEquals(runner.search_count([(0, 15), (3, 0), (5, 6)], group=True), 2)
+        self.assertEquals(runner.search_count([(0, 15), (3, 0), (5, 6)]), 3)
+        self.assertEquals(runner.search_count([(0, 15), (3, 0)], runner.ASTAR, group=True), 2)
+
+    def test_grouped_routes_match(self):
+        pairs = [(0, 15), (3, 0), (5, 6), (0, 12), (6, 9), (0, 99)]
+        grouped = list(runner.run_parallel(pairs, runner.DIJKSTRA, workers=2, timeout=60, group=True))
+        single = list(runner.run_parallel(pairs, runner.DIJKSTRA, workers=2, timeout=60))
+        self.assertEquals(sorted(outcome[:4] for outcome in grouped), sorted(outcome[:4] for outcome in single))
+        single_routes = dict((outcome[0], outcome[4]) for outcome in single if outcome[3] == runner.DONE)
+        for index, source, destination, status, route in grouped:
+            if status == runner.DONE:
+                self.assertAlmostEquals(route[5], single_routes[index][5])
+                self.assertEquals(route[3:5], single_routes[index][3:5])  # From the larger osm_id
+                self.assertEquals((route[6][0], route[6][-1]), route[3:5])
+                self.assertEquals(route[1:3], (None, None))  # The shared search's timings belong to no pair
+
+    def test_cached_pairs_skip_the_workers(self):
+        route_cache = session.get_session().enable_cache(10)
+        first = list(runner.run_parallel([(0, 15), (3, 12)], runner.DIJKSTRA, workers=2, timeout=60))
+        second = list(runner.run_parallel([(15, 0), (3, 12)], runner.DIJKSTRA, workers=2, timeout=60))
+        self.assertEquals(route_cache.hits, 2)
+        self.assertEquals([outcome[3] for outcome in second], [runner.DONE, runner.DONE])
+        self.assertEquals(dict((outcome[0], outcome[4][0]) for outcome in first),
+                          dict((outcome[0], outcome[4][0]) for outcome in second))
+        self.assertEquals([outcome[4][1:3] for outcome in second], [(None, None), (None, None)])
+
+    def test_uncached_run_searches_every_pair(self):
+        route_cache = session.get_session().enable_cache(10)
+        list(runner.run_parallel([(0, 15), (3, 12)], runner.DIJKSTRA, workers=2, timeout=60))
+        outcomes = list(runner.run_parallel([(15, 0), (3, 12)], runner.DIJKSTRA, workers=2, timeout=60,
+                                            cached=False))
+        self.assertEquals(route_cache.hits, 0)
+        for index, source, destination, status, route in outcomes:
+            self.assertEquals(status, runner.DONE)
+            self.assertTrue(route[2] > 0)
+
+    def test_timeout_replaces_worker(self):
+        def slow_route_pair(routing_session, algorithm, source, destination, mode, metric):
+            if source == 1:
+                time.sleep(60)
+            return self.route_pair(routing_session, algorithm, source, destination, mode, metric)
+        runner.route_pair = slow_route_pair  # Workers are forked, so they see the patched function
+        start = time.time()
+        outcomes = list(runner.run_parallel([(1, 2), (0, 15), (3, 12)], runner.DIJKSTRA, workers=2, timeout=1))
+        self.assertTrue(time.time() - start < 30)
+        statuses = dict((outcome[0], outcome[3]) for outcome in outcomes)
+        self.assertEquals(statuses, {0: runner.TIMED_OUT, 1: runner.DONE, 2: runner.DONE})
+
+    def test_dead_worker_is_replaced(self):
+        def exiting_route_pair(routing_session, algorithm, source, destination, mode, metric):
+            if source == 1:
+                os._exit(1)
+            return self.route_pair(routing_session, algorithm, source, destination, mode, metric)
+        runner.route_pair = exiting_route_pair
+        outcomes = list(runner.run_parallel([(1, 2), (0, 15), (3, 12), (5, 6)], runner.DIJKSTRA, workers=1,
+                                            timeout=60))
+        statuses = dict((outcome[0], outcome[3]) for outcome in outcomes)
+        self.assertEquals(statuses, {0: runner.FAILED, 1: runner.DONE, 2: runner.DONE, 3: runner.DONE})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import src.components as components
+import src.loadtest as loadtest
+import src.service as service
+import src.session as session
+from test.components_test import island_graph
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        graph = island_graph()
+        components.get_components(graph)
+        self.service = service.RoutingService(session.RoutingSession(graph), workers=2)
+        self.server = service.make_server(self.service, port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.client = loadtest.Client(self.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+
+    def test_route(self):
+        status, answer = self.client.request('GET', '/route?source=0&destination=15')
+        self.assertEquals(status, 200)
+        self.assertAlmostEquals(answer['cost'], 0.006)
+        self.assertEquals(answer['path'][0], 0)
+        self.assertEquals(answer['path'][-1], 15)
+        status, answer = self.client.request('POST', '/route', {'source': 0, 'destination': 18})
+        self.assertEquals(status, 200)
+        self.assertIsNone(answer['cost'])
+
+    def test_routes_and_matrix(self):
+        status, answer = self.client.request('POST', '/routes', {'source': 0, 'destinations': [1, 15, 18]})
+        self.assertEquals(status, 200)
+        costs = [route['cost'] for route in answer['routes']]
+        self.assertAlmostEquals(costs[0], 0.001)
+        self.assertAlmostEquals(costs[1], 0.006)
+        self.assertIsNone(costs[2])
+        status, answer = self.client.request('POST', '/matrix', {'sources': [0, 16], 'destinations': [15, 18]})
+        self.assertEquals(status, 200)
+        self.assertAlmostEquals(answer['costs'][0][0], 0.006)
+        self.assertIsNone(answer['costs'][0][1])
+        self.assertIsNone(answer['costs'][1][0])
+        self.assertAlmostEquals(answer['costs'][1][1], 0.002)
+
+    def test_snap(self):
+        status, answer = self.client.request('GET', '/snap?points=-104.90,39.70|-104.898,39.7001')
+        self.assertEquals(status, 200)
+        self.assertEquals([snap['osm_id'] for snap in answer['snaps']], [16, 18])
+        status, answer = self.client.request('POST', '/snap', {'points': [[-104.80, 39.80]]})
+        self.assertEquals(answer['snaps'][0]['osm_id'], 18)
+        self.assertEquals(self.client.request('POST', '/snap', {'points': [[1]]})[0], 400)
+
+    def test_bad_requests(self):
+        self.assertEquals(self.client.request('GET', '/route?source=0&destination=99')[0], 404)
+        self.assertEquals(self.client.request('GET', '/route?source=0&destination=x')[0], 400)
+        self.assertEquals(self.client.request('POST', '/route', {'source': 0})[0], 400)
+        self.assertEquals(self.client.request('GET', '/nowhere')[0], 404)
+        status, answer = self.client.request('GET', '/metrics')
+        self.assertEquals(status, 200)
+        self.assertEquals(answer['endpoints']['route']['errors'], 3)
+        self.assertEquals(self.client.request('GET', '/health')[1]['nodes'], 20)
+
+    def test_load(self):
+        nodes = loadtest.sample_nodes(16, 0, self.url)
+        self.assertEquals(len(nodes), 16)
+        queries = loadtest.make_queries(nodes, 40, loadtest.ROUTES, 3, sources=2)
+        report = loadtest.run_load(queries, 4, self.url)
+        self.assertEquals((report['requests'], report['errors']), (40, 0))
+        self.assertEquals(report['searches'] + report['coalesced'], 40)
+
+
+class TestSearchPool(unittest.TestCase):
+    def setUp(self):
+        self.routing = session.RoutingSession(island_graph())
+
+    def test_queued_requests_share_a_search(self):
+        pool = service.SearchPool(self.routing, workers=0)
+        first = pool.submit(0, [15])
+        second = pool.submit(0, [5])
+        other = pool.submit(16, [18])
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEquals(first.destinations, set([5, 15]))
+        pool.start_worker()
+        result = pool.wait(second, 10)
+        self.assertAlmostEquals(result.costs[15], 0.006)
+        self.assertAlmostEquals(pool.wait(other, 10).costs[18], 0.002)
+        self.assertEquals(pool.stats()['searches'], 2)
+        self.assertEquals(pool.stats()['coalesced'], 1)
+        pool.close()
+
+    def test_dead_process_is_replaced(self):
+        pool = service.SearchPool(self.routing, workers=1)
+        worker = pool.processes[0]
+        self.assertNotEquals(worker.process.pid, os.getpid())
+        worker.process.terminate()
+        worker.process.join()
+        self.assertRaises(service.RequestError, pool.search, 0, [15], 10)
+        self.assertTrue(worker.process.is_alive())
+        self.assertAlmostEquals(pool.search(0, [15], 10).costs[15], 0.006)
+        pool.close()
+
+    def test_full_batch_starts_another(self):
+        pool = service.SearchPool(self.routing, workers=0, max_batch=2)
+        first = pool.submit(0, [1, 2])
+        self.assertIsNot(pool.submit(0, [3]), first)
+
+
+class TestUnixSocket(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'routing.sock')
+        routing_service = service.RoutingService(session.RoutingSession(island_graph()), workers=1)
+        server = service.make_server(routing_service, socket_path=path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        client = loadtest.Client(socket_path=path)
+        try:
+            status, answer = client.request('POST', '/route', {'source': 16, 'destination': 18})
+            self.assertEquals(status, 200)
+            self.assertEquals(answer['path'], [16, 17, 18])
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            routing_service.close()
+
+if __name__ == '__main__':
+    unittest.main()
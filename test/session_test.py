@@ -0,0 +1,131 @@
+import math
+import random
+import threading
+import unittest
+import src.compact_graph as compact_graph
+import src.heuristics as heuristics
+import src.search as search
+import src.session as session
+
+# A 4x4 grid of vertices 0.001 degrees apart, with one slow diagonal
+VERTICES = range(16)
+LONS = [-104.99 + (v % 4) * 0.001 for v in VERTICES]
+LATS = [39.74 + (v / 4) * 0.001 for v in VERTICES]
+EDGES = [(v, v + 1, 0.001) for v in VERTICES if v % 4 != 3] + \
+        [(v, v + 4, 0.001) for v in VERTICES if v < 12] + [(0, 15, 0.01)]
+
+
+class TestRoutingSession(unittest.TestCase):
+    def setUp(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+        self.session = session.RoutingSession(graph)
+
+    def test_dijkstra_many_destinations(self):
+        result = self.session.dijkstra(0, [5, 15, 3])
+        self.assertAlmostEquals(result.costs[15], 0.006)
+        self.assertAlmostEquals(result.costs[3], 0.003)
+        self.assertEquals(result.paths[3], [0.0, 1.0, 2.0, 3.0])
+        self.assertEquals(len(result.paths[15]), 7)
+
+    def test_astar_matches_dijkstra(self):
+        for destination in VERTICES:
+            expected = self.session.dijkstra(0, [destination])
+            result = self.session.astar(0, [destination])
+            self.assertAlmostEquals(result.costs[destination], expected.costs[destination])
+            self.assertTrue(result.nodes_assessed <= expected.nodes_assessed)
+
+    def test_astar_answers_every_destination(self):
+        result = self.session.astar(0, [1, 2, 3, 4])
+        self.assertEquals(sorted(result.paths.keys()), [1, 2, 3, 4])
+
+    def test_parents_walk_back_to_source(self):
+        result = self.session.dijkstra(0, [15])
+        parents = result.parents
+        node = 15
+        steps = 0
+        while node != 0:
+            node = parents[node]
+            steps = steps + 1
+        self.assertEquals(steps, 6)
+
+    def test_bidirectional_modes(self):
+        for destination in VERTICES:
+            expected = self.session.dijkstra(0, [destination])
+            for result in (self.session.dijkstra(0, [destination], search.BIDIRECTIONAL),
+                           self.session.astar(0, [destination], mode=search.BIDIRECTIONAL)):
+                self.assertAlmostEquals(result.costs[destination], expected.costs[destination])
+                self.assertEquals(result.paths[destination][0], 0)
+                self.assertEquals(result.paths[destination][-1], destination)
+                forward, backward = result.nodes_assessed_by_direction
+                self.assertEquals(forward + backward, result.nodes_assessed)
+
+    def test_bidirectional_on_random_graph(self):
+        rng = random.Random(7)
+        count = 300
+        lons = [rng.random() for v in xrange(count)]
+        lats = [rng.random() for v in xrange(count)]
+        edges = []
+        for v in xrange(count):
+            for u in rng.sample(xrange(count), 3):
+                straight = math.hypot(lons[u] - lons[v], lats[u] - lats[v])
+                edges.append((v, u, straight * (1 + rng.random())))
+        routing = session.RoutingSession(compact_graph.build_compact_graph(range(count), edges, lons, lats))
+        for query in xrange(30):
+            source, destination = rng.sample(xrange(count), 2)
+            expected = routing.dijkstra(source, [destination]).costs[destination]
+            for result in (routing.dijkstra(source, [destination], search.BIDIRECTIONAL),
+                           routing.astar(source, [destination]),
+                           routing.astar(source, [destination], mode=search.BIDIRECTIONAL),
+                           routing.astar(source, [destination], heuristics.HAVERSINE),
+                           routing.astar(source, [destination], heuristics.HAVERSINE, search.BIDIRECTIONAL)):
+                self.assertAlmostEquals(result.costs[destination], expected)
+                path = result.paths[destination]
+                length = sum(dict(routing.graph.neighbors(routing.graph.index_of(path[i])))[routing.graph.index_of(path[i + 1])]
+                             for i in xrange(len(path) - 1))
+                self.assertAlmostEquals(length, expected)
+
+
+class TestSearchWorkspace(unittest.TestCase):
+    def setUp(self):
+        self.graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+
+    def test_reused_workspace_matches_fresh_arrays(self):
+        workspace = search.SearchWorkspace(len(self.graph))
+        workspaces = (search.SearchWorkspace(len(self.graph)), search.SearchWorkspace(len(self.graph)))
+        rng = random.Random(3)
+        for query in xrange(40):
+            source, target = rng.randrange(16), rng.randrange(16)
+            expected = search.dijkstra(self.graph, source, [target])
+            result = search.dijkstra(self.graph, source, [target], None, workspace)
+            self.assertEquals(result[0][target], expected[0][target])
+            self.assertEquals(search.path_to(self.graph, result[1], source, target),
+                              search.path_to(self.graph, expected[1], source, target))
+            self.assertEquals(search.bidirectional(self.graph, source, target, None, None, workspaces),
+                              search.bidirectional(self.graph, source, target))
+
+    def test_reset_clears_only_what_was_touched(self):
+        workspace = search.SearchWorkspace(len(self.graph))
+        costs, parents, assessed = search.dijkstra(self.graph, 0, [1], None, workspace)
+        touched = set(workspace.touched)
+        self.assertTrue(0 < len(touched) < len(self.graph))
+        self.assertEquals(set(i for i in xrange(len(self.graph)) if costs[i] != search.INFINITY), touched)
+        workspace.reset()
+        self.assertEquals(costs, [search.INFINITY] * len(self.graph))
+        self.assertEquals(parents, [search.NO_PARENT] * len(self.graph))
+        self.assertEquals(workspace.settled_nodes(), [])
+        self.assertRaises(ValueError, search.dijkstra, self.graph, 0, [1], None, search.SearchWorkspace(3))
+
+    def test_each_thread_gets_its_own(self):
+        routing = session.RoutingSession(self.graph)
+        routing.dijkstra(0, [15])
+        workspaces = []
+        thread = threading.Thread(target=lambda: workspaces.append(routing._workspaces()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(workspaces[0][0], routing._workspaces()[0])
+        routing.reuse_workspace = False
+        self.assertEquals(routing._workspaces(), (None, None))
+        self.assertAlmostEquals(routing.dijkstra(0, [15]).costs[15], 0.006)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+import src.compact_graph as compact_graph
+import src.search as search
+import src.snapshot as snapshot
+
+VERTICES = [4, 2, 3, 1]
+LONS = [-104.9, -104.8, -104.7, -104.6]
+LATS = [39.4, 39.2, 39.3, 39.1]
+EDGES = [(1, 2, 1.0), (2, 3, 2.0), (1, 3, 4.0), (3, 4, 1.0)]
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.graph')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        graph = compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS)
+        snapshot.write_snapshot(graph, self.path, (4, 11, 4, 22))
+        loaded = snapshot.load_snapshot(self.path)
+        self.assertEquals(list(loaded.ids), [1.0, 2.0, 3.0, 4.0])
+        self.assertEquals(list(loaded.offsets), list(graph.offsets))
+        self.assertEquals(list(loaded.targets), list(graph.targets))
+        self.assertEquals(list(loaded.weights), list(graph.weights))
+        self.assertEquals(loaded.coordinates_of(loaded.index_of(4)), (-104.9, 39.4))
+        self.assertEquals(loaded.fingerprint, (4, 11, 4, 22))
+        self.assertEquals(snapshot.read_header(self.path)['fingerprint'], (4, 11, 4, 22))
+        costs, parents, nodes_assessed = search.dijkstra(loaded, loaded.index_of(1), [loaded.index_of(4)])
+        self.assertEquals(costs[loaded.index_of(4)], 4.0)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write('not a graph' * 20)
+        self.assertRaises(snapshot.SnapshotError, snapshot.load_snapshot, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
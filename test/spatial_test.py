@@ -0,0 +1,86 @@
+import math
+import random
+import unittest
+import src.benchmark as benchmark
+import src.compact_graph as compact_graph
+import src.components as components
+import src.metrics as metrics
+import src.session as session
+import src.spatial as spatial
+from test.components_test import island_graph
+
+
+def brute_force(graph, lon, lat):
+    routable = [i for i in xrange(len(graph)) if graph.offsets[i + 1] > graph.offsets[i]]
+    return min(math.hypot(graph.lons[i] - lon, graph.lats[i] - lat) for i in routable)
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        self.numpy = spatial.numpy
+        self.graph = benchmark.geometric_graph(2000, seed=5)
+        self.index = spatial.build_index(self.graph)
+        rng = random.Random(1)
+        pad = 0.002  # Some points fall outside the grid
+        self.points = [(rng.uniform(min(self.graph.lons) - pad, max(self.graph.lons) + pad),
+                        rng.uniform(min(self.graph.lats) - pad, max(self.graph.lats) + pad)) for k in xrange(300)]
+
+    def tearDown(self):
+        spatial.numpy = self.numpy
+
+    def test_nearest_matches_brute_force(self):
+        for lon, lat in self.points:
+            index, distance = self.index.nearest(lon, lat)
+            self.assertAlmostEquals(distance, brute_force(self.graph, lon, lat), places=12)
+            self.assertAlmostEquals(distance, math.hypot(self.graph.lons[index] - lon, self.graph.lats[index] - lat),
+                                    places=12)
+
+    def test_bulk_matches_single(self):
+        lons = [lon for lon, lat in self.points]
+        lats = [lat for lon, lat in self.points]
+        expected = [self.index.nearest(lon, lat)[1] for lon, lat in self.points]
+        for module_numpy in (spatial.numpy, None):
+            spatial.numpy = module_numpy
+            indices, distances = self.index.nearest_many(lons, lats)
+            self.assertEquals(len(indices), len(self.points))
+            for k in xrange(len(self.points)):
+                self.assertAlmostEquals(distances[k], expected[k], places=12)
+
+    def test_skips_vertices_without_edges(self):
+        graph = island_graph()
+        index = spatial.build_index(graph)
+        self.assertEquals(len(index), 19)
+        snap = index.snap(-104.80, 39.80)  # Exactly on the isolated vertex 19
+        self.assertNotEquals(snap.osm_id, 19)
+        self.assertEquals(snap.osm_id, 18)
+        self.assertTrue(snap.meters > 1000)
+
+    def test_component_restriction(self):
+        graph = island_graph()
+        components.get_components(graph)
+        index = spatial.build_index(graph, component=0)
+        self.assertEquals(len(index), 16)
+        self.assertTrue(index.snap(-104.899, 39.70).osm_id < 16)
+
+    def test_empty_index(self):
+        index = spatial.build_index(compact_graph.build_compact_graph([1, 2], [], [-104.9, -104.8], [39.7, 39.8]))
+        self.assertEquals(len(index), 0)
+        self.assertRaises(ValueError, index.snap, 0.0, 0.0)
+        self.assertRaises(ValueError, index.snap_many, [(0.0, 0.0)])
+
+
+class TestSessionSnap(unittest.TestCase):
+    def test_snap_records_metrics(self):
+        routing = session.RoutingSession(island_graph())
+        snaps = routing.snap([(-104.90, 39.70), (-104.898, 39.7001)])
+        self.assertEquals([snap.osm_id for snap in snaps], [16, 18])
+        self.assertAlmostEquals(snaps[1].distance, 0.0001)
+        self.assertTrue(10 < snaps[1].meters < 12)
+        query_metrics = metrics.QueryMetrics('dijkstra', run_id='run')
+        query_metrics.add_snaps(snaps)
+        self.assertEquals(query_metrics.as_dict()['snap_meters'], snaps[1].meters)
+        self.assertTrue(query_metrics.phases[metrics.SNAP] >= 0)
+        self.assertIsNone(metrics.QueryMetrics('dijkstra', run_id='run').as_dict()['snap_meters'])
+
+if __name__ == '__main__':
+    unittest.main()
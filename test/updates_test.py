@@ -0,0 +1,234 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import src.benchmark as benchmark
+import src.compact_graph as compact_graph
+import src.contraction as contraction
+import src.heuristics as heuristics
+import src.landmarks as landmarks
+import src.search as search
+import src.service as service
+import src.session as session
+import src.snapshot as snapshot
+import src.updates as updates
+from test.session_test import VERTICES, LONS, LATS, EDGES
+
+
+def grid_session():
+    return session.RoutingSession(compact_graph.build_compact_graph(VERTICES, EDGES, LONS, LATS))
+
+
+class TestApplyUpdates(unittest.TestCase):
+    def setUp(self):
+        self.routing = grid_session()
+        self.graph = self.routing.graph
+
+    def test_both_directions_change(self):
+        report = updates.apply_updates(self.graph, [(1, 0, 1.0), (0, 99, 1.0), (2, 3, 0.001)])
+        self.assertEquals((report.applied, report.increased, report.unchanged), (1, 1, 1))
+        self.assertEquals(report.missing, [(0, 99)])
+        forward, backward = updates.edge_positions(self.graph, 0, 1)
+        self.assertEquals((self.graph.weights[forward], self.graph.weights[backward]), (1.0, 1.0))
+        self.assertEquals(self.graph.version, 1)
+        self.assertAlmostEquals(self.routing.dijkstra(0, [1]).costs[1], 0.003)
+        self.assertEquals(updates.apply_updates(self.graph, [(2, 3, 0.001)]).version, 1)
+
+    def test_snapshot_weights_are_copied(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = snapshot.write_snapshot(self.graph, os.path.join(directory, 'grid.graph'))
+            loaded = snapshot.load_snapshot(path)
+            updates.apply_updates(loaded, [(0, 1, 1.0)])
+            self.assertAlmostEquals(search.dijkstra(loaded, 0, [1])[0][1], 0.003)
+            self.assertAlmostEquals(search.dijkstra(snapshot.load_snapshot(path), 0, [1])[0][1], 0.001)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_below_straight_line(self):
+        report = updates.apply_updates(self.graph, [(0, 1, 0.0005), (1, 2, 0.002)])
+        self.assertEquals((report.increased, report.decreased, report.below_straight_line), (1, 1, 1))
+        self.assertEquals(self.graph.below_straight_line, set([(0, 1)]))
+        updates.apply_updates(self.graph, [(0, 1, 0.001)])
+        self.assertEquals(self.graph.below_straight_line, set())
+
+    def test_straight_line_astar_falls_back_to_dijkstra(self):
+        self.assertIsNone(self.routing.astar(0, [15]).fallback)
+        updates.apply_updates(self.graph, [(0, 1, 0.0001), (1, 2, 0.0001), (2, 3, 0.0001), (3, 7, 0.0001),
+                                           (7, 11, 0.0001), (11, 15, 0.0001)])
+        for mode in (search.UNIDIRECTIONAL, search.BIDIRECTIONAL):
+            result = self.routing.astar(0, [15], mode=mode)
+            self.assertAlmostEquals(result.costs[15], 0.0006)
+            self.assertEquals(result.paths[15], [0, 1, 2, 3, 7, 11, 15])
+            self.assertEquals(result.fallback, session.DIJKSTRA)
+
+
+class TestRepair(unittest.TestCase):
+    def setUp(self):
+        self.routing = grid_session()
+        self.graph = self.routing.graph
+        self.cache = self.routing.enable_cache()
+        self.routing.dijkstra(0, [1])
+        self.routing.dijkstra(2, [3])
+        self.routing.dijkstra(12, [13])
+
+    def test_increase_drops_routes_over_the_road(self):
+        report = updates.apply_updates(self.graph, [(3, 2, 0.5)], self.routing)
+        self.assertEquals(report.cache_dropped, 1)
+        self.assertIsNotNone(self.cache.get(0, 1))
+        self.assertIsNone(self.cache.get(2, 3))
+        self.assertAlmostEquals(self.routing.dijkstra(2, [3]).costs[3], 0.003)
+
+    def test_decrease_clears_cache(self):
+        report = updates.apply_updates(self.graph, [(10, 11, 0.0005)], self.routing)
+        self.assertEquals(report.cache_dropped, 3)
+        self.assertEquals(len(self.cache), 0)
+
+    def test_missed_version_clears_cache(self):
+        self.graph.version += 1
+        updates.apply_updates(self.graph, [(2, 3, 0.5)], self.routing)
+        self.assertEquals(len(self.cache), 0)
+
+    def assert_alt_matches_dijkstra(self, routing, graph):
+        for source, destination in benchmark.query_pairs(graph, 100, seed=2):
+            expected = routing.dijkstra(source, [destination]).costs[destination]
+            for mode in (search.UNIDIRECTIONAL, search.BIDIRECTIONAL):
+                self.assertAlmostEquals(routing.astar(source, [destination], heuristics.ALT, mode).costs[destination],
+                                        expected)
+
+    def test_increases_keep_landmarks(self):
+        graph = benchmark.grid_graph(900)
+        routing = session.RoutingSession(graph, landmarks=landmarks.select_landmarks(graph, 4, verbose=False))
+        report = updates.apply_updates(graph, updates.random_updates(graph, 200, seed=1, factor=(1.0, 2.0)), routing)
+        self.assertFalse(report.landmarks_dropped)
+        self.assert_alt_matches_dijkstra(routing, graph)
+
+    def test_decrease_drops_landmarks(self):
+        graph = benchmark.grid_graph(900)
+        routing = session.RoutingSession(graph, landmarks=landmarks.select_landmarks(graph, 4, verbose=False))
+        report = updates.apply_updates(graph, updates.random_updates(graph, 2, seed=1, factor=(0.01, 0.05)), routing)
+        self.assertTrue(report.landmarks_dropped)
+        self.assertRaises(ValueError, routing.astar, graph.ids[0], [graph.ids[1]], heuristics.ALT)
+        routing.landmarks = landmarks.select_landmarks(graph, 4, verbose=False)
+        self.assert_alt_matches_dijkstra(routing, graph)
+
+    def test_rebuild_after_decrease(self):
+        graph = benchmark.grid_graph(900)
+        routing = session.RoutingSession(graph, contraction.build_hierarchy(graph, verbose=False),
+                                         landmarks.select_landmarks(graph, 4, verbose=False))
+        rebuilder = updates.Rebuilder(routing, updates.ReadWriteLock())
+        self.assertEquals(rebuilder.rebuild(), [])
+        updates.apply_updates(graph, updates.random_updates(graph, 2, seed=1, factor=(0.01, 0.05)), routing)
+        self.assertEquals(rebuilder.missing(), ['landmarks', 'hierarchy'])
+        self.assertEquals(rebuilder.rebuild(), ['landmarks', 'hierarchy'])
+        self.assertEquals(rebuilder.missing(), [])
+        self.assertIs(routing.landmarks.graph, graph)
+        self.assertIs(routing.hierarchy.graph, graph)
+        self.assert_alt_matches_dijkstra(routing, graph)
+        for source, destination in benchmark.query_pairs(graph, 20, seed=3):
+            self.assertAlmostEquals(routing.dijkstra(source, [destination], search.CONTRACTION).costs[destination],
+                                    routing.dijkstra(source, [destination]).costs[destination])
+
+    def test_hierarchy_dropped(self):
+        self.routing.hierarchy = contraction.build_hierarchy(self.graph, verbose=False)
+        self.assertTrue(updates.apply_updates(self.graph, [(0, 1, 1.0)], self.routing).hierarchy_dropped)
+        self.assertRaises(ValueError, self.routing.dijkstra, 0, [1], search.CONTRACTION)
+
+
+class TestDeltas(unittest.TestCase):
+    def setUp(self):
+        self.routing = grid_session()
+        self.deltas = updates.MemoryDeltas()
+
+    def test_poll_in_batches(self):
+        for k in xrange(3):
+            self.deltas.append(k, k + 1, 0.002)
+        poller = updates.Poller(self.routing, self.deltas, batch_size=2)
+        self.assertEquals([report.applied for report in poller.poll()], [2, 1])
+        self.assertEquals(poller.last_id, 3)
+        self.assertEquals(poller.poll(), [])
+        self.deltas.append(0, 1, 0.5)
+        self.assertEquals(poller.poll()[0].applied, 1)
+        self.assertEquals(self.routing.graph.version, 3)
+
+    def test_notification_wakes_watcher(self):
+        channel = updates.LocalChannel()
+        poller = updates.Poller(self.routing, self.deltas)
+        thread, stop = updates.start_watcher(poller, channel, interval=60)
+        self.deltas.append(0, 1, 1.0)
+        channel.notify()
+        for attempt in xrange(100):
+            if poller.last_id == 1:
+                break
+            threading.Event().wait(0.05)
+        stop.set()
+        channel.close()
+        thread.join(5)
+        self.assertEquals(poller.last_id, 1)
+        self.assertFalse(thread.is_alive())
+
+    def test_service_applies_deltas(self):
+        routing_service = service.RoutingService(self.routing, workers=1)
+        try:
+            channel = updates.LocalChannel()
+            thread, stop = routing_service.watch_updates(self.deltas, channel, interval=60)
+            self.assertAlmostEquals(routing_service.route({'source': 0, 'destination': 1})['cost'], 0.001)
+            self.deltas.append(0, 1, 1.0)
+            channel.notify()
+            for attempt in xrange(100):
+                if routing_service.health({})['graph_version'] == 1:
+                    break
+                threading.Event().wait(0.05)
+            self.assertAlmostEquals(routing_service.route({'source': 0, 'destination': 1})['cost'], 0.003)
+            stop.set()
+            channel.close()
+            thread.join(5)
+        finally:
+            routing_service.close()
+
+    def test_service_rebuilds_dropped_landmarks(self):
+        graph = benchmark.grid_graph(400)
+        routing = session.RoutingSession(graph, landmarks=landmarks.select_landmarks(graph, 4, verbose=False))
+        routing_service = service.RoutingService(routing, workers=1)
+        try:
+            self.assertEquals(routing_service.health({})['status'], 'ok')
+            channel = updates.LocalChannel()
+            thread, stop = routing_service.watch_updates(self.deltas, channel, interval=60)
+            for source_osm, target_osm, length in updates.random_updates(graph, 2, seed=1, factor=(0.01, 0.05)):
+                self.deltas.append(source_osm, target_osm, length)
+            channel.notify()
+            for attempt in xrange(200):
+                if routing_service.rebuilder.rebuilds:
+                    break
+                threading.Event().wait(0.05)
+            health = routing_service.health({})
+            self.assertEquals((health['status'], health['missing'], health['graph_version']), ('ok', [], 1))
+            self.assertIsNotNone(routing.landmarks)
+            routing.landmarks = None  # As a decrease leaves them until the rebuild
+            self.assertEquals(routing_service.health({})['status'], 'degraded')
+            stop.set()
+            channel.close()
+            thread.join(5)
+        finally:
+            routing_service.close()
+
+
+class TestReadWriteLock(unittest.TestCase):
+    def test_update_waits_for_searches(self):
+        lock = updates.ReadWriteLock()
+        order = []
+
+        def update():
+            with lock.exclusive():
+                order.append('update')
+        with lock.shared():
+            writer = threading.Thread(target=update)
+            writer.start()
+            writer.join(0.2)
+            order.append('search')
+        writer.join(5)
+        self.assertEquals(order, ['search', 'update'])
+
+if __name__ == '__main__':
+    unittest.main()